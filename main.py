@@ -1,6 +1,7 @@
 # Import necessary functions from the src.models and src.workflow modules
-from src.models import init_models, start_session
+from src.models import init_models, init_refine_model, start_session
 from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+from src.profiling import Profiler
 
 # Set the API key for authentication with the external service (e.g., OpenAI)
 api_key = "your_api_key_here"  # Replace with your actual API key
@@ -15,27 +16,40 @@ model_generate_new, model_re_generate, model_verify, model_integrate = init_mode
 # Define the root concept for which the taxonomy will be created
 concept = "Transistor"
 
-# Create the initial taxonomy structure for the given concept using the generation and verification models
-taxonomy = create_taxonomy(model_generate_new, model_verify, concept, log)
+# Profiling: per-phase wall and CPU times; with a sample interval (seconds), also collapsed stacks per phase
+profiling = {"enabled": False, "sample_interval": None, "collapsed_path": "data/profiles"}
 
-# Set the maximum depth to which the taxonomy will be expanded
-stop_at_depth = 3
+with Profiler.from_config(profiling) as profiler:
+    # Create the initial taxonomy structure for the given concept using the generation and verification models
+    taxonomy = create_taxonomy(model_generate_new, model_verify, concept, log)
 
-# Set the maximum number of subconcepts to generate per iteration
-max_subconcepts_per_iteration = 15
+    # Set the maximum depth to which the taxonomy will be expanded
+    stop_at_depth = 3
 
-# Expand the taxonomy by generating subconcepts for all ranks up to the specified depth and limit
-taxonomy = generate_subconcepts_for_all_ranks(
-    model_generate_new, 
-    model_re_generate, 
-    taxonomy, 
-    stop_at_depth, 
-    max_subconcepts_per_iteration, 
-    log
-)
+    # Set the maximum number of subconcepts to generate per iteration
+    max_subconcepts_per_iteration = 15
 
-# Integrate the generated subconcepts into the taxonomy using the integration model
-taxonomy = integrate_subconcepts(model_integrate, taxonomy, log)
+    # Choose how generated subconcepts are refined: "two_call" (discard + postprocess) or "structured" (one JSON call)
+    refine_mode = "two_call"
+    model_refine = init_refine_model(log) if refine_mode == "structured" else None
+
+    # Expand the taxonomy by generating subconcepts for all ranks up to the specified depth and limit
+    taxonomy = generate_subconcepts_for_all_ranks(
+        model_generate_new, 
+        model_re_generate, 
+        taxonomy, 
+        stop_at_depth, 
+        max_subconcepts_per_iteration, 
+        log,
+        refine_mode,
+        model_refine
+    )
+
+    # Integrate the generated subconcepts into the taxonomy using the integration model
+    taxonomy = integrate_subconcepts(model_integrate, taxonomy, log)
+
+if profiling["enabled"]:
+    log.info(f"Profile:\n{profiler.report()}")
 
 # Log the final taxonomy structure using the info method of the taxonomy object
 log.info(f"Final Taxonomy: {taxonomy.info()}")
\ No newline at end of file
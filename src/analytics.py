@@ -0,0 +1,220 @@
+import numpy as np
+
+from src.models import Taxonomy
+from src.repository import normalize_label, tree_nodes_and_edges
+
+class TreeCorpus:
+    """
+    Subconcept trees of many taxonomies flattened into NumPy arrays, one row per node:
+    tree ID, parent index (global row, -1 for roots), depth (-1 if unreachable from a root) and label ID.
+    Every (taxonomy, rank list) pair is one tree; labels are normalized and share IDs across all taxonomies,
+    so the statistics below are computed with vectorized counts instead of dict walks.
+    """
+    def __init__(self) -> None:
+        # Label vocabulary shared by all trees (normalized label -> ID, and the first spelling seen)
+        self.label_ids          = {}
+        self.labels             = []
+        # Per taxonomy: name and root concept
+        self.taxonomy_names     = []
+        self.root_concepts      = []
+        # Per tree: taxonomy index and rank list index
+        self.tree_taxonomy      = []
+        self.tree_rank_list     = []
+        # Per-tree node arrays, concatenated lazily by arrays()
+        self._parts             = []
+        self._arrays            = None
+
+    def label_id(self, label:str) -> int:
+        """
+        Return the ID of a (normalized) label, adding it to the vocabulary if needed.
+        """
+        key = normalize_label(label)
+        if key not in self.label_ids:
+            self.label_ids[key] = len(self.labels)
+            self.labels.append(str(label))
+        return self.label_ids[key]
+
+    def add(self, taxonomy:Taxonomy) -> int:
+        """
+        Flatten the subconcept trees of a taxonomy into the corpus. Returns the taxonomy index.
+        """
+        taxonomy_index = len(self.taxonomy_names)
+        self.taxonomy_names.append(taxonomy.name)
+        self.root_concepts.append(taxonomy.root_concept)
+        for rank_list, tree in enumerate(taxonomy.subconcepts_trees):
+            nodes, edges = tree_nodes_and_edges(tree)
+            parent = np.full(len(nodes), -1, dtype=np.int64)
+            if edges:
+                edges = np.asarray(edges, dtype=np.int64)
+                # Keep the first parent of every child (trees with shared children become forests)
+                children, first = np.unique(edges[:, 1], return_index=True)
+                parent[children] = edges[first, 0]
+            depth = np.array([-1 if node[2] is None else node[2] for node in nodes], dtype=np.int32)
+            label = np.array([self.label_id(node[1]) for node in nodes], dtype=np.int64)
+            self.tree_taxonomy.append(taxonomy_index)
+            self.tree_rank_list.append(rank_list)
+            self._parts.append((parent, depth, label))
+        self._arrays = None
+        return taxonomy_index
+
+    @classmethod
+    def from_taxonomies(cls, taxonomies) -> 'TreeCorpus':
+        """
+        Build a corpus from Taxonomy objects.
+        """
+        corpus = cls()
+        for taxonomy in taxonomies:
+            corpus.add(taxonomy)
+        return corpus
+
+    @classmethod
+    def from_files(cls, file_paths, repository = None) -> 'TreeCorpus':
+        """
+        Build a corpus from saved taxonomies, reading only their metadata and trees sections.
+        With a TaxonomyRepository, file_paths are taxonomy names.
+        """
+        corpus = cls()
+        for file_path in file_paths:
+            corpus.add(Taxonomy.load(file_path, sections=['metadata', 'trees'], repository=repository))
+        return corpus
+
+    def arrays(self) -> dict:
+        """
+        Return the concatenated node arrays: 'tree', 'parent' (global row index, -1 for roots), 'depth' and 'label',
+        plus the per-tree arrays 'tree_taxonomy' and 'tree_rank_list'.
+        """
+        if self._arrays is None:
+            sizes = np.array([len(part[0]) for part in self._parts], dtype=np.int64)
+            offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])) if len(sizes) else np.zeros(0, dtype=np.int64)
+            tree = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+            if self._parts:
+                parent = np.concatenate([part[0] for part in self._parts])
+                depth = np.concatenate([part[1] for part in self._parts])
+                label = np.concatenate([part[2] for part in self._parts])
+            else:
+                parent, depth, label = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+            # Shift tree-local parent indices to global rows
+            parent = np.where(parent >= 0, parent + offsets[tree], -1)
+            self._arrays = {
+                'tree': tree,
+                'parent': parent,
+                'depth': depth,
+                'label': label,
+                'tree_taxonomy': np.array(self.tree_taxonomy, dtype=np.int64),
+                'tree_rank_list': np.array(self.tree_rank_list, dtype=np.int64)
+            }
+        return self._arrays
+
+    def child_counts(self) -> np.ndarray:
+        """
+        Number of children of every node.
+        """
+        arrays = self.arrays()
+        parent = arrays['parent']
+        return np.bincount(parent[parent >= 0], minlength=len(parent))
+
+    def node_counts(self) -> np.ndarray:
+        """
+        Number of nodes per tree.
+        """
+        return np.bincount(self.arrays()['tree'], minlength=len(self.tree_taxonomy))
+
+    def breadth_per_depth(self) -> np.ndarray:
+        """
+        Number of nodes at every depth of every tree, as a (trees x max depth + 1) matrix.
+        """
+        arrays = self.arrays()
+        reachable = arrays['depth'] >= 0
+        width = int(arrays['depth'].max()) + 1 if reachable.any() else 1
+        keys = arrays['tree'][reachable] * width + arrays['depth'][reachable]
+        return np.bincount(keys, minlength=len(self.tree_taxonomy) * width).reshape(len(self.tree_taxonomy), width)
+
+    def leaf_counts(self) -> np.ndarray:
+        """
+        Number of leaves (nodes without children) per tree.
+        """
+        return np.bincount(self.arrays()['tree'], weights=self.child_counts() == 0, minlength=len(self.tree_taxonomy)).astype(np.int64)
+
+    def branching_factors(self) -> np.ndarray:
+        """
+        Mean number of children of the inner nodes of every tree (0 for trees without inner nodes).
+        """
+        tree = self.arrays()['tree']
+        children = self.child_counts()
+        edges = np.bincount(tree, weights=children, minlength=len(self.tree_taxonomy))
+        inner = np.bincount(tree, weights=children > 0, minlength=len(self.tree_taxonomy))
+        return np.divide(edges, inner, out=np.zeros(len(self.tree_taxonomy)), where=inner > 0)
+
+    def max_depths(self) -> np.ndarray:
+        """
+        Deepest level of every tree (-1 for empty trees).
+        """
+        depths = np.full(len(self.tree_taxonomy), -1, dtype=np.int64)
+        arrays = self.arrays()
+        np.maximum.at(depths, arrays['tree'], arrays['depth'])
+        return depths
+
+    def _tree_labels(self) -> tuple:
+        # Distinct (tree, label) pairs
+        labels = max(len(self.labels), 1)
+        pairs = np.unique(self.arrays()['tree'] * labels + self.arrays()['label'])
+        return pairs // labels, pairs % labels
+
+    def duplicate_labels(self) -> dict:
+        """
+        Labels that occur in the trees of more than one rank list of the same taxonomy.
+
+        Returns:
+            dict: Taxonomy name -> {label: number of rank lists containing it}, most frequent first.
+        """
+        tree, label = self._tree_labels()
+        labels = max(len(self.labels), 1)
+        taxonomy = self.arrays()['tree_taxonomy'][tree]
+        keys, counts = np.unique(taxonomy * labels + label, return_counts=True)
+        keys, counts = keys[counts > 1], counts[counts > 1]
+        duplicates = {name: {} for name in self.taxonomy_names}
+        for index in np.argsort(-counts, kind='stable'):
+            duplicates[self.taxonomy_names[keys[index] // labels]][self.labels[keys[index] % labels]] = int(counts[index])
+        return duplicates
+
+    def rank_list_overlaps(self) -> list:
+        """
+        Jaccard similarity between the label sets of the rank list trees of every taxonomy.
+
+        Returns:
+            list: One (rank lists x rank lists) matrix per taxonomy, in corpus order.
+        """
+        tree_taxonomy = self.arrays()['tree_taxonomy']
+        tree, label = self._tree_labels()
+        # Trees of a taxonomy are contiguous, so the sorted (tree, label) pairs are sliced per taxonomy
+        tree_bounds = np.searchsorted(tree_taxonomy, np.arange(len(self.taxonomy_names) + 1))
+        pair_bounds = np.searchsorted(tree, tree_bounds)
+        overlaps = []
+        for index in range(len(self.taxonomy_names)):
+            first, last = pair_bounds[index], pair_bounds[index + 1]
+            rows = tree[first:last] - tree_bounds[index]
+            _, columns = np.unique(label[first:last], return_inverse=True)
+            incidence = np.zeros((tree_bounds[index + 1] - tree_bounds[index], int(columns.max()) + 1 if len(columns) else 0), dtype=np.int64)
+            incidence[rows, columns] = 1
+            intersection = incidence @ incidence.T
+            sizes = incidence.sum(axis=1)
+            union = sizes[:, None] + sizes[None, :] - intersection
+            overlaps.append(np.divide(intersection, union, out=np.zeros(intersection.shape), where=union > 0))
+        return overlaps
+
+    def tree_stats(self) -> list:
+        """
+        Statistics of every tree: taxonomy, rank list, nodes, leaves, maximum depth, branching factor and breadth per depth.
+        """
+        breadth = self.breadth_per_depth()
+        nodes, leaves = self.node_counts(), self.leaf_counts()
+        branching, depths = self.branching_factors(), self.max_depths()
+        return [{
+            'taxonomy': self.taxonomy_names[self.tree_taxonomy[i]],
+            'rank_list': self.tree_rank_list[i],
+            'nodes': int(nodes[i]),
+            'leaves': int(leaves[i]),
+            'max_depth': int(depths[i]),
+            'branching_factor': float(branching[i]),
+            'breadth_per_depth': breadth[i, :depths[i] + 1].tolist()
+        } for i in range(len(self.tree_taxonomy))]
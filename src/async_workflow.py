@@ -0,0 +1,237 @@
+import time
+import asyncio
+import logging
+from src.dag import arun_steps
+from src.models import Taxonomy
+from src.profiling import Phase
+from src.workflow import taxonomy_steps, subconcept_calls, integrate_prompt, store_integrated
+
+# Async counterparts of the functions in src/workflow.py, built on ainvoke.
+# They run the same step graphs and call generators as the synchronous versions, so both produce
+# identical taxonomies. Every function accepts call_timeout (seconds per model call, raising
+# asyncio.TimeoutError) and saves the taxonomy when it is cancelled, so a cancelled run can be
+# resumed later with the same function or with expand_taxonomy. Several taxonomies can be built
+# concurrently on one event loop with the same model objects, which share one async HTTP client.
+
+async def ainvoke_and_record(model, taxonomy: Taxonomy, template_id: str, prompt, timeout = None, **kwargs):
+    """
+    Async counterpart of invoke_and_record.
+
+    Args:
+        model: Model (or structured-output runnable) to invoke.
+        taxonomy (Taxonomy): The taxonomy the response record is appended to.
+        template_id (str): Key of the chat template the prompt was formatted from.
+        prompt: Formatted prompt messages.
+        timeout (float, optional): Timeout in seconds for the call.
+        **kwargs: Extra invocation parameters (e.g. max_tokens).
+
+    Returns:
+        The raw model output; the recorded content is available as taxonomy.responses[-1].
+    """
+    start_time = time.perf_counter()
+    with Phase('invoke'):
+        response = await asyncio.wait_for(model.ainvoke(prompt, **kwargs), timeout)
+    taxonomy.record_response(template_id, response, time.perf_counter() - start_time, prompt)
+    return response
+
+async def arun_calls(calls, taxonomy: Taxonomy, timeout = None):
+    """
+    Drive a call generator (e.g. subconcept_calls) on the event loop: await and record every
+    model call it yields, send the output back and return the generator's result.
+    """
+    response = None
+    while True:
+        try:
+            model, template_id, prompt, kwargs = calls.send(response)
+        except StopIteration as stop:
+            return stop.value
+        response = await ainvoke_and_record(model, taxonomy, template_id, prompt, timeout, **kwargs)
+
+def save_cancelled(taxonomy: Taxonomy, log) -> None:
+    """
+    Save the committed state of a taxonomy whose run was cancelled.
+    """
+    log.info(f"run cancelled, saving taxonomy {taxonomy.name} at depths {taxonomy.depths}\n")
+    taxonomy.save()
+
+@Phase('create_taxonomy')
+async def acreate_taxonomy(model_generate_new, model_verify, concept = "Transistor", log = None, max_concurrency = 4, call_timeout = None, save_path = None,
+                           criteria_batch_size = None, model_score = None):
+    """
+    Async counterpart of create_taxonomy.
+
+    Args:
+        model_generate_new: Model used to generate new information.
+        model_verify: Model used to verify and filter generated information.
+        concept (str): The root concept for the taxonomy.
+        log (logging.Logger, optional): Logger for info/debug output.
+        max_concurrency (int): Maximum number of concurrent model calls of this taxonomy.
+        call_timeout (float, optional): Timeout in seconds for each model call.
+        save_path (str, optional): Directory the taxonomy is saved to (data/taxonomies by default).
+        criteria_batch_size (int, optional): Verify the criteria lists in concurrent groups of this size (see taxonomy_steps).
+        model_score (optional): Structured-output model for the criteria groups (see init_role_model('score')).
+
+    Returns:
+        Taxonomy: The constructed and initialized taxonomy object.
+    """
+    if not log:
+        log = logging.getLogger("acreate_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+
+    res = Taxonomy(concept, save_path)
+    try:
+        await arun_steps(taxonomy_steps(res, model_generate_new, model_verify, log, criteria_batch_size, model_score), max_concurrency, call_timeout)
+    except asyncio.CancelledError:
+        save_cancelled(res, log)
+        raise
+    return res
+
+@Phase('generate_subconcepts')
+async def agenerate_subconcepts(
+    model_generate_new,
+    model_re_generate,
+    taxonomy: Taxonomy,
+    ranks_list_num: int,
+    stop_at_depth: int = None,
+    max_subconcepts_per_iteration: int = 15,
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None,
+    call_timeout = None
+):
+    """
+    Async counterpart of generate_subconcepts. On cancellation only fully generated depths are kept,
+    so a later run resumes at the first unfinished depth.
+    """
+    if not log:
+        log = logging.getLogger("agenerate_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    calls = subconcept_calls(
+        model_generate_new,
+        model_re_generate,
+        taxonomy,
+        ranks_list_num,
+        stop_at_depth,
+        max_subconcepts_per_iteration,
+        log,
+        refine_mode,
+        model_refine
+    )
+    taxonomy.pin_rank_list(ranks_list_num)
+    try:
+        return await arun_calls(calls, taxonomy, call_timeout)
+    except asyncio.CancelledError:
+        save_cancelled(taxonomy, log)
+        raise
+    finally:
+        taxonomy.release_rank_list(ranks_list_num)
+
+async def agenerate_subconcepts_for_all_ranks(
+    model_generate_new,
+    model_re_generate,
+    taxonomy: Taxonomy,
+    stop_at_depth: int = None,
+    max_subconcepts_per_iteration: int = 15,
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None,
+    max_concurrency: int = 1,
+    call_timeout = None
+):
+    """
+    Async counterpart of generate_subconcepts_for_all_ranks.
+    Rank lists are independent, so up to max_concurrency of them are generated concurrently
+    (their response records interleave; with the default of 1 the order matches the synchronous run).
+
+    Args:
+        model_generate_new: Model used to generate new concepts.
+        model_re_generate: Model used to refine and filter concepts.
+        taxonomy (Taxonomy): The taxonomy object to expand.
+        stop_at_depth (int, optional): Maximum depth to generate subconcepts for each rank.
+        max_subconcepts_per_iteration (int): Maximum number of subconcepts to generate per iteration.
+        log (logging.Logger, optional): Logger for info/debug output.
+        refine_mode (str): Refine mode passed to generate_subconcepts.
+        model_refine (optional): Structured-output model used when refine_mode is "structured".
+        max_concurrency (int): Maximum number of rank lists generated concurrently.
+        call_timeout (float, optional): Timeout in seconds for each model call.
+
+    Returns:
+        Taxonomy: The updated taxonomy with generated subconcepts.
+    """
+    if not log:
+        log = logging.getLogger("agenerate_subconcepts_for_all_ranks")
+        logging.basicConfig(level=logging.INFO)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate_rank(i):
+        async with semaphore:
+            await agenerate_subconcepts(
+                model_generate_new,
+                model_re_generate,
+                taxonomy,
+                i,
+                stop_at_depth,
+                max_subconcepts_per_iteration,
+                log,
+                refine_mode,
+                model_refine,
+                call_timeout
+            )
+            log.info(f"depth of rank {taxonomy.ranks[i]}: {taxonomy.depths[i]}")
+            taxonomy.save()
+
+    tasks = [asyncio.ensure_future(generate_rank(i)) for i in range(len(taxonomy.ranks))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Cancel the remaining rank lists if one failed or the caller was cancelled
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return taxonomy
+
+@Phase('integrate_subconcepts')
+async def aintegrate_subconcepts(
+    model_integrate,
+    taxonomy: Taxonomy,
+    log = None,
+    rank_indices = None,
+    max_concurrency: int = 4,
+    call_timeout = None
+):
+    """
+    Async counterpart of integrate_subconcepts. The integration calls of all rank lists run concurrently
+    (at most max_concurrency at a time); trees are stored as soon as their call finishes.
+
+    Args:
+        model_integrate: Model used to integrate subconcepts into a hierarchical structure.
+        taxonomy (Taxonomy): The taxonomy object containing subconcepts.
+        log (logging.Logger, optional): Logger for info/debug output.
+        rank_indices (list, optional): Indices of the rank lists to (re-)integrate; all if omitted.
+        max_concurrency (int): Maximum number of concurrent integration calls.
+        call_timeout (float, optional): Timeout in seconds for each model call.
+
+    Returns:
+        Taxonomy: The updated taxonomy with integrated subconcept trees.
+    """
+    if not log:
+        log = logging.getLogger("aintegrate_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def integrate_rank(i):
+        async with semaphore:
+            integrate_response = await ainvoke_and_record(model_integrate, taxonomy, 'integrate_subconcepts', integrate_prompt(taxonomy, i), call_timeout)
+        store_integrated(taxonomy, i, integrate_response, log)
+
+    tasks = [asyncio.ensure_future(integrate_rank(i)) for i in (range(len(taxonomy.ranks)) if rank_indices is None else rank_indices)]
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        save_cancelled(taxonomy, log)
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return taxonomy
@@ -0,0 +1,114 @@
+import os
+import sys
+import zlib
+import hashlib
+import tempfile
+
+class BlobStore:
+    """
+    Content-addressed store for prompt and completion text.
+    Every distinct value is kept once as a zlib-compressed chunk under its SHA-256 hex digest (the reference).
+    Without a path the chunks are kept in memory (and pickled with the owner);
+    with a path they are written to disk once and read lazily on demand.
+    """
+    def __init__(self, path = None, compression_level = 6) -> None:
+        self.path               = path
+        self.compression_level  = compression_level
+        # In-memory chunks (reference -> compressed bytes), only used without a path
+        self.chunks             = {}
+        # Statistics: number of put calls and raw bytes passed to put
+        self.puts               = 0
+        self.raw_bytes          = 0
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def digest(data:bytes) -> str:
+        """
+        Return the reference (SHA-256 hex digest) of the given bytes.
+        """
+        # Interned, so repeated references share one string object in memory and in pickles
+        return sys.intern(hashlib.sha256(data).hexdigest())
+
+    def _chunk_path(self, ref:str) -> str:
+        # Two-level fan-out keeps directories small for long runs
+        return os.path.join(self.path, ref[:2], ref[2:])
+
+    def __contains__(self, ref:str) -> bool:
+        if self.path:
+            return os.path.exists(self._chunk_path(ref))
+        return ref in self.chunks
+
+    def __len__(self) -> int:
+        if self.path:
+            # Temporary files of interrupted writes are not chunks
+            return sum(1 for _, _, files in os.walk(self.path) for name in files if not name.endswith('.tmp'))
+        return len(self.chunks)
+
+    def put(self, data:bytes) -> str:
+        """
+        Store the bytes if they are not stored yet and return their reference.
+        """
+        ref = self.digest(data)
+        self.puts += 1
+        self.raw_bytes += len(data)
+        if ref not in self:
+            chunk = zlib.compress(data, self.compression_level)
+            if self.path:
+                self._write_chunk(ref, chunk)
+            else:
+                self.chunks[ref] = chunk
+        return ref
+
+    def _write_chunk(self, ref:str, chunk:bytes) -> None:
+        # Write to a temporary file and move it into place, so a crash never leaves a truncated chunk under its reference
+        directory = os.path.dirname(self._chunk_path(ref))
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(chunk)
+            os.replace(temporary_path, self._chunk_path(ref))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def get(self, ref:str) -> bytes:
+        """
+        Return the bytes stored under the given reference.
+        """
+        if self.path:
+            with open(self._chunk_path(ref), 'rb') as file:
+                chunk = file.read()
+        else:
+            chunk = self.chunks[ref]
+        return zlib.decompress(chunk)
+
+    def put_text(self, text:str) -> str:
+        """
+        Store a string (UTF-8) and return its reference.
+        """
+        return self.put(text.encode('utf-8'))
+
+    def get_text(self, ref:str) -> str:
+        """
+        Return the string stored under the given reference, or None for a None reference.
+        """
+        if ref is None:
+            return None
+        return self.get(ref).decode('utf-8')
+
+    def stats(self) -> dict:
+        """
+        Return storage statistics: distinct blobs, put calls, raw bytes passed in and compressed bytes stored.
+        """
+        if self.path:
+            stored_bytes = sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(self.path) for name in files)
+        else:
+            stored_bytes = sum(len(chunk) for chunk in self.chunks.values())
+        return {
+            'blobs': len(self),
+            'puts': self.puts,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': stored_bytes
+        }
@@ -1,4 +1,5 @@
 from langchain.prompts import ChatPromptTemplate
+from src.profiling import Phase
 chat_templates = {}
 
 # GET PROPERTY GROUPS FOR ROOT CONCEPT
@@ -348,6 +349,36 @@ list, another list
         ]
     )
 
+# SCORE A GROUP OF TAXONOMICAL CRITERIA LISTS
+#
+# Name: chat_template_score_criteria
+# Parameters: root_concept, context
+# Description: Structured, batched counterpart of discard_criteria: reviews one group of candidate criteria lists (each given with its global ID) and decides for every list whether it is kept, with a suitability score, so groups can be verified independently and merged by ID.
+# Expected Result: Returns a JSON object in the format:
+# {
+#   "lists": [
+#     {"id": 0, "keep": true, "score": 0.9},
+#     {"id": 1, "keep": false, "score": 0.2},
+#     ...
+#   ]
+# }
+
+chat_templates["score_criteria"] = ChatPromptTemplate.from_messages(
+        [
+            ("system", '''Role: You are a highly skilled ontology expert.
+Task: Your goal is to diligently and painstakingly inspect every given list of taxonomical criteria from the provided context. Decide for every list whether it contains accurate distinctive differentiation criteria for the taxonomical classification of the {root_concept} root concept (keep it) or whether it is redundant, unnecessary or just wrong (drop it), and rate its suitability from 0 to 1.
+
+Context: Candidate lists are given one per line as "ID: criteria":
+{context}
+
+Constraints: Skip explanations. Return a JSON object with the key "lists": one entry per candidate list with its ID exactly as given, "keep" (true or false) and "score" (a number from 0 to 1).
+
+Format:
+{{"lists": [{{"id": 4, "keep": true, "score": 0.9}}, {{"id": 5, "keep": false, "score": 0.2}}]}}'''),
+            ("human", "Provide the JSON object for every candidate list")
+        ]
+    )
+
 # DEFINE TARGET CONCEPT WITHIN TAXONOMICAL CONTEXT
 #
 # Name: chat_template_define
@@ -472,6 +503,35 @@ Italian Cuisine, Mexican Cuisine, Japanese Cuisine.
         ]
     )
 
+# REFINE SUB-CONCEPTS LIST IN A SINGLE STRUCTURED CALL
+#
+# Name: chat_template_refine_subconcepts
+# Parameters: root_concept, taxonomical_rank, taxonomical_context, candidate_list
+# Description: Combines the discard and postprocess steps: inspects the candidate sub-concepts, drops redundant or wrong ones and rewrites the kept ones into their final sub-concept names in one call.
+# Expected Result: Returns a JSON object in the format:
+# {
+#   "kept": ["Candidate1", "Candidate2", ...],
+#   "dropped": ["Candidate3", ...],
+#   "renamed": {"Candidate1": "Refined Sub-concept 1", ...}
+# }
+
+chat_templates["refine_subconcepts"] = ChatPromptTemplate.from_messages(
+        [
+            ("system", '''Role:
+You are the best AI taxonomy expert in the world — a genius ontologist, who possesses all available knowledge about the {root_concept} nature and classification.
+Context:
+Scientists are developing a new valuable {root_concept} taxonomical classification. They have formed the list of candidate terms. Some of them must be inserted as concepts into the current taxonomy. However, some other candidates are unnecessary or redundant and must be discarded.
+Instruction:
+You must diligently and painstakingly inspect every given candidate from that list. Candidate term must be considered as redundant either if it is not a {root_concept} sub-category, or if it is not an acceptable sub-concept of current taxonomical rank (We are currently at the "{taxonomical_rank}" level in the hierarchy ({taxonomical_context})). Discard not all concepts but only needless ones.
+Every kept candidate must then be turned into a true sub-concept name of the root concept, following a consistent format for all sub-concepts (e.g. root concept 'Vehicle', taxonomical rank 'Energy Source', candidate 'Gasoline' becomes 'Gasoline-powered Vehicle'; root concept 'Disease', taxonomical rank 'Body System Affected', candidate 'Respiratory' becomes 'Respiratory Disease').
+Constraints:
+Skip explanations. Return a JSON object with three keys: "kept" is the list of kept candidates exactly as given, "dropped" is the list of redundant candidates exactly as given, and "renamed" is a dictionary mapping every kept candidate to its true sub-concept name. Every candidate must appear either in "kept" or in "dropped".
+Format:
+{{"kept": ["candidate", "other candidate"], "dropped": ["redundant candidate"], "renamed": {{"candidate": "true subconcept", "other candidate": "other true subconcept"}}}}'''),
+            ("human", "The list of candidates is \"{candidate_list}\". Provide the JSON object.")
+        ]
+    )
+
 # INTEGRATE SUB-CONCEPTS INTO TREE STRUCTURE
 #
 # Name: chat_template_integrate_subconcepts
@@ -494,3 +554,9 @@ chat_templates["integrate_subconcepts"] = ChatPromptTemplate.from_messages(
         ]
     )
 
+def format_prompt(template_id:str, **kwargs):
+    """
+    Format the messages of a chat template (timed as the "format_prompt" phase when profiling).
+    """
+    with Phase('format_prompt'):
+        return chat_templates[template_id].format_messages(**kwargs)
@@ -0,0 +1,152 @@
+import json
+import asyncio
+import hashlib
+import threading
+
+from src.responses import message_token_usage, split_response
+
+def request_key(prompt, kwargs:dict) -> str:
+    """
+    Hash identifying a request: the rendered prompt messages (type and content, in order)
+    and the invocation parameters (e.g. max_tokens).
+    """
+    messages = [(getattr(message, 'type', 'message'), getattr(message, 'content', message)) for message in (prompt or [])]
+    return hashlib.sha256(json.dumps([messages, kwargs], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class _Flight:
+    # One in-flight call shared by all identical requests
+    __slots__ = ('done', 'response', 'error', 'waiters')
+
+    def __init__(self) -> None:
+        self.done       = threading.Event()
+        self.response   = None
+        self.error      = None
+        self.waiters    = 0
+
+class CoalescingModel:
+    """
+    Single-flight wrapper around a model: identical requests (same rendered messages and invocation parameters,
+    see request_key) that arrive while one of them is in flight share that call and its result (or error).
+    The sampling parameters of the wrapped model are fixed, so one CoalescingModel per model role is shared by
+    all workers that should coalesce. Only in-flight calls are shared; nothing is cached after a call returns.
+
+    Callers receive the same response object, so every taxonomy records the full answer (and its token usage)
+    even though the tokens were paid once; saved_tokens counts the difference.
+    """
+    def __init__(self, model, name:str = '') -> None:
+        self.model          = model
+        self.name           = name
+        self.flights        = {}
+        # Async calls are coalesced per event loop: key -> (task, waiters)
+        self.async_flights  = {}
+        self.lock           = threading.Lock()
+        self.calls          = 0
+        self.model_calls    = 0
+        self.coalesced      = 0
+        self.saved_tokens   = 0
+        self.max_waiters    = 0
+
+    def _count_saved(self, response) -> None:
+        message, _ = split_response(response)
+        usage = message_token_usage(message) if message is not None else {}
+        with self.lock:
+            self.saved_tokens += usage.get('total_tokens', 0)
+
+    def invoke(self, prompt, **kwargs):
+        """
+        Invoke the model, or wait for the identical call already in flight and return its response.
+        If the shared call was interrupted (KeyboardInterrupt, SystemExit), the leader re-raises the interrupt
+        and the waiting callers get a RuntimeError instead of a missing response.
+        """
+        key = request_key(prompt, kwargs)
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.model_calls += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+            self.max_waiters = max(self.max_waiters, flight.waiters)
+        if leader:
+            try:
+                flight.response = self.model.invoke(prompt, **kwargs)
+            except BaseException as error:
+                flight.error = error
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+            if flight.error is None:
+                self._count_saved(flight.response)
+        if flight.error is not None:
+            if leader or isinstance(flight.error, Exception):
+                raise flight.error
+            raise RuntimeError("coalesced call was interrupted") from flight.error
+        return flight.response
+
+    async def ainvoke(self, prompt, **kwargs):
+        """
+        Async counterpart of invoke. The shared call runs as its own task, so cancelling one caller
+        does not cancel the others; it is cancelled only when every caller waiting for it was cancelled.
+        """
+        key = (id(asyncio.get_running_loop()), request_key(prompt, kwargs))
+        with self.lock:
+            self.calls += 1
+            flight = self.async_flights.get(key)
+            if flight is None:
+                task = asyncio.ensure_future(self.model.ainvoke(prompt, **kwargs))
+                flight = self.async_flights[key] = [task, 0]
+                task.add_done_callback(lambda done: self._end_async_flight(key, done))
+                self.model_calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+            flight[1] += 1
+            self.max_waiters = max(self.max_waiters, flight[1])
+        task = flight[0]
+        try:
+            response = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            with self.lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    # Nobody waits anymore: drop the flight so later callers start a new call
+                    self._end_async_flight(key, task, locked = True)
+                    task.cancel()
+            raise
+        if not leader:
+            self._count_saved(response)
+        return response
+
+    def _end_async_flight(self, key, task, locked:bool = False) -> None:
+        if not locked:
+            with self.lock:
+                return self._end_async_flight(key, task, locked = True)
+        if self.async_flights.get(key, (None,))[0] is task:
+            del self.async_flights[key]
+
+    def metrics(self) -> dict:
+        """
+        Counters: requests, calls made, calls saved by coalescing, tokens saved and the most callers sharing one call.
+        """
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'model_calls': self.model_calls,
+                'coalesced': self.coalesced,
+                'saved_tokens': self.saved_tokens,
+                'max_waiters': self.max_waiters,
+                'in_flight': len(self.flights) + len(self.async_flights)
+            }
+
+def coalesce_models(*models) -> tuple:
+    """
+    Wrap models (e.g. the tuple returned by init_models) in CoalescingModels, keeping their order.
+    """
+    return tuple(CoalescingModel(model) for model in models)
@@ -0,0 +1,312 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+import httpx
+import openai
+
+from src.responses import message_token_usage, split_response
+
+def is_rate_limited(error:BaseException) -> bool:
+    """
+    Check whether an error is an HTTP 429 (rate limit) response, from the OpenAI client or from httpx.
+    """
+    if isinstance(error, openai.RateLimitError):
+        return True
+    response = getattr(error, 'response', None)
+    return getattr(error, 'status_code', None) == 429 or getattr(response, 'status_code', None) == 429
+
+def is_overload(error:BaseException) -> bool:
+    """
+    Check whether an error signals an overloaded endpoint (rate limit, timeout, connection failure or 5xx),
+    as opposed to an error of the request itself (e.g. 400), which must not shrink the concurrency limit.
+    """
+    if is_rate_limited(error):
+        return True
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError, httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    status_code = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status_code, int) and status_code >= 500
+
+class _Waiter:
+    # A queued acquire; the releasing thread hands its slot over with grant()
+    __slots__ = ('event', 'loop', 'future', 'granted')
+
+    def __init__(self, loop = None) -> None:
+        self.loop       = loop
+        self.event      = None if loop else threading.Event()
+        self.future     = loop.create_future() if loop else None
+        self.granted    = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(True)
+
+class AIMDLimiter:
+    """
+    Adaptive limit on the concurrent calls of one model role (additive increase, multiplicative decrease).
+
+    The baseline latency is the minimum of the recent successful calls of the same kind (the latency without
+    queueing). One role serves calls of very different lengths, so calls are compared by latency per output
+    token, and only with calls of the same request class (e.g. the same max_tokens) and output length
+    (within a factor of two); a call of a kind without baseline yet is not judged.
+    A call that succeeds within latency_tolerance times the baseline, while the limit was at least half used,
+    raises the limit by increase / limit (about +increase per round trip of the whole window). An overload
+    error (429, timeout, 5xx, see is_overload) or a call slower than the tolerance multiplies the limit by
+    decrease, at most once per average latency, so one burst of failures counts as one congestion signal.
+
+    Callers that find the limit reached wait in a FIFO queue; threads (acquire) and asyncio tasks (aacquire)
+    can share one limiter.
+    """
+    def __init__(self, initial:int = 4, min_limit:int = 1, max_limit:int = 64, increase:float = 1.0, decrease:float = 0.5,
+                 latency_tolerance:float = 2.0, window:int = 100, alpha:float = 0.1, name:str = 'limiter') -> None:
+        self.name               = name
+        self.limit              = float(initial)
+        self.min_limit          = min_limit
+        self.max_limit          = max_limit
+        self.increase           = increase
+        self.decrease           = decrease
+        self.latency_tolerance  = latency_tolerance
+        self.alpha              = alpha
+        # Recent successful latencies and their EWMA
+        self.window             = window
+        self.latencies          = deque(maxlen=window)
+        self.latency_ewma       = None
+        # (request class, output length bucket) -> recent latencies per output token (baseline = minimum)
+        self.baselines          = {}
+        self.in_flight          = 0
+        self.waiters            = deque()
+        self.last_decrease      = 0.0
+        self.lock               = threading.Lock()
+        # Counters
+        self.calls              = 0
+        self.errors             = 0
+        self.rate_limited       = 0
+        self.increases          = 0
+        self.decreases          = 0
+        self.max_queue_depth    = 0
+        self.wait_time          = 0.0
+
+    @property
+    def current_limit(self) -> int:
+        """
+        Current number of calls allowed in flight.
+        """
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    def _try_acquire(self, loop = None):
+        # Take a free slot, or return a queued waiter (FIFO: nobody overtakes queued callers)
+        with self.lock:
+            if self.in_flight < self.current_limit and not self.waiters:
+                self.in_flight += 1
+                return None
+            waiter = _Waiter(loop)
+            self.waiters.append(waiter)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiters))
+            return waiter
+
+    def _grant_waiters(self) -> None:
+        # Hand free slots to queued callers; called with the lock held
+        while self.waiters and self.in_flight < self.current_limit:
+            self.in_flight += 1
+            self.waiters.popleft().grant()
+
+    def acquire(self) -> float:
+        """
+        Wait for a slot (blocking the thread). Returns the call start time to pass to release.
+        """
+        wait_start = time.perf_counter()
+        waiter = self._try_acquire()
+        if waiter is not None:
+            try:
+                waiter.event.wait()
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        start_time = time.perf_counter()
+        with self.lock:
+            self.wait_time += start_time - wait_start
+        return start_time
+
+    async def aacquire(self) -> float:
+        """
+        Async counterpart of acquire, waiting without blocking the event loop.
+        """
+        wait_start = time.perf_counter()
+        waiter = self._try_acquire(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await waiter.future
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        start_time = time.perf_counter()
+        with self.lock:
+            self.wait_time += start_time - wait_start
+        return start_time
+
+    def _abandon(self, waiter:_Waiter) -> None:
+        # A queued caller gave up (cancelled or interrupted)
+        with self.lock:
+            if waiter.granted:
+                # The slot was handed over in the meantime: pass it on
+                self.in_flight -= 1
+                self._grant_waiters()
+            else:
+                self.waiters.remove(waiter)
+
+    def release(self, start_time:float, error = None, request_class = None, output_tokens = None) -> None:
+        """
+        Free the slot of a finished call and adapt the limit to its latency and outcome.
+
+        Args:
+            start_time (float): Value returned by acquire.
+            error (Exception, optional): Error of a failed call.
+            request_class (optional): Hashable kind of the request (e.g. its invocation parameters); calls are only compared within a class.
+            output_tokens (int, optional): Completion tokens of the call, to compare latency per output token.
+        """
+        latency = time.perf_counter() - start_time
+        now = time.perf_counter()
+        with self.lock:
+            used = self.in_flight
+            self.in_flight -= 1
+            self.calls += 1
+            overload = False
+            if error is not None:
+                self.errors += 1
+                if is_rate_limited(error):
+                    self.rate_limited += 1
+                overload = is_overload(error)
+            else:
+                self.latencies.append(latency)
+                self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma + self.alpha * (latency - self.latency_ewma)
+                cost = latency / output_tokens if output_tokens else latency
+                baseline = self.baselines.setdefault((request_class, output_tokens.bit_length() if output_tokens else None), deque(maxlen=self.window))
+                overload = bool(baseline) and cost > self.latency_tolerance * min(baseline)
+                baseline.append(cost)
+            if overload:
+                # One decrease per average latency: the other calls of the same window saw the same congestion
+                if now - self.last_decrease > (self.latency_ewma or 0.0):
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                    self.last_decrease = now
+                    self.decreases += 1
+            elif error is None and used * 2 >= self.current_limit:
+                # Only grow while the limit is actually used (not while the caller is the bottleneck)
+                previous = self.current_limit
+                self.limit = min(float(self.max_limit), self.limit + self.increase / self.limit)
+                if self.current_limit > previous:
+                    self.increases += 1
+            self._grant_waiters()
+
+    def discard(self) -> None:
+        """
+        Free the slot of a cancelled call without adapting the limit (a cancellation says nothing about the endpoint).
+        """
+        with self.lock:
+            self.in_flight -= 1
+            self._grant_waiters()
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of the limiter: current limit, calls in flight, queue depth and counters.
+        """
+        with self.lock:
+            return {
+                'limit': self.current_limit,
+                'in_flight': self.in_flight,
+                'queue_depth': len(self.waiters),
+                'max_queue_depth': self.max_queue_depth,
+                'calls': self.calls,
+                'errors': self.errors,
+                'rate_limited': self.rate_limited,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'baseline_latency': min(self.latencies) if self.latencies else None,
+                'latency_ewma': self.latency_ewma,
+                'wait_time': self.wait_time
+            }
+
+class LimitedModel:
+    """
+    Wraps a model (or a Router, or a structured-output runnable) so that every invoke and ainvoke
+    passes through an AIMDLimiter. Errors are re-raised after they were counted. The invocation parameters
+    are the request class and the completion tokens the output length of the limiter's latency baseline.
+    Calls ended by cancellation or interrupts (BaseException) free their slot without adapting the limit.
+    """
+    def __init__(self, model, limiter:AIMDLimiter) -> None:
+        self.model      = model
+        self.limiter    = limiter
+
+    def _release(self, start_time:float, kwargs:dict, outcome) -> None:
+        # outcome: ('ok', response), ('error', exception) or None if the call was cancelled or interrupted
+        if outcome is None:
+            self.limiter.discard()
+            return
+        request_class = json.dumps(kwargs, sort_keys=True, default=str)
+        if outcome[0] == 'error':
+            self.limiter.release(start_time, outcome[1], request_class)
+            return
+        message, _ = split_response(outcome[1])
+        output_tokens = message_token_usage(message).get('completion_tokens') if message is not None else None
+        self.limiter.release(start_time, None, request_class, output_tokens)
+
+    def invoke(self, prompt, **kwargs):
+        start_time = self.limiter.acquire()
+        outcome = None
+        try:
+            response = self.model.invoke(prompt, **kwargs)
+            outcome = ('ok', response)
+            return response
+        except Exception as error:
+            outcome = ('error', error)
+            raise
+        finally:
+            self._release(start_time, kwargs, outcome)
+
+    async def ainvoke(self, prompt, **kwargs):
+        start_time = await self.limiter.aacquire()
+        outcome = None
+        try:
+            response = await self.model.ainvoke(prompt, **kwargs)
+            outcome = ('ok', response)
+            return response
+        except Exception as error:
+            outcome = ('error', error)
+            raise
+        finally:
+            self._release(start_time, kwargs, outcome)
+
+    def metrics(self) -> dict:
+        """
+        Metrics of the limiter (see AIMDLimiter.metrics).
+        """
+        return self.limiter.metrics()
+
+def limit_models(models:dict, log = None, **limiter_options) -> dict:
+    """
+    Wrap the models of several roles in LimitedModels, with one AIMDLimiter per role.
+
+    Args:
+        models (dict): Role name -> model, e.g. {'generate new': model_generate_new, 'verify': model_verify}.
+        log (logging.Logger, optional): Logger for info/debug output.
+        **limiter_options: Options of AIMDLimiter (initial, min_limit, max_limit, increase, decrease, latency_tolerance).
+
+    Returns:
+        dict: Role name -> LimitedModel.
+    """
+    if not log:
+        log = logging.getLogger("limit_models()")
+        logging.basicConfig(level=logging.INFO)
+    limited = {role: LimitedModel(model, AIMDLimiter(name = role, **limiter_options)) for role, model in models.items()}
+    log.info(f"adaptive concurrency limits for {list(limited)}: {limiter_options}")
+    return limited
@@ -0,0 +1,186 @@
+import time
+import asyncio
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.profiling import Phase
+
+class Step:
+    """
+    One model call in a step graph.
+    The prompt is built from the values of the dependencies, the model is invoked in a worker,
+    and the result is committed in declaration order on the caller's thread.
+    """
+    def __init__(self, name:str, deps, model, template_id:str, prompt, parse = None, commit = None, expand = None, invoke_kwargs = None) -> None:
+        # Unique step name and names of the steps whose values the prompt needs
+        self.name           = name
+        self.deps           = list(deps)
+        self.model          = model
+        self.template_id    = template_id
+        # prompt(inputs) -> formatted messages; inputs maps dependency names to their values
+        self.prompt         = prompt
+        # parse(inputs, response) -> value passed to dependent steps (defaults to the response itself)
+        self.parse          = parse
+        # commit(result) applies a StepResult to shared state; called in declaration order
+        self.commit         = commit
+        # expand(result) -> list of new steps inserted right after this one (e.g. a fan-out over its value)
+        self.expand         = expand
+        self.invoke_kwargs  = invoke_kwargs or {}
+
+class StepResult:
+    """
+    Outcome of one step: the raw model response, the formatted prompt, the call latency and the parsed value.
+    """
+    __slots__ = ('name', 'template_id', 'prompt', 'response', 'latency', 'value')
+
+    def __init__(self, name:str, template_id:str, prompt, response, latency:float, value) -> None:
+        self.name           = name
+        self.template_id    = template_id
+        self.prompt         = prompt
+        self.response       = response
+        self.latency        = latency
+        self.value          = value
+
+def run_step(step:Step, inputs:dict) -> StepResult:
+    """
+    Build the prompt of a step, invoke its model and parse the response.
+    """
+    with Phase(step.template_id):
+        prompt = step.prompt(inputs)
+        start_time = time.perf_counter()
+        with Phase('invoke'):
+            response = step.model.invoke(prompt, **step.invoke_kwargs)
+        latency = time.perf_counter() - start_time
+        with Phase('parse'):
+            value = step.parse(inputs, response) if step.parse else response
+    return StepResult(step.name, step.template_id, prompt, response, latency, value)
+
+async def arun_step(step:Step, inputs:dict, semaphore:asyncio.Semaphore, timeout = None) -> StepResult:
+    """
+    Async counterpart of run_step: awaits the model's ainvoke, bounded by the semaphore
+    and, if given, by a per-call timeout in seconds (asyncio.TimeoutError on expiry).
+    """
+    async with semaphore:
+        with Phase(step.template_id):
+            prompt = step.prompt(inputs)
+            start_time = time.perf_counter()
+            with Phase('invoke'):
+                response = await asyncio.wait_for(step.model.ainvoke(prompt, **step.invoke_kwargs), timeout)
+            latency = time.perf_counter() - start_time
+            with Phase('parse'):
+                value = step.parse(inputs, response) if step.parse else response
+    return StepResult(step.name, step.template_id, prompt, response, latency, value)
+
+def commit_ready(order:list, results:dict, committed:int) -> int:
+    """
+    Commit finished steps in declaration order, stopping at the first unfinished one.
+    Returns the number of committed steps.
+    """
+    while committed < len(order) and order[committed].name in results:
+        step = order[committed]
+        if step.commit:
+            with Phase('commit'):
+                step.commit(results[step.name])
+        committed += 1
+    return committed
+
+def add_finished(order:list, results:dict, step:Step, result:StepResult) -> None:
+    """
+    Store a step result and insert the steps it expands into right after it.
+    """
+    results[step.name] = result
+    if step.expand:
+        position = order.index(step) + 1
+        order[position:position] = step.expand(result)
+
+def ready_steps(order:list, results:dict, running) -> list:
+    """
+    Return the steps that are neither finished nor running and whose dependencies are all finished.
+    """
+    running = set(running)
+    return [step for step in order if step.name not in results and step.name not in running and all(dep in results for dep in step.deps)]
+
+def raise_stalled(order:list, results:dict) -> None:
+    """
+    Raise for a step graph in which no step is running and none can start.
+    """
+    missing = [step.name for step in order if step.name not in results]
+    raise ValueError(f"Step graph cannot make progress, unresolved steps: {missing}")
+
+def run_steps(steps, max_workers:int = 4) -> dict:
+    """
+    Run a step graph: every step starts as soon as its dependencies are finished,
+    with at most max_workers model calls in flight. Results are committed in declaration order,
+    so the shared state ends up identical to a serial run.
+
+    Args:
+        steps (list): Steps in declaration (commit) order; dependencies must refer to earlier steps.
+        max_workers (int): Maximum number of concurrent model calls.
+
+    Returns:
+        dict: Step name -> StepResult.
+    """
+    order = list(steps)
+    results = {}
+    running = {}
+    committed = 0
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while committed < len(order):
+            # Start every step whose dependencies are finished
+            for step in ready_steps(order, results, running.values()):
+                inputs = {dep: results[dep].value for dep in step.deps}
+                # Run in a copy of the caller's context, so profiling phases (and other context variables) carry over
+                running[executor.submit(contextvars.copy_context().run, run_step, step, inputs)] = step.name
+            if not running:
+                raise_stalled(order, results)
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                step = next(v for v in order if v.name == name)
+                add_finished(order, results, step, future.result())
+            committed = commit_ready(order, results, committed)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+async def arun_steps(steps, max_concurrency:int = 4, timeout = None) -> dict:
+    """
+    Async counterpart of run_steps: every step runs as an asyncio task on the current event loop
+    as soon as its dependencies are finished, with at most max_concurrency model calls in flight.
+    Results are committed in declaration order. If the caller is cancelled (or a step fails),
+    the running steps are cancelled and the already committed state is kept.
+
+    Args:
+        steps (list): Steps in declaration (commit) order; dependencies must refer to earlier steps.
+        max_concurrency (int): Maximum number of concurrent model calls.
+        timeout (float, optional): Timeout in seconds for each model call.
+
+    Returns:
+        dict: Step name -> StepResult.
+    """
+    order = list(steps)
+    results = {}
+    running = {}
+    committed = 0
+    semaphore = asyncio.Semaphore(max_concurrency)
+    try:
+        while committed < len(order):
+            # Start every step whose dependencies are finished
+            for step in ready_steps(order, results, running.values()):
+                inputs = {dep: results[dep].value for dep in step.deps}
+                running[asyncio.ensure_future(arun_step(step, inputs, semaphore, timeout))] = step.name
+            if not running:
+                raise_stalled(order, results)
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = running.pop(task)
+                step = next(v for v in order if v.name == name)
+                add_finished(order, results, step, task.result())
+            committed = commit_ready(order, results, committed)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return results
@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import httpx
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """
+    Response stream that releases a per-host slot once the body has been read and closed.
+    """
+    def __init__(self, stream, release) -> None:
+        self.stream     = stream
+        self.release    = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    """
+    Async counterpart of _ReleasingStream.
+    """
+    def __init__(self, stream, release) -> None:
+        self.stream     = stream
+        self.release    = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self.release()
+
+def _once(release):
+    # Release a slot at most once, even if a stream is closed twice
+    released = []
+    def wrapper():
+        if not released:
+            released.append(True)
+            release()
+    return wrapper
+
+class HostLimitedTransport(httpx.BaseTransport):
+    """
+    Transport allowing at most per_host_limit requests in flight per host; a slot is held until the response is closed.
+    """
+    def __init__(self, transport:httpx.BaseTransport, per_host_limit:int) -> None:
+        self.transport      = transport
+        self.per_host_limit = per_host_limit
+        self.semaphores     = {}
+        self.lock           = threading.Lock()
+
+    def handle_request(self, request:httpx.Request) -> httpx.Response:
+        with self.lock:
+            semaphore = self.semaphores.setdefault(request.url.host, threading.BoundedSemaphore(self.per_host_limit))
+        semaphore.acquire()
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers, stream=_ReleasingStream(response.stream, _once(semaphore.release)), extensions=response.extensions)
+
+    def close(self) -> None:
+        self.transport.close()
+
+class AsyncHostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Async counterpart of HostLimitedTransport.
+    """
+    def __init__(self, transport:httpx.AsyncBaseTransport, per_host_limit:int) -> None:
+        self.transport      = transport
+        self.per_host_limit = per_host_limit
+        self.semaphores     = {}
+
+    async def handle_async_request(self, request:httpx.Request) -> httpx.Response:
+        semaphore = self.semaphores.setdefault(request.url.host, asyncio.BoundedSemaphore(self.per_host_limit))
+        await semaphore.acquire()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        return httpx.Response(response.status_code, headers=response.headers, stream=_AsyncReleasingStream(response.stream, _once(semaphore.release)), extensions=response.extensions)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+class HTTPPool:
+    """
+    Shared HTTP connection pool for all models of a process.
+    Holds one httpx.Client and one httpx.AsyncClient (created on first use) with keep-alive,
+    HTTP/2 when the optional 'h2' package is installed, and an optional limit of concurrent requests per host.
+    Every request is traced, so stats() reports how many requests reused an open connection.
+    """
+    def __init__(self, max_connections = 20, max_keepalive_connections = 10, keepalive_expiry = 30.0, per_host_limit = None, http2 = None, timeout = 120.0) -> None:
+        self.limits             = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections, keepalive_expiry=keepalive_expiry)
+        self.per_host_limit     = per_host_limit
+        # HTTP/2 multiplexes concurrent requests over one connection; used by default where available
+        self.http2              = (h2 is not None) if http2 is None else http2
+        self.timeout            = timeout
+        self._client            = None
+        self._async_client      = None
+        # Statistics: requests sent, new connections opened, requests per host and per HTTP version
+        self.requests           = 0
+        self.connections        = 0
+        self.hosts              = {}
+        self.http_versions      = {}
+        self.lock               = threading.Lock()
+
+    def _count(self, event:str, request = None, response = None) -> None:
+        with self.lock:
+            if event == 'connection':
+                self.connections += 1
+            else:
+                self.requests += 1
+                self.hosts[request.url.host] = self.hosts.get(request.url.host, 0) + 1
+                self.http_versions[response.http_version] = self.http_versions.get(response.http_version, 0) + 1
+
+    def _trace(self, event_name:str, info:dict) -> None:
+        # httpcore emits connect_tcp only when a request has to open a new connection
+        if event_name == 'connection.connect_tcp.complete':
+            self._count('connection')
+
+    async def _atrace(self, event_name:str, info:dict) -> None:
+        self._trace(event_name, info)
+
+    def _on_request(self, request:httpx.Request) -> None:
+        request.extensions['trace'] = self._trace
+
+    async def _aon_request(self, request:httpx.Request) -> None:
+        request.extensions['trace'] = self._atrace
+
+    def _on_response(self, response:httpx.Response) -> None:
+        self._count('request', response.request, response)
+
+    async def _aon_response(self, response:httpx.Response) -> None:
+        self._on_response(response)
+
+    @property
+    def client(self) -> httpx.Client:
+        """
+        Shared synchronous client (pass as ChatOpenAI http_client).
+        """
+        with self.lock:
+            if self._client is None:
+                transport = httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+                if self.per_host_limit:
+                    transport = HostLimitedTransport(transport, self.per_host_limit)
+                self._client = httpx.Client(transport=transport, timeout=self.timeout,
+                                            event_hooks={'request': [self._on_request], 'response': [self._on_response]})
+            return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """
+        Shared asynchronous client (pass as ChatOpenAI http_async_client).
+        """
+        with self.lock:
+            if self._async_client is None:
+                transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+                if self.per_host_limit:
+                    transport = AsyncHostLimitedTransport(transport, self.per_host_limit)
+                self._async_client = httpx.AsyncClient(transport=transport, timeout=self.timeout,
+                                                       event_hooks={'request': [self._aon_request], 'response': [self._aon_response]})
+            return self._async_client
+
+    def stats(self) -> dict:
+        """
+        Return connection statistics: requests, new connections, reused connections and the reuse ratio,
+        plus request counts per host and per HTTP version.
+        """
+        with self.lock:
+            reused = max(self.requests - self.connections, 0)
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': reused,
+                'reuse_ratio': reused / self.requests if self.requests else 0.0,
+                'hosts': dict(self.hosts),
+                'http_versions': dict(self.http_versions)
+            }
+
+    def close(self) -> None:
+        """
+        Close the synchronous client.
+        """
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def aclose(self) -> None:
+        """
+        Close the asynchronous client (on the event loop it was used on).
+        """
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool() -> HTTPPool:
+    """
+    Return the process-wide HTTPPool (created with default settings on first use).
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = HTTPPool()
+        return _default_pool
@@ -1,11 +1,19 @@
 import os
 import logging
+import uuid
 import pickle
 import datetime
 
 import openai
 from langchain_openai import ChatOpenAI
 
+from src.blobs import BlobStore
+from src.http_pool import default_pool
+from src.profiling import Phase
+from src.responses import ResponseRecord, make_record
+from src.spill import SpillList, peak_rss_bytes, spill_to_cap
+from src.taxonomy_file import FILE_EXTENSION, SECTIONS, is_taxonomy_file, read_header, read_sections, write_sections
+
 def ensure_directory_exists(path):
     """
     Ensure that the directory at the given path exists.
@@ -23,21 +31,54 @@ def ensure_directory_exists(path):
     else:
         print(f"Directory already exists: {path}")
 
+def default_save_path() -> str:
+    """
+    Directory taxonomies are saved to when no save_path is given: data/taxonomies in the working directory.
+    """
+    return os.path.join(os.getcwd(), "data", "taxonomies")
+
+# Text fields of Taxonomy stored as references into its blob store
+TEXT_FIELDS = ('property_groups', 'key_aspects', 'rare_info', 'initial_hierarchies', 'present_features', 'distinctive_features')
+
+def blob_text_field(name:str) -> property:
+    """
+    Create a Taxonomy property that keeps the text in the taxonomy's blob store
+    and only holds its reference in Taxonomy._text_refs.
+    """
+    def getter(self):
+        return self.blobs.get_text(self._text_refs.get(name))
+    def setter(self, value):
+        self._text_refs[name] = None if value is None else self.blobs.put_text(value)
+    return property(getter, setter, doc=f"{name} text, stored in the taxonomy's blob store.")
+
 class Taxonomy:
     """
     Class representing a taxonomy structure for organizing concepts.
     Stores metadata, hierarchical information, and methods for persistence.
+    Prompt and completion text is kept once per distinct value in a content-addressed BlobStore.
     """
-    def __init__(self, root_concept:str) -> None:
+    property_groups         = blob_text_field('property_groups')
+    key_aspects             = blob_text_field('key_aspects')
+    rare_info               = blob_text_field('rare_info')
+    initial_hierarchies     = blob_text_field('initial_hierarchies')
+    present_features        = blob_text_field('present_features')
+    distinctive_features    = blob_text_field('distinctive_features')
+
+    def __init__(self, root_concept:str, save_path = None) -> None:
         # Record creation and last edit timestamps
         self.created_at             = datetime.datetime.now()
         self.last_edit_time         = datetime.datetime.now()
-        # Generate a unique name for the taxonomy based on creation time
-        self.name                   = 'Taxonomy_'+str(self.created_at).replace(' ','_T').replace(':','-')[:22]
-        # Default save path for taxonomy files
-        self.save_path              = os.getcwd()+"\\data\\taxonomies\\"
+        # Generate a unique name for the taxonomy based on creation time; the random suffix keeps
+        # taxonomies created within the same 0.1 s (e.g. concurrent acreate_taxonomy runs) apart
+        self.name                   = 'Taxonomy_'+str(self.created_at).replace(' ','_T').replace(':','-')[:22]+'_'+uuid.uuid4().hex[:8]
+        # Save path for taxonomy files (data/taxonomies in the working directory by default)
+        self.save_path              = save_path or default_save_path()
         # List of file paths where the taxonomy has been saved
-        self.saved_to               = [self.save_path + self.name + '.pkl']
+        self.saved_to               = [os.path.join(self.save_path, self.name + FILE_EXTENSION)]
+        # Sections read by a partial Taxonomy.load (None when the taxonomy is complete)
+        self.loaded_sections        = None
+        # Optional TaxonomyRepository that save() writes to instead of a file (not persisted)
+        self.repository             = None
         # Track token usage for LLM interactions
         self.token_usage            = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
         # Store the root concept of the taxonomy
@@ -49,6 +90,10 @@ class Taxonomy:
             'total_tokens': 0
         }
         
+        # Content-addressed store for prompt and completion text, and references to the text fields
+        self.blobs = BlobStore()
+        self._text_refs = {}
+        
         # Various properties for taxonomy construction and analysis
         self.property_groups = ""
         self.key_aspects = ""
@@ -59,13 +104,70 @@ class Taxonomy:
         
         # Lists for hierarchical and structural data
         self.hierarchies = []
-        self.missing = []
+        # References to the completions with newly found hierarchies (see missing / add_missing)
+        self._missing_refs = []
         self.ranks = []
         self.subconcepts_plain = []
+        # Subconcepts per generated depth for each rank list (leaves of the last level are resumed from)
+        self.subconcepts_levels = []
         self.subconcepts_trees = []
         self.depths = []
+        # Compact ResponseRecord entries, one per model call
         self.responses = []
+        # Optional separate blob store for full raw payloads (see offload_payloads)
+        self.payload_store = None
+        # Token and latency metrics of the subconcept refine stage, keyed by refine mode
+        self.refine_metrics = {}
+        # Resident-size cap of the memory-bounded mode (None when the mode is off, see bound_memory)
+        self.max_resident_bytes = None
+        # Parameters of the run that shape its prompts (criteria_batch_size, stop_at_depth,
+        # max_subconcepts_per_iteration, refine_mode), so a recorded run can be replayed (see src/replay.py)
+        self.run_parameters = {}
     
+    def __getstate__(self) -> dict:
+        """
+        Pickle the taxonomy state without the (connection-holding) repository.
+        """
+        state = self.__dict__.copy()
+        state['repository'] = None
+        return state
+
+    def __setstate__(self, state) -> None:
+        """
+        Restore a pickled taxonomy, re-binding response records to the blob store.
+        Taxonomies pickled before the blob store existed are migrated on load.
+        """
+        self.__dict__.update(state)
+        self.__dict__.setdefault('refine_metrics', {})
+        self.__dict__.setdefault('payload_store', None)
+        self.__dict__.setdefault('loaded_sections', None)
+        self.__dict__.setdefault('repository', None)
+        self.__dict__.setdefault('max_resident_bytes', None)
+        self.__dict__.setdefault('run_parameters', {})
+        self.__dict__.setdefault('subconcepts_levels', [[] for v in self.__dict__.get('ranks', [])])
+        if 'blobs' not in state:
+            self.blobs = BlobStore()
+            self._text_refs = {}
+            for name in TEXT_FIELDS:
+                setattr(self, name, self.__dict__.pop(name, ""))
+            self._missing_refs = [self.blobs.put_text(v) for v in self.__dict__.pop('missing', [])]
+            self.responses = [v if isinstance(v, ResponseRecord) else make_record(None, v, self.blobs) for v in self.responses]
+        for record in self.responses:
+            record.bind(self.blobs)
+
+    @property
+    def missing(self) -> tuple:
+        """
+        Completions with newly found hierarchies, read from the blob store. Use add_missing to append.
+        """
+        return tuple(self.blobs.get_text(ref) for ref in self._missing_refs)
+
+    def add_missing(self, text:str) -> None:
+        """
+        Append a completion with newly found hierarchies.
+        """
+        self._missing_refs.append(self.blobs.put_text(text))
+
     def update_token_usage(self, token_usage_delta) -> None:
         """
         Update the token usage statistics by adding values from token_usage_delta.
@@ -73,24 +175,232 @@ class Taxonomy:
         for key in self.token_usage.keys():
             self.token_usage[key] += token_usage_delta[key]
     
+    def record_response(self, template_id:str, response, latency = None, prompt = None) -> ResponseRecord:
+        """
+        Append a compact record of a model response and update token usage and edit time.
+        Completion and prompt text go to the blob store; if payload offloading is enabled,
+        the full raw payload is written to the payload store.
+        Returns the new record.
+        """
+        payload_ref = None
+        if self.payload_store is not None:
+            payload_ref = self.payload_store.put(pickle.dumps(response))
+        record = make_record(template_id, response, self.blobs, latency, prompt, payload_ref)
+        self.responses.append(record)
+        self.update_token_usage(record.token_usage)
+        self.update_last_edit_time()
+        return record
+
+    def offload_payloads(self, path = None) -> BlobStore:
+        """
+        Enable offloading of full raw model payloads to a separate directory-backed blob store.
+        Defaults to a '<name>_payloads' directory next to the saved taxonomy files.
+        Returns the payload store.
+        """
+        if not path:
+            path = os.path.join(self.save_path, self.name + '_payloads')
+        self.payload_store = BlobStore(path)
+        return self.payload_store
+
+    def raw_response(self, index:int):
+        """
+        Lazily load the full raw payload of the response record at the given index.
+        Returns None if the payload was not offloaded.
+        """
+        record = self.responses[index]
+        if record.payload_ref is None or self.payload_store is None:
+            return None
+        return pickle.loads(self.payload_store.get(record.payload_ref))
+
+    def spill_path(self) -> str:
+        """
+        Default directory for spilled data: next to the repository database if one is set,
+        otherwise a '<name>_spill' directory next to the saved taxonomy files.
+        """
+        if self.repository is not None:
+            return os.path.join(os.path.dirname(os.path.abspath(self.repository.db_path)), "spill", self.name)
+        return os.path.join(self.save_path, self.name + '_spill')
+
+    def bound_memory(self, max_resident_bytes:int = 32 * 2**20, path = None) -> BlobStore:
+        """
+        Enable the memory-bounded mode.
+        Prompt and completion text moves to a directory-backed blob store and is read lazily;
+        the per-rank-list subconcept lists, levels and trees become SpillLists whose completed entries
+        are spilled to the same store (least recently used first) whenever their resident size exceeds
+        max_resident_bytes, and are reloaded on access. Saved files then reference the spill directory,
+        like offloaded payloads do.
+
+        Args:
+            max_resident_bytes (int): Cap on the resident size of completed rank lists (pickled bytes).
+            path (str, optional): Spill directory; defaults to spill_path().
+
+        Returns:
+            BlobStore: The directory-backed store.
+        """
+        if self.blobs.path is None:
+            store = BlobStore(path or self.spill_path(), self.blobs.compression_level)
+            for ref in list(self.blobs.chunks):
+                store.put(self.blobs.get(ref))
+            self.blobs = store
+            for record in self.responses:
+                record.bind(store)
+        for attribute in ('subconcepts_plain', 'subconcepts_levels', 'subconcepts_trees'):
+            value = getattr(self, attribute)
+            if not isinstance(value, SpillList):
+                setattr(self, attribute, SpillList(self.blobs, value))
+        self.max_resident_bytes = max_resident_bytes
+        self.enforce_memory_cap()
+        return self.blobs
+
+    def _spill_lists(self) -> list:
+        return [v for v in (self.subconcepts_plain, self.subconcepts_levels, self.subconcepts_trees) if isinstance(v, SpillList)]
+
+    def pin_rank_list(self, i:int) -> None:
+        """
+        Keep the data of rank list i resident while it is being generated or integrated (no-op unless memory-bounded).
+        """
+        for spill_list in self._spill_lists():
+            spill_list.pin(i)
+
+    def release_rank_list(self, i:int) -> None:
+        """
+        Allow the data of rank list i to be spilled again (no-op unless memory-bounded).
+        """
+        for spill_list in self._spill_lists():
+            spill_list.unpin(i)
+
+    def enforce_memory_cap(self) -> int:
+        """
+        Spill least recently used, unpinned rank list data until the resident size is within max_resident_bytes.
+        Returns the resident size in bytes (0 when the memory-bounded mode is off).
+        """
+        if self.max_resident_bytes is None:
+            return 0
+        return spill_to_cap(self._spill_lists(), self.max_resident_bytes)
+
+    def memory_report(self) -> dict:
+        """
+        Return the memory-bounded mode state: cap, resident and spilled rank list entries,
+        blob store location and the peak RSS of the process.
+        """
+        spill_lists = self._spill_lists()
+        return {
+            'max_resident_bytes': self.max_resident_bytes,
+            'resident_bytes': sum(size for spill_list in spill_lists for _, _, size in spill_list.resident_items()),
+            'spilled_items': sum(spill_list.is_spilled(i) for spill_list in spill_lists for i in range(len(spill_list))),
+            'spill_path': self.blobs.path,
+            'responses': len(self.responses),
+            'peak_rss_bytes': peak_rss_bytes()
+        }
+
+    def update_refine_metrics(self, refine_mode:str, token_usage_delta, latency:float, calls:int = 1) -> None:
+        """
+        Accumulate token usage, latency and call count of one refine iteration under refine_mode.
+        """
+        metrics = self.refine_metrics.setdefault(refine_mode, {
+            'iterations': 0,
+            'calls': 0,
+            'completion_tokens': 0,
+            'prompt_tokens': 0,
+            'total_tokens': 0,
+            'latency': 0.0
+        })
+        metrics['iterations'] += 1
+        metrics['calls'] += calls
+        metrics['latency'] += latency
+        for key in ('completion_tokens', 'prompt_tokens', 'total_tokens'):
+            metrics[key] += token_usage_delta[key]
+
     def update_last_edit_time(self) -> None:
         """
         Update the last_edit_time to the current time.
         """
         self.last_edit_time = datetime.datetime.now()
 
-    def save(self, suffix = "") -> str:
+    def summary(self) -> dict:
+        """
+        Return a small JSON-serializable summary, stored in the header of saved taxonomy files.
+        """
+        return {
+            'name': self.name,
+            'root_concept': self.root_concept,
+            'created_at': self.created_at.isoformat(),
+            'last_edit_time': self.last_edit_time.isoformat(),
+            'token_usage': self.token_usage,
+            'ranks': len(self.ranks),
+            'depths': self.depths,
+            'responses': len(self.responses)
+        }
+
+    def to_sections(self) -> dict:
+        """
+        Split the taxonomy state into the sections of the taxonomy file format.
+        Text fields are written as references, resolved from the blob store of the 'responses' section on load.
+        """
+        sections = {}
+        for section, attributes in SECTIONS.items():
+            sections[section] = {attribute: getattr(self, attribute) for attribute in attributes}
+        return sections
+
+    @staticmethod
+    def text_refs(values:dict) -> list:
+        """
+        Blob references of the text fields and missing hierarchies in a loaded 'hierarchies' section.
+        """
+        refs = list(values.get('_text_refs', {}).values()) + list(values.get('_missing_refs', []))
+        return [ref for ref in refs if ref is not None]
+
+    @staticmethod
+    def resolve_text_refs(values:dict, blobs:BlobStore) -> dict:
+        """
+        Replace the text references of a loaded 'hierarchies' section with plain text read from blobs,
+        for partial loads without the 'responses' section (whose blob store the references point into).
+        """
+        values = dict(values)
+        for name, ref in values.pop('_text_refs', {}).items():
+            values[name] = blobs.get_text(ref)
+        if '_missing_refs' in values:
+            values['missing'] = [blobs.get_text(ref) for ref in values.pop('_missing_refs')]
+        return values
+
+    def apply_section(self, values:dict) -> None:
+        """
+        Set taxonomy attributes from one loaded section.
+        Text fields given as plain text (older files, partial loads) are put into the blob store.
+        """
+        for attribute, value in values.items():
+            if attribute == 'missing':
+                self._missing_refs = [self.blobs.put_text(v) for v in value]
+            elif attribute in ('_text_refs', '_missing_refs'):
+                setattr(self, attribute, type(value)(value))
+            else:
+                setattr(self, attribute, value)
+        if 'responses' in values:
+            for record in self.responses:
+                record.bind(self.blobs)
+
+    @Phase('save')
+    def save(self, suffix = "", repository = None) -> str:
         """
-        Save the taxonomy object to a pickle file.
-        Ensures the save directory exists.
+        Save the taxonomy to a compressed, versioned container file (see src/taxonomy_file.py).
+        Ensures the save directory exists. Every file save rewrites the whole file, so the workflow's
+        save after each step costs time proportional to the taxonomy size; for long runs a repository,
+        which only writes what changed since the last save, is cheaper.
+        If a TaxonomyRepository is given (or set as self.repository), the taxonomy is written to it
+        in one transaction instead, and the taxonomy name is returned.
         Returns the full path to the saved file.
         """
+        if self.loaded_sections is not None:
+            raise ValueError(f"Cannot save a partially loaded taxonomy (sections: {self.loaded_sections})")
+        repository = repository or self.repository
+        self.enforce_memory_cap()
+        if repository is not None:
+            return repository.save(self)
         ensure_directory_exists(self.save_path)
-        full_path = self.save_path + self.name + suffix + '.pkl'
-        with open(full_path, 'wb') as file:
-            pickle.dump(self, file)
+        full_path = os.path.join(self.save_path, self.name + suffix + FILE_EXTENSION)
         if not full_path in self.saved_to:
             self.saved_to.append(full_path) 
+        write_sections(full_path, self.summary(), self.to_sections())
         return full_path    
     
     def info(self) -> str:
@@ -115,6 +425,9 @@ Root concept: {self.root_concept}
 Hierarchies: {self.hierarchies}
 Missing: {self.missing}
 Token Usage: {self.token_usage}
+Refine metrics: {self.refine_metrics}
+Blob store: {self.blobs.stats()}
+Memory: {self.memory_report()}
 '''
         for i, rank in enumerate(self.ranks):
             info += f'''
@@ -126,28 +439,80 @@ Depth: {self.depths[i]}
         return info
 
     @staticmethod
-    def load(file_path:str) -> 'Taxonomy':
+    def load(file_path:str, sections = None, repository = None) -> 'Taxonomy':
         """
-        Load a Taxonomy object from a pickle file at the given file_path.
+        Load a Taxonomy object from the file at the given file_path.
+        Only the requested sections ('metadata', 'hierarchies', 'ranks', 'trees', 'responses') are read;
+        all sections are read if omitted. 'hierarchies' without 'responses' also reads the blob store of
+        the 'responses' section to resolve its text fields. Legacy pickle files are always loaded whole.
+        If a TaxonomyRepository is given, file_path is the taxonomy name in the repository.
         Returns the loaded Taxonomy instance.
         """
-        with open(file_path, 'rb') as file:
-            taxonomy = pickle.load(file)
+        if repository is not None:
+            return repository.load(file_path, sections)
+        if not is_taxonomy_file(file_path):
+            with open(file_path, 'rb') as file:
+                taxonomy = pickle.load(file)
+            return taxonomy
+        header, values = read_sections(file_path, sections)
+        if 'hierarchies' in values and 'responses' not in values and Taxonomy.text_refs(values['hierarchies']):
+            blobs = read_sections(file_path, ['responses'])[1]['responses']['blobs']
+            values['hierarchies'] = Taxonomy.resolve_text_refs(values['hierarchies'], blobs)
+        return Taxonomy.from_sections(header['summary'], values, sections)
+
+    @staticmethod
+    def from_sections(summary:dict, values:dict, sections = None) -> 'Taxonomy':
+        """
+        Build a Taxonomy from a file summary and loaded section values.
+        Marks the taxonomy as partially loaded if not all sections were requested.
+        """
+        taxonomy = Taxonomy(summary['root_concept'])
+        taxonomy.name = summary['name']
+        # The responses section carries the blob store, so it is applied first
+        for section in sorted(values, key=lambda name: name != 'responses'):
+            taxonomy.apply_section(values[section])
+        if sections is not None and not set(SECTIONS) <= set(sections):
+            taxonomy.loaded_sections = list(sections)
         return taxonomy
+
+    @staticmethod
+    def read_summary(file_path:str) -> dict:
+        """
+        Read only the summary from the header of a taxonomy file, without loading any section.
+        """
+        return read_header(file_path)['summary']
         
+# Default checkpoint and sampling parameters of every model role
+ROLE_PARAMETERS = {
+    'verify':       {'model_checkpoint': 'gpt-4o-mini', 'temperature': 0.9, 'top_p': 0.90, 'presence_penalty': 1.00, 'frequency_penalty': 0.00},
+    're-generate':  {'model_checkpoint': 'gpt-4o-mini', 'temperature': 1.3, 'top_p': 0.90, 'presence_penalty': 0.50, 'frequency_penalty': 1.00},
+    'generate new': {'model_checkpoint': 'gpt-4o',      'temperature': 1.0, 'top_p': 0.98, 'presence_penalty': 1.00, 'frequency_penalty': 1.20},
+    'integrate':    {'model_checkpoint': 'gpt-4o-mini', 'temperature': 1.3, 'top_p': 0.90, 'presence_penalty': 0.50, 'frequency_penalty': 1.00},
+    'refine':       {'model_checkpoint': 'gpt-4o-mini', 'temperature': 1.3, 'top_p': 0.90, 'presence_penalty': 0.50, 'frequency_penalty': 1.00},
+    'score':        {'model_checkpoint': 'gpt-4o-mini', 'temperature': 0.9, 'top_p': 0.90, 'presence_penalty': 1.00, 'frequency_penalty': 0.00}
+}
+# Roles answering with structured JSON output (the raw message is kept for token usage)
+STRUCTURED_ROLES = ('integrate', 'refine', 'score')
+
 class Model:
     """
     Wrapper class for initializing a Large Language Model (LLM) with specific parameters.
     Stores configuration and provides access to the underlying model.
     """
-    def __init__(self, name:str, model_checkpoint:str, temperature = 1, top_p = 1, presence_penalty = 1, frequency_penalty = 0) -> None:
+    def __init__(self, name:str, model_checkpoint:str, temperature = 1, top_p = 1, presence_penalty = 1, frequency_penalty = 0, http_pool = None, base_url = None, api_key = None, max_retries = 2) -> None:
         # Initialize the LLM with the provided parameters
+        # With an HTTPPool all models share its keep-alive connections instead of opening their own clients
         self.model              = ChatOpenAI(
                 model               = model_checkpoint, 
                 temperature         = temperature, 
                 top_p               = top_p, 
                 presence_penalty    = presence_penalty, 
-                frequency_penalty   = frequency_penalty
+                frequency_penalty   = frequency_penalty,
+                base_url            = base_url,
+                api_key             = api_key,
+                max_retries         = max_retries,
+                http_client         = http_pool.client if http_pool else None,
+                http_async_client   = http_pool.async_client if http_pool else None
             )
         self.name               = name
         self.temperature        = temperature
@@ -155,6 +520,9 @@ class Model:
         self.top_p              = top_p
         self.presence_penalty   = presence_penalty
         self.frequency_penalty  = frequency_penalty
+        self.http_pool          = http_pool
+        self.base_url           = base_url
+        self.max_retries        = max_retries
         # Store a formatted string with model configuration info
         self.info               = f'''model name: {name}
 model checkpoint: {model_checkpoint}
@@ -170,10 +538,10 @@ def start_session(api_key = None):
     """
     start_time = datetime.datetime.now()
     log = logging.getLogger("TaxoRankExpand")
-    logs_path = os.getcwd()+"\\logs\\"
+    logs_path = os.path.join(os.getcwd(), "logs")
     ensure_directory_exists(logs_path)
     log_name = 'TaxoRankExpand_0.1__'+str(start_time).replace(' ','_').replace(':','-')[:21]+'.log'
-    logging.basicConfig(filename=logs_path+log_name, level=logging.INFO)
+    logging.basicConfig(filename=os.path.join(logs_path, log_name), level=logging.INFO)
     log.info("start_session()")
     # Set your OpenAI API key
     if not api_key:
@@ -183,37 +551,79 @@ def start_session(api_key = None):
     openai.api_key = os.environ["OPENAI_API_KEY"]
     return log
 
-def init_models(log = None):
+def init_models(log = None, http_pool = None, base_url = None):
     """
     Initialize and configure multiple LLM models for different taxonomy construction tasks.
+    All models share one HTTP connection pool (the process-wide default_pool() unless http_pool is given);
+    base_url points them at another OpenAI-compatible endpoint (e.g. src/stub_server.py).
     Returns the initialized model instances.
     """
     if not log:
         log = logging.getLogger("init_models()")
         logging.basicConfig(level=logging.INFO)
     log.info(f"init_models()..")
+    http_pool = http_pool or default_pool()
     
     # Verification model: Used for verifying taxonomy data
-    llm_verify              = Model('verify',       'gpt-4o-mini',  
-                                    temperature = 0.9,    top_p = 0.90,   presence_penalty = 1.00,   frequency_penalty = 0.00) 
+    llm_verify              = Model('verify',       **ROLE_PARAMETERS['verify'],
+                                    http_pool = http_pool,   base_url = base_url) 
     log.info(f"{llm_verify.info}\nmodel init successfully..")
     model_verify            = llm_verify.model
     
     # Re-Generation model: Used for regenerating or refining taxonomy data
-    llm_re_generate         = Model('re-generate',  'gpt-4o-mini',
-                                    temperature = 1.3,    top_p = 0.90,   presence_penalty = 0.50,   frequency_penalty = 1.00)
+    llm_re_generate         = Model('re-generate',  **ROLE_PARAMETERS['re-generate'],
+                                    http_pool = http_pool,   base_url = base_url)
     log.info(f"{llm_re_generate.info}\nmodel init successfully..")
     model_re_generate       = llm_re_generate.model
     
     # New concept generation model: Used for generating new taxonomy concepts
-    llm_generate_new        = Model('generate new',  'gpt-4o',
-                                    temperature = 1.0,    top_p = 0.98,   presence_penalty = 1.00,   frequency_penalty = 1.20)
+    llm_generate_new        = Model('generate new', **ROLE_PARAMETERS['generate new'],
+                                    http_pool = http_pool,   base_url = base_url)
     log.info(f"{llm_generate_new.info}\nmodel init successfully..")
     model_generate_new      = llm_generate_new.model
     
     # Integration model: Used for integrating taxonomy data, with structured JSON output
-    model_integrate = Model('integrate',  'gpt-4o-mini',
-                                    temperature = 1.3,    top_p = 0.90,   presence_penalty = 0.50,   frequency_penalty = 1.00).model.with_structured_output(method="json_mode")
+    model_integrate = Model('integrate',  **ROLE_PARAMETERS['integrate'],
+                                    http_pool = http_pool,   base_url = base_url).model.with_structured_output(method="json_mode", include_raw=True)
     
     log.info(f"model_generate_new, model_re_generate, model_verify models initialized")
     return model_generate_new, model_re_generate, model_verify, model_integrate
+
+def init_refine_model(log = None, http_pool = None, base_url = None):
+    """
+    Initialize the model for the single-call structured refine stage of subconcept generation.
+    Uses the re-generation settings with structured JSON output; the raw message is kept for token usage.
+    Shares the HTTP connection pool of init_models by default.
+    Returns the initialized model instance.
+    """
+    if not log:
+        log = logging.getLogger("init_refine_model()")
+        logging.basicConfig(level=logging.INFO)
+    log.info(f"init_refine_model()..")
+    http_pool = http_pool or default_pool()
+
+    # Refine model: Used for discarding and refining subconcepts at once, with structured JSON output
+    llm_refine              = Model('refine',       **ROLE_PARAMETERS['refine'],
+                                    http_pool = http_pool,   base_url = base_url)
+    log.info(f"{llm_refine.info}\nmodel init successfully..")
+    model_refine            = llm_refine.model.with_structured_output(method="json_mode", include_raw=True)
+    return model_refine
+
+def init_role_model(role:str, log = None, http_pool = None, base_url = None, model_checkpoint = None, api_key = None, max_retries = 2):
+    """
+    Initialize the model of one role (a key of ROLE_PARAMETERS) with the role's sampling parameters,
+    optionally on another OpenAI-compatible endpoint or checkpoint (e.g. a local server for src/routing.py).
+    Roles in STRUCTURED_ROLES return the structured-output runnable (JSON mode, include_raw=True), like init_models
+    and init_refine_model; e.g. init_role_model('score', log) creates the model for the batched criteria verification.
+    """
+    if not log:
+        log = logging.getLogger("init_role_model()")
+        logging.basicConfig(level=logging.INFO)
+    parameters = dict(ROLE_PARAMETERS[role])
+    if model_checkpoint:
+        parameters['model_checkpoint'] = model_checkpoint
+    llm = Model(role, **parameters, http_pool = http_pool or default_pool(), base_url = base_url, api_key = api_key, max_retries = max_retries)
+    log.info(f"{llm.info}\nbase url: {base_url}\nmodel init successfully..")
+    if role in STRUCTURED_ROLES:
+        return llm.model.with_structured_output(method="json_mode", include_raw=True)
+    return llm.model
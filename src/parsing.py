@@ -0,0 +1,337 @@
+import re
+import json
+import time
+import random
+import argparse
+
+# Opening quote -> closing quote, and opening bracket -> closing bracket
+QUOTES      = {'"': '"', "'": "'", '`': '`', '“': '”', '‘': '’', '«': '»'}
+BRACKETS    = {'(': ')', '[': ']', '{': '}'}
+CLOSERS     = set(BRACKETS.values())
+
+# List markers models put in front of items ("- ", "* ", "1. ", "2) ")
+ITEM_MARKER = re.compile(r'^(?:[-*•]+|\(?\d{1,3}[.)])\s+')
+MARKER_START = set('-*•(0123456789')
+INTEGER     = re.compile(r'\b\d+\b')
+# Answers that are only an ID list ("0, 3", "[1; 7]", "2 and 5.") or state that there are no IDs ("None", "No redundant lists.")
+ID_LIST     = re.compile(r'^[\[(]?\s*\d+(?:(?:\s*[,;]\s*|\s*\band\b\s*|\s+)\d+)*\s*[\])]?\.?$', re.IGNORECASE)
+NO_IDS      = re.compile(r'^(?:none|no\b.*|n/?a|nothing|\[\s*\]|-)?\.?$', re.IGNORECASE | re.DOTALL)
+CODE_FENCE  = re.compile(r'^```[a-zA-Z]*\s*|\s*```$')
+
+_special_patterns = {}
+
+def _special(separators:str):
+    # One compiled pattern per separator set, matching every character the tokenizer reacts to
+    if separators not in _special_patterns:
+        characters = set(separators) | set(QUOTES) | set(QUOTES.values()) | set(BRACKETS) | CLOSERS
+        _special_patterns[separators] = re.compile('[' + ''.join(re.escape(c) for c in sorted(characters)) + ']')
+    return _special_patterns[separators]
+
+def _tokenize(text:str, separators:str, aware:bool = True) -> list:
+    """
+    Split text on separators in a single pass over the special characters only.
+    Separators inside brackets, or inside quotes that open an item, do not split. If a quote or bracket
+    is never closed, the item it opened in is split again without quote and bracket awareness.
+    """
+    if not aware:
+        return re.split('[' + re.escape(separators) + ']', text)
+    items = []
+    start = 0
+    stack = []
+    quote = None
+    for match in _special(separators).finditer(text):
+        character, position = match.group(), match.start()
+        if quote:
+            # A closing quote only counts at the end of a word (apostrophes inside quotes are kept)
+            following = text[position + 1:position + 2]
+            if character == quote and (not following or following.isspace() or following in separators or following in CLOSERS or following in '.:!?'):
+                quote = None
+        elif character in separators and not stack:
+            items.append(text[start:position])
+            start = position + 1
+        elif character in BRACKETS:
+            stack.append(BRACKETS[character])
+        elif stack and character == stack[-1]:
+            stack.pop()
+        elif character in QUOTES and not stack and not text[start:position].strip():
+            # Quotes are only recognized at the start of an item, so apostrophes ("Men's") never open one
+            quote = QUOTES[character]
+    if quote or stack:
+        return items + _tokenize(text[start:], separators, aware = False)
+    items.append(text[start:])
+    return items
+
+def clean_item(item:str) -> str:
+    """
+    Normalize one list item: collapse whitespace, drop list markers, surrounding quotes and a trailing period.
+    """
+    item = ' '.join(item.split())
+    # Cheap first-character checks keep the regular expression off the common path
+    if item[:1] in MARKER_START:
+        item = ITEM_MARKER.sub('', item)
+    if len(item) >= 2 and item[0] in QUOTES and item[-1] == QUOTES[item[0]]:
+        item = item[1:-1].strip()
+    if item.endswith('.') and not item.endswith('..'):
+        item = item[:-1].rstrip()
+    return item
+
+def split_list(text:str, separators:str = ',', max_length = None) -> list:
+    """
+    Parse a separator-delimited model answer into a list of items.
+    Quote- and bracket-aware ("Field-effect transistor (FET, MOSFET)" stays one item); items are cleaned
+    with clean_item and empty items are dropped. Bulleted or numbered lists (models sometimes answer with
+    them instead), and texts without any separator but with several lines, give one item per line.
+
+    Args:
+        text (str): Model answer.
+        separators (str): Separator characters, e.g. ',' or ';'.
+        max_length (int, optional): Items longer than this (after cleaning) are dropped.
+
+    Returns:
+        list: The cleaned items in order.
+    """
+    if not text:
+        return []
+    lines = [line for line in text.splitlines() if line.strip()] if '\n' in text else []
+    if len(lines) > 1 and all(ITEM_MARKER.match(line.strip()) for line in lines):
+        # A bulleted or numbered list: one item per line, separators inside items are kept
+        items = lines
+    else:
+        items = _tokenize(text, separators)
+        if len(items) == 1 and len(lines) > 1:
+            items = lines
+    items = [clean_item(item) for item in items]
+    return [item for item in items if item and (max_length is None or len(item) <= max_length)]
+
+def parse_indices(text:str, count = None):
+    """
+    Parse the list IDs of an answer like "0, 2". Only answers that are purely an ID list (separated by
+    commas, semicolons, spaces or "and", optionally in brackets or a code fence) count; answers stating
+    that there are none ("None", "No redundant lists.") give an empty list. Integers in prose
+    ("keep list 2, the 5 best, discard 1") are not IDs: such answers give None.
+
+    Args:
+        text (str): Model answer.
+        count (int, optional): Number of valid IDs; IDs outside range(count) are ignored.
+
+    Returns:
+        list: Distinct IDs in order of appearance, or None if the answer is neither an ID list nor "None".
+    """
+    text = CODE_FENCE.sub('', (text or '').strip()).strip().strip('"\'`').strip()
+    if NO_IDS.match(text):
+        return []
+    if not ID_LIST.match(text):
+        return None
+    indices = []
+    for match in INTEGER.finditer(text):
+        index = int(match.group())
+        if (count is None or index < count) and index not in indices:
+            indices.append(index)
+    return indices
+
+def parse_json_object(text:str):
+    """
+    Parse a JSON object from a model answer, tolerating code fences and text around the object.
+    Returns the parsed dict, or None if no JSON object can be recovered (also for nesting too deep to decode).
+    """
+    if not text:
+        return None
+    text = CODE_FENCE.sub('', text.strip())
+    try:
+        value = json.loads(text)
+    except RecursionError:
+        return None
+    except ValueError:
+        # Retry with the outermost braces
+        first, last = text.find('{'), text.rfind('}')
+        if first < 0 or last <= first:
+            return None
+        try:
+            value = json.loads(text[first:last + 1])
+        except (ValueError, RecursionError):
+            return None
+    return value if isinstance(value, dict) else None
+
+def _flag(value):
+    # Booleans as models write them: true/false, "yes"/"no", 1/0
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str) and value.strip().lower() in ('true', 'yes', 'keep', 'kept', '1', 'false', 'no', 'drop', 'dropped', '0'):
+        return value.strip().lower() in ('true', 'yes', 'keep', 'kept', '1')
+    return None
+
+def parse_list_scores(value, ids) -> dict:
+    """
+    Parse per-list decisions like {"lists": [{"id": 0, "keep": true, "score": 0.9}, ...]} (or the bare list).
+    Entries with an ID outside ids or without a usable keep flag are ignored; IDs may be numeric strings,
+    keep may be written as "yes"/"no", and scores are clamped to [0, 1] (None if missing).
+
+    Args:
+        value: Parsed JSON answer.
+        ids: Valid list IDs (e.g. the global IDs of one group).
+
+    Returns:
+        dict: ID -> {'keep': bool, 'score': float or None}.
+    """
+    if isinstance(value, dict):
+        value = value.get('lists', value.get('criteria'))
+    if not isinstance(value, list):
+        return {}
+    ids = set(ids)
+    scores = {}
+    for entry in value:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get('id')
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        keep = _flag(entry.get('keep'))
+        if not isinstance(index, int) or isinstance(index, bool) or index not in ids or keep is None:
+            continue
+        score = entry.get('score')
+        try:
+            score = min(max(float(score), 0.0), 1.0)
+        except (TypeError, ValueError):
+            score = None
+        scores[index] = {'keep': keep, 'score': score}
+    return scores
+
+def _label(value):
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        label = clean_item(str(value))
+        return label or None
+    return None
+
+def _node(value):
+    # Nodes written as {"name": ..., "children": [...]} (also "label"/"subconcepts")
+    if isinstance(value, dict):
+        label = _label(value.get('name', value.get('label')))
+        if label is not None:
+            return label, value.get('children', value.get('subconcepts'))
+    return None
+
+def normalize_tree(value) -> dict:
+    """
+    Normalize a subconcept tree to the canonical form {parent: [children]}.
+    Accepts adjacency dicts (children as lists, comma-separated strings or nested dicts), fully nested dicts
+    ({"A": {"B": {}}}), name/children node objects and lists of them, optionally wrapped in {"taxonomy": ...}.
+    Labels are cleaned, children are de-duplicated in order, self-loops and empty labels are dropped,
+    and parents without children are omitted. Anything else yields an empty tree.
+    """
+    if isinstance(value, dict) and len(value) == 1 and next(iter(value)) in ('taxonomy', 'tree'):
+        value = next(iter(value.values()))
+    tree = {}
+    seen = {}
+
+    def add(parent, child):
+        if child is None or child == parent:
+            return
+        if child not in seen.setdefault(parent, set()):
+            seen[parent].add(child)
+            tree.setdefault(parent, []).append(child)
+
+    # Explicit stack of (parent label, children value), so deeply nested input cannot exhaust recursion
+    stack = []
+    if _node(value):
+        stack.append(_node(value))
+    elif isinstance(value, dict):
+        stack.extend((_label(key), children) for key, children in reversed(list(value.items())))
+    elif isinstance(value, list):
+        stack.extend(node for node in map(_node, reversed(value)) if node)
+    while stack:
+        parent, children = stack.pop()
+        if parent is None:
+            continue
+        if isinstance(children, str):
+            children = split_list(children, ',')
+        pending = []
+        if _node(children):
+            children = [children]
+        if isinstance(children, dict):
+            for key, grandchildren in children.items():
+                add(parent, _label(key))
+                pending.append((_label(key), grandchildren))
+        elif isinstance(children, list):
+            for child in children:
+                node = _node(child)
+                if node:
+                    add(parent, node[0])
+                    pending.append(node)
+                elif isinstance(child, dict):
+                    for key, grandchildren in child.items():
+                        add(parent, _label(key))
+                        pending.append((_label(key), grandchildren))
+                else:
+                    add(parent, _label(child))
+        stack.extend(reversed(pending))
+    return tree
+
+def parse_tree(message_content, parsed = None) -> dict:
+    """
+    Recover a canonical subconcept tree from a structured integration answer:
+    the parsed JSON if usable, otherwise the JSON object found in the raw message content.
+    Returns an empty dict if neither yields a tree.
+    """
+    tree = normalize_tree(parsed) if isinstance(parsed, (dict, list)) else {}
+    if not tree:
+        tree = normalize_tree(parse_json_object(message_content))
+    return tree
+
+def _fuzz_text(rng:random.Random, length:int) -> str:
+    # Random answer-like text: words, separators, quotes, brackets, list markers, digits and unicode
+    pieces = ['Transistor', 'MOSFET', "Men's", 'field-effect', 'None', 'the', '0', '12', '3.', '-', '*', '•',
+              ',', ', ', ';', '; ', '\n', '"', "'", '`', '“', '”', '(', ')', '[', ']', '{', '}', ':', '.',
+              '  ', '\t', 'été', '中文', '{"taxonomy": {"A": ["B", "C"]}}', '```json']
+    return ''.join(rng.choice(pieces) for _ in range(length))
+
+def benchmark(iterations:int = 20000, seed:int = 0, max_pieces:int = 120) -> dict:
+    """
+    Fuzz the parsers with random answer-like texts and measure their throughput.
+    Every parser must return a result of the expected type for every input (no exceptions),
+    also for nesting deeper than the recursion limit.
+
+    Returns:
+        dict: Parser name -> {'calls', 'seconds', 'mb_per_second'}; 'bytes' is the total input size.
+    """
+    rng = random.Random(seed)
+    texts = [_fuzz_text(rng, rng.randint(0, max_pieces)) for _ in range(iterations)]
+    total_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    parsers = {
+        'split_list_comma': lambda text: split_list(text, ',', 120),
+        'split_list_semicolon': lambda text: split_list(text, ';'),
+        'parse_indices': lambda text: parse_indices(text, 10),
+        'parse_tree': lambda text: parse_tree(text),
+        'str_split_baseline': lambda text: [v.strip() for v in text.split(',')],
+    }
+    expected = {'parse_tree': dict, 'parse_indices': (list, type(None))}
+    results = {'bytes': total_bytes}
+    for name, parser in parsers.items():
+        start_time = time.perf_counter()
+        for text in texts:
+            value = parser(text)
+            if not isinstance(value, expected.get(name, list)):
+                raise AssertionError(f"{name} returned {type(value).__name__} for {text!r}")
+        seconds = time.perf_counter() - start_time
+        results[name] = {'calls': iterations, 'seconds': seconds, 'mb_per_second': total_bytes / seconds / 1e6 if seconds else float('inf')}
+    # Nested input deep enough to break recursive parsers, as a value and as model output
+    deep = {}
+    for level in range(5000):
+        deep = {f'level {level}': deep}
+    normalize_tree(deep)
+    deep_text = '{"taxonomy": ' * 100000 + '[]' + '}' * 100000
+    for name, parser in parsers.items():
+        if not isinstance(parser(deep_text), expected.get(name, list)):
+            raise AssertionError(f"{name} failed on deeply nested input")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz benchmark of the answer parsers")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    results = benchmark(args.iterations, args.seed)
+    print(f"{args.iterations} fuzzed answers, {results.pop('bytes') / 1e6:.2f} MB")
+    for name, result in results.items():
+        print(f"{name:24s} {result['seconds']:8.3f} s  {result['mb_per_second']:8.2f} MB/s  {result['seconds'] / result['calls'] * 1e6:8.1f} us/call")
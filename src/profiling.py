@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import Counter
+
+# Active profiler and the phase path ("create_taxonomy/commit/save") of the current thread or task.
+# Both are context variables, so asyncio tasks and DAG worker threads (which run in a copied context)
+# attribute their phases to the run that started them.
+_profiler   = contextvars.ContextVar('profiler', default=None)
+_path       = contextvars.ContextVar('profile_path', default='')
+
+def current_profiler():
+    """
+    Return the active Profiler of the current context, or None if profiling is off.
+    """
+    return _profiler.get()
+
+class Phase:
+    """
+    Context manager and decorator timing one phase of a run (wall time and CPU time of the current thread).
+    Phases nest: a phase entered inside another one is recorded under the path "outer/inner".
+    Without an active Profiler, entering a phase costs one context variable lookup.
+
+    Usage:
+        with Phase('save'):
+            ...
+
+        @Phase('integrate_subconcepts')
+        def integrate_subconcepts(...):
+            ...
+    """
+    __slots__ = ('name', 'profiler', 'path', 'previous', 'start_wall', 'start_cpu')
+
+    def __init__(self, name:str) -> None:
+        self.name       = name
+        self.profiler   = None
+
+    def __enter__(self) -> 'Phase':
+        profiler = _profiler.get()
+        if profiler is None:
+            return self
+        self.profiler   = profiler
+        self.previous   = _path.get()
+        self.path       = f"{self.previous}/{self.name}" if self.previous else self.name
+        _path.set(self.path)
+        profiler.enter(self.path)
+        self.start_wall = time.perf_counter()
+        self.start_cpu  = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        if self.profiler is None:
+            return False
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        # Restore the previous path by value (not by token), so a phase left open in a generator
+        # that is closed from another context cannot raise
+        _path.set(self.previous)
+        self.profiler.exit(self.path, wall, cpu)
+        self.profiler = None
+        return False
+
+    def __call__(self, function):
+        name = self.name
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                if _profiler.get() is None:
+                    return await function(*args, **kwargs)
+                with Phase(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if _profiler.get() is None:
+                    return function(*args, **kwargs)
+                with Phase(name):
+                    return function(*args, **kwargs)
+        return wrapper
+
+class Profiler:
+    """
+    Collects per-phase timings of a run: calls, wall time and CPU time (so time spent waiting on the
+    network shows up as wall minus CPU). Times are inclusive; report() also shows the self time of a phase
+    without its sub-phases. CPU time is the thread CPU time, which for asyncio phases includes the tasks
+    interleaved on the same event loop thread.
+
+    With sample_interval (seconds), a sampling thread records the Python stack of every thread inside a phase;
+    the samples are kept per innermost phase as collapsed stacks ("frame;frame;frame count", the input format
+    of flamegraph.pl and speedscope) and written to collapsed_path when the profiler is deactivated.
+
+    Usage:
+        with Profiler(sample_interval = 0.005, collapsed_path = "data/profiles") as profiler:
+            taxonomy = create_taxonomy(...)
+        log.info(profiler.report())
+    """
+    def __init__(self, enabled:bool = True, sample_interval = None, collapsed_path = None) -> None:
+        self.enabled            = enabled
+        self.sample_interval    = sample_interval
+        self.collapsed_path     = collapsed_path
+        # Phase path -> [calls, wall seconds, cpu seconds]
+        self.phases             = {}
+        # Phase path -> Counter of collapsed stacks
+        self.samples            = {}
+        # Thread ID -> stack of the phase paths entered on that thread, read by the sampling thread
+        self.thread_phases      = {}
+        self.lock               = threading.Lock()
+        self.stop_event         = threading.Event()
+        self.sampler            = None
+        self.tokens             = []
+
+    @classmethod
+    def from_config(cls, config) -> 'Profiler':
+        """
+        Create a profiler from a config dict with the keys 'enabled', 'sample_interval' and 'collapsed_path'
+        (missing keys take the defaults; a missing or empty config gives a disabled profiler).
+        """
+        config = dict(config or {'enabled': False})
+        return cls(config.get('enabled', True), config.get('sample_interval'), config.get('collapsed_path'))
+
+    def enter(self, path:str) -> None:
+        """
+        Called by Phase when a phase starts.
+        """
+        if self.sampler is not None:
+            self.thread_phases.setdefault(threading.get_ident(), []).append(path)
+
+    def exit(self, path:str, wall:float, cpu:float) -> None:
+        """
+        Called by Phase when a phase ends: add its timings.
+        """
+        with self.lock:
+            totals = self.phases.setdefault(path, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+        stack = self.thread_phases.get(threading.get_ident()) if self.sampler is not None else None
+        if stack and path in stack:
+            # Interleaved asyncio tasks can leave phases out of order, so remove the latest entry of this path
+            del stack[len(stack) - 1 - stack[::-1].index(path)]
+
+    def __enter__(self) -> 'Profiler':
+        if self.enabled:
+            self.tokens.append((_profiler.set(self), _path.set('')))
+            if self.sample_interval:
+                self.stop_event.clear()
+                self.sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+                self.sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if not self.enabled:
+            return
+        profiler_token, path_token = self.tokens.pop()
+        _path.reset(path_token)
+        _profiler.reset(profiler_token)
+        if self.sampler is not None:
+            self.stop_event.set()
+            self.sampler.join()
+            self.sampler = None
+            self.thread_phases.clear()
+            if self.collapsed_path:
+                self.write_collapsed(self.collapsed_path)
+
+    def _sample(self) -> None:
+        # Runs in the sampling thread until the profiler is deactivated
+        own_thread = threading.get_ident()
+        while not self.stop_event.wait(self.sample_interval):
+            frames = sys._current_frames()
+            for thread_id, paths in list(self.thread_phases.items()):
+                # Copy first: the thread may leave its phase while it is sampled
+                innermost = paths[-1:]
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_thread or not innermost:
+                    continue
+                path = innermost[0]
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self.lock:
+                    self.samples.setdefault(path, Counter())[';'.join(reversed(stack))] += 1
+
+    def summary(self) -> dict:
+        """
+        Return phase path -> {'calls', 'wall', 'cpu', 'wait', 'self_wall'} in seconds, in tree order.
+        wait is wall minus CPU time (network and lock waits); self_wall excludes the direct sub-phases.
+        """
+        with self.lock:
+            phases = {path: list(totals) for path, totals in self.phases.items()}
+        children_wall = Counter()
+        for path, (calls, wall, cpu) in phases.items():
+            if '/' in path:
+                children_wall[path.rsplit('/', 1)[0]] += wall
+        return {path: {
+            'calls': calls,
+            'wall': wall,
+            'cpu': cpu,
+            'wait': max(wall - cpu, 0.0),
+            'self_wall': max(wall - children_wall[path], 0.0)
+        } for path, (calls, wall, cpu) in sorted(phases.items())}
+
+    def report(self) -> str:
+        """
+        Format the summary as an indented table (one row per phase, sub-phases below their parent).
+        """
+        lines = [f"{'phase':48s} {'calls':>7s} {'wall s':>9s} {'cpu s':>9s} {'wait s':>9s} {'self s':>9s}"]
+        for path, stats in self.summary().items():
+            label = '  ' * path.count('/') + path.rsplit('/', 1)[-1]
+            lines.append(f"{label:48s} {stats['calls']:7d} {stats['wall']:9.3f} {stats['cpu']:9.3f} {stats['wait']:9.3f} {stats['self_wall']:9.3f}")
+        return '\n'.join(lines)
+
+    def collapsed(self, path = None) -> list:
+        """
+        Return the sampled collapsed stack lines of one phase (or of all phases, prefixed with the phase path).
+        """
+        with self.lock:
+            samples = {phase: Counter(stacks) for phase, stacks in self.samples.items()}
+        if path is not None:
+            return [f"{stack} {count}" for stack, count in samples.get(path, Counter()).most_common()]
+        return [f"{phase.replace('/', ';')};{stack} {count}" for phase, stacks in sorted(samples.items()) for stack, count in stacks.most_common()]
+
+    def write_collapsed(self, directory:str) -> list:
+        """
+        Write the collapsed stacks of every sampled phase to <directory>/<phase path>.collapsed
+        (path separators replaced by dots) plus all.collapsed with every phase. Returns the written paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        with self.lock:
+            phases = sorted(self.samples)
+        for path in phases + [None]:
+            file_path = os.path.join(directory, (path.replace('/', '.') if path else 'all') + '.collapsed')
+            with open(file_path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(self.collapsed(path)) + '\n')
+            written.append(file_path)
+        return written
@@ -0,0 +1,286 @@
+import os
+import time
+import logging
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+from langchain_core.messages import AIMessage
+
+from src.models import Taxonomy, default_save_path
+from src.taxonomy_file import FILE_EXTENSION
+from src.parsing import parse_json_object
+from src.profiling import Phase
+from src.responses import prompt_key
+from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+
+class ReplayMiss(LookupError):
+    """
+    Raised when a replayed call has no recorded response (a new prompt in 'prompt' mode, or no records left).
+    """
+
+def replay_response(record, structured:bool = False):
+    """
+    Rebuild a model output from a ResponseRecord: an AIMessage with the recorded content and token usage,
+    wrapped as {'raw', 'parsed', 'parsing_error'} (like with_structured_output(include_raw=True)) if structured.
+    """
+    message = AIMessage(content=record.content, response_metadata=record.response_metadata)
+    if not structured:
+        return message
+    parsed = parse_json_object(message.content)
+    return {
+        'raw': message,
+        'parsed': parsed,
+        'parsing_error': None if parsed is not None else ValueError("recorded content is not a JSON object")
+    }
+
+class Replay:
+    """
+    Serves the recorded responses of a taxonomy to ReplayModels instead of calling an endpoint.
+
+    In 'prompt' mode every call is answered with the record of the same rendered prompt (see prompt_key);
+    identical prompts get their records in recorded order, and a prompt that was never recorded raises
+    ReplayMiss. This works with concurrent steps, but a changed prompt template or parser output that
+    changes later prompts stops the replay. In 'order' mode the records are served in recorded order
+    regardless of the prompt, so the run continues after such changes; calls whose prompt differs from
+    the record are counted in prompt_mismatches. 'order' needs a serial run (max_workers = 1), since
+    the records are in commit order.
+    """
+    def __init__(self, taxonomy:Taxonomy, mode:str = 'prompt') -> None:
+        if mode not in ('prompt', 'order'):
+            raise ValueError(f"Unknown replay mode: {mode}")
+        self.mode               = mode
+        self.records            = list(taxonomy.responses)
+        # Prompt key -> indices of the records with that prompt, in recorded order
+        self.by_prompt          = {}
+        for index, record in enumerate(self.records):
+            self.by_prompt.setdefault(record.prompt_key, deque()).append(index)
+        self.position           = 0
+        self.lock               = threading.Lock()
+        # Counters
+        self.served             = 0
+        self.prompt_mismatches  = 0
+
+    def next_record(self, prompt):
+        """
+        Return the record answering the given prompt (see the class docstring for the modes).
+        """
+        key = prompt_key(prompt)
+        with self.lock:
+            if self.mode == 'prompt':
+                indices = self.by_prompt.get(key)
+                if not indices:
+                    raise ReplayMiss(f"no recorded response for prompt {key[:12]} (call {self.served + 1})")
+                record = self.records[indices.popleft()]
+            else:
+                if self.position >= len(self.records):
+                    raise ReplayMiss(f"all {len(self.records)} recorded responses were served")
+                record = self.records[self.position]
+                self.position += 1
+                if record.prompt_refs and record.prompt_key != key:
+                    self.prompt_mismatches += 1
+            self.served += 1
+        return record
+
+    def model(self, structured:bool = False) -> 'ReplayModel':
+        """
+        Create a model answering from this replay (structured for the JSON-output roles).
+        """
+        return ReplayModel(self, structured)
+
+    def metrics(self) -> dict:
+        """
+        Counters: recorded responses, responses served, unused records and prompts that differed from the record.
+        """
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'recorded': len(self.records),
+                'served': self.served,
+                'unused': len(self.records) - self.served,
+                'prompt_mismatches': self.prompt_mismatches
+            }
+
+class ReplayModel:
+    """
+    Stand-in for a chat model (or a structured-output runnable with include_raw=True) returning recorded responses.
+    Invocation parameters (e.g. max_tokens) are ignored.
+    """
+    def __init__(self, replay:Replay, structured:bool = False) -> None:
+        self.replay     = replay
+        self.structured = structured
+
+    def invoke(self, prompt, **kwargs):
+        return replay_response(self.replay.next_record(prompt), self.structured)
+
+    async def ainvoke(self, prompt, **kwargs):
+        return self.invoke(prompt, **kwargs)
+
+def replay_run(
+    recorded: Taxonomy,
+    mode: str = 'prompt',
+    stop_at_depth = 'recorded',
+    max_subconcepts_per_iteration = 'recorded',
+    criteria_batch_size = 'recorded',
+    integrate: bool = None,
+    max_workers: int = 4,
+    save_path = None,
+    log = None
+):
+    """
+    Re-run create_taxonomy, generate_subconcepts_for_all_ranks and (optionally) integrate_subconcepts
+    for the root concept of a recorded taxonomy, answering every model call from its recorded responses.
+    Only the local work remains (prompt formatting, parsing, commits and saves), so the run profiles the
+    non-network part of the pipeline and checks parser or workflow changes against a known run (see diff_taxonomies).
+
+    The parameters that shape the prompts (depth, max_subconcepts_per_iteration, criteria_batch_size and
+    the refine mode) are taken from the recorded Taxonomy.run_parameters by default. Taxonomies recorded
+    before they were stored fall back to the deepest recorded depth, the refine mode seen in the responses,
+    15 subconcepts and no criteria batching.
+
+    Args:
+        recorded (Taxonomy): The recorded taxonomy (fully loaded, with its responses).
+        mode (str): 'prompt' or 'order', see Replay.
+        stop_at_depth (int, optional): Depth limit of the subconcept generation ('recorded' by default).
+        max_subconcepts_per_iteration (int): Subconcepts requested per iteration ('recorded' by default).
+        criteria_batch_size (int, optional): Criteria lists per scoring call, see taxonomy_steps ('recorded' by default).
+        integrate (bool, optional): Replay the integration as well (by default if it was recorded).
+        max_workers (int): Concurrent steps of create_taxonomy (1 in 'order' mode).
+        save_path (str, optional): Directory the replayed taxonomy is saved to (a temporary directory by default,
+            removed afterwards; the returned taxonomy then saves to the default directory).
+        log (logging.Logger, optional): Logger for info/debug output.
+
+    Returns:
+        tuple: (replayed Taxonomy, report dict with per-stage wall and CPU seconds, calls and calls per second).
+    """
+    if not log:
+        log = logging.getLogger("replay_run()")
+        logging.basicConfig(level=logging.INFO)
+    templates = {record.template_id for record in recorded.responses}
+    parameters = recorded.run_parameters
+    refine_mode = parameters.get('refine_mode') or ("structured" if 'refine_subconcepts' in templates else "two_call")
+    if stop_at_depth == 'recorded':
+        stop_at_depth = parameters['stop_at_depth'] if 'stop_at_depth' in parameters else (max(recorded.depths) if recorded.depths else None) or None
+    if max_subconcepts_per_iteration == 'recorded':
+        max_subconcepts_per_iteration = parameters.get('max_subconcepts_per_iteration') or 15
+    if criteria_batch_size == 'recorded':
+        criteria_batch_size = parameters.get('criteria_batch_size')
+    if integrate is None:
+        integrate = 'integrate_subconcepts' in templates
+    if mode == 'order':
+        max_workers = 1
+
+    replay = Replay(recorded, mode)
+    model_plain, model_structured = replay.model(), replay.model(structured = True)
+    stages = {}
+
+    def timed(stage, function, *args, **kwargs):
+        served, wall, cpu = replay.served, time.perf_counter(), time.process_time()
+        value = function(*args, **kwargs)
+        stages[stage] = {'calls': replay.served - served, 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu}
+        return value
+
+    with tempfile.TemporaryDirectory(prefix = "replay_") as temporary_path:
+        with Phase('replay'):
+            taxonomy = timed('create_taxonomy', create_taxonomy, model_plain, model_plain, recorded.root_concept, log,
+                             max_workers, save_path or temporary_path, criteria_batch_size, model_structured)
+            taxonomy = timed('generate_subconcepts', generate_subconcepts_for_all_ranks, model_plain, model_plain, taxonomy,
+                             stop_at_depth, max_subconcepts_per_iteration, log, refine_mode, model_structured)
+            if integrate:
+                taxonomy = timed('integrate_subconcepts', integrate_subconcepts, model_structured, taxonomy, log)
+        if not save_path:
+            # The temporary directory is removed: later saves go to the default directory
+            taxonomy.save_path = default_save_path()
+            taxonomy.saved_to = [os.path.join(taxonomy.save_path, taxonomy.name + FILE_EXTENSION)]
+
+    calls = sum(stage['calls'] for stage in stages.values())
+    wall = sum(stage['wall'] for stage in stages.values())
+    report = {
+        'stages': stages,
+        'calls': calls,
+        'wall': wall,
+        'cpu': sum(stage['cpu'] for stage in stages.values()),
+        'calls_per_second': calls / wall if wall else None,
+        # Model time of the recorded run, for comparison with the local time
+        'recorded_latency': sum(record.latency or 0.0 for record in recorded.responses),
+        'replay': replay.metrics()
+    }
+    log.info(f"replayed {recorded.name}: {calls} calls in {wall:.3f}s ({report['calls_per_second'] or 0:.1f} calls/s, recorded model time {report['recorded_latency']:.1f}s)\n")
+    return taxonomy, report
+
+def _list_diff(original:list, replayed:list) -> dict:
+    # Items only in one of the two lists, in list order
+    return {
+        'removed': [v for v in original if v not in replayed],
+        'added': [v for v in replayed if v not in original]
+    }
+
+def _tree_edges(tree) -> set:
+    return {(parent, child) for parent, children in (tree or {}).items() for child in children}
+
+def diff_taxonomies(original: Taxonomy, replayed: Taxonomy) -> dict:
+    """
+    Compare the ranks, plain subconcept lists and subconcept trees of two taxonomies rank list by rank list.
+
+    Returns:
+        dict: 'identical' and, per field, the differing rank lists: ranks with both versions,
+        subconcepts_plain with the removed and added subconcepts, subconcepts_trees with the removed
+        and added (parent, child) edges. A rank list present in only one taxonomy counts as a difference
+        of every field (compared with an empty value).
+    """
+    count = max(len(original.ranks), len(replayed.ranks))
+
+    def value(taxonomy, field, i, empty):
+        values = getattr(taxonomy, field)
+        return values[i] if i < len(values) else empty
+
+    diff = {'ranks': [], 'subconcepts_plain': [], 'subconcepts_trees': []}
+    for i in range(count):
+        ranks = (list(value(original, 'ranks', i, [])), list(value(replayed, 'ranks', i, [])))
+        if ranks[0] != ranks[1]:
+            diff['ranks'].append({'index': i, 'original': ranks[0], 'replayed': ranks[1]})
+        plain = (list(value(original, 'subconcepts_plain', i, [])), list(value(replayed, 'subconcepts_plain', i, [])))
+        if plain[0] != plain[1]:
+            diff['subconcepts_plain'].append({'index': i, **_list_diff(*plain)})
+        edges = (_tree_edges(value(original, 'subconcepts_trees', i, {})), _tree_edges(value(replayed, 'subconcepts_trees', i, {})))
+        if edges[0] != edges[1]:
+            diff['subconcepts_trees'].append({'index': i, 'removed': sorted(edges[0] - edges[1]), 'added': sorted(edges[1] - edges[0])})
+    diff['identical'] = not any(diff[field] for field in ('ranks', 'subconcepts_plain', 'subconcepts_trees'))
+    return diff
+
+def format_diff(diff:dict) -> str:
+    """
+    Format the result of diff_taxonomies as readable text.
+    """
+    if diff['identical']:
+        return "ranks, plain subconcepts and trees are identical"
+    lines = []
+    for entry in diff['ranks']:
+        lines.append(f"ranks[{entry['index']}]:\n  - {entry['original']}\n  + {entry['replayed']}")
+    for entry in diff['subconcepts_plain']:
+        # Same items in a different order show up with empty removed/added lists
+        lines.append(f"subconcepts_plain[{entry['index']}]:\n  - {entry['removed']}\n  + {entry['added']}")
+    for entry in diff['subconcepts_trees']:
+        lines.append(f"subconcepts_trees[{entry['index']}]:\n  - {entry['removed']}\n  + {entry['added']}")
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded taxonomy without model calls and diff the result")
+    parser.add_argument("path", help="Recorded taxonomy file")
+    parser.add_argument("--mode", choices=["prompt", "order"], default="prompt")
+    parser.add_argument("--depth", type=int, help="Depth limit (recorded value by default)")
+    parser.add_argument("--max-subconcepts", type=int, help="Subconcepts per iteration (recorded value by default)")
+    parser.add_argument("--criteria-batch-size", type=int, help="Criteria lists per scoring call (recorded value by default)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # Options that are not given keep the recorded run parameters
+    recorded_or = lambda value: 'recorded' if value is None else value
+    recorded = Taxonomy.load(args.path)
+    replayed, report = replay_run(recorded, args.mode, recorded_or(args.depth), recorded_or(args.max_subconcepts),
+                                  recorded_or(args.criteria_batch_size), log = logging.getLogger("replay"))
+    for stage, stats in report['stages'].items():
+        print(f"{stage:24s} {stats['calls']:6d} calls {stats['wall']:9.3f}s wall {stats['cpu']:9.3f}s cpu")
+    print(f"{'total':24s} {report['calls']:6d} calls {report['wall']:9.3f}s wall, {report['calls_per_second'] or 0:.1f} calls/s "
+          f"(recorded model time {report['recorded_latency']:.1f}s), {report['replay']}")
+    print(format_diff(diff_taxonomies(recorded, replayed)))
@@ -0,0 +1,388 @@
+import os
+import re
+import copy
+import json
+import pickle
+import hashlib
+import sqlite3
+import threading
+from collections import deque
+from itertools import islice
+
+from src.models import Taxonomy
+from src.responses import ResponseRecord
+from src.taxonomy_file import SECTIONS, compress, decode_section, default_codec
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS taxonomies (
+    id              INTEGER PRIMARY KEY,
+    name            TEXT NOT NULL UNIQUE,
+    root_concept    TEXT NOT NULL,
+    root_norm       TEXT NOT NULL,
+    created_at      TEXT,
+    last_edit_time  TEXT,
+    prompt_tokens   INTEGER,
+    completion_tokens INTEGER,
+    total_tokens    INTEGER,
+    summary         TEXT
+);
+CREATE TABLE IF NOT EXISTS sections (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    name            TEXT NOT NULL,
+    codec           TEXT NOT NULL,
+    data            BLOB NOT NULL,
+    PRIMARY KEY (taxonomy_id, name)
+);
+CREATE TABLE IF NOT EXISTS ranks (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    rank_list       INTEGER NOT NULL,
+    position        INTEGER NOT NULL,
+    label           TEXT NOT NULL,
+    label_norm      TEXT NOT NULL,
+    depth           INTEGER
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    rank_list       INTEGER NOT NULL,
+    node_id         INTEGER NOT NULL,
+    label           TEXT NOT NULL,
+    label_norm      TEXT NOT NULL,
+    depth           INTEGER,
+    PRIMARY KEY (taxonomy_id, rank_list, node_id)
+);
+CREATE TABLE IF NOT EXISTS edges (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    rank_list       INTEGER NOT NULL,
+    parent_id       INTEGER NOT NULL,
+    child_id        INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calls (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    seq             INTEGER NOT NULL,
+    template_id     TEXT,
+    prompt_tokens   INTEGER,
+    completion_tokens INTEGER,
+    total_tokens    INTEGER,
+    latency         REAL,
+    content_ref     TEXT,
+    prompt_refs     TEXT,
+    payload_ref     TEXT
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    taxonomy_id     INTEGER NOT NULL REFERENCES taxonomies(id) ON DELETE CASCADE,
+    ref             TEXT NOT NULL,
+    data            BLOB NOT NULL,
+    PRIMARY KEY (taxonomy_id, ref)
+);
+CREATE INDEX IF NOT EXISTS idx_taxonomies_root_norm ON taxonomies(root_norm);
+CREATE INDEX IF NOT EXISTS idx_ranks_label_norm ON ranks(label_norm);
+CREATE INDEX IF NOT EXISTS idx_ranks_taxonomy ON ranks(taxonomy_id, rank_list);
+CREATE INDEX IF NOT EXISTS idx_nodes_label_norm ON nodes(label_norm);
+CREATE INDEX IF NOT EXISTS idx_edges_taxonomy ON edges(taxonomy_id, rank_list, parent_id);
+CREATE INDEX IF NOT EXISTS idx_calls_taxonomy ON calls(taxonomy_id, seq);
+CREATE INDEX IF NOT EXISTS idx_calls_template ON calls(template_id);
+'''
+
+def normalize_label(label:str) -> str:
+    """
+    Normalize a concept or rank label for indexed lookups: case-folded, single-spaced, without surrounding punctuation.
+    """
+    return re.sub(r'\s+', ' ', str(label)).strip(' \t.,;:"\'').casefold()
+
+def tree_nodes_and_edges(tree:dict) -> tuple:
+    """
+    Flatten a subconcept tree ({parent: [children]}) into nodes and edges.
+    Roots are keys that never appear as a child; depths are assigned breadth-first from the roots.
+
+    Returns:
+        tuple: (list of (node_id, label, depth), list of (parent_id, child_id))
+    """
+    if not isinstance(tree, dict):
+        return [], []
+    node_ids = {}
+    nodes = []
+    def node_id(label):
+        if label not in node_ids:
+            node_ids[label] = len(nodes)
+            nodes.append([node_ids[label], label, None])
+        return node_ids[label]
+    children = {str(parent): [str(child) for child in (values if isinstance(values, list) else [values])] for parent, values in tree.items()}
+    child_labels = {child for values in children.values() for child in values}
+    roots = [parent for parent in children if parent not in child_labels] or list(children)[:1]
+    edges = []
+    seen_edges = set()
+    for root in roots:
+        nodes[node_id(root)][2] = 0
+    queue = deque((root, 0) for root in roots)
+    while queue:
+        parent, depth = queue.popleft()
+        for child in children.get(parent, []):
+            edge = (node_id(parent), node_id(child))
+            if edge in seen_edges:
+                continue
+            seen_edges.add(edge)
+            edges.append(edge)
+            if nodes[edge[1]][2] is None:
+                nodes[edge[1]][2] = depth + 1
+                queue.append((child, depth + 1))
+    # Labels only reachable through cycles keep an unknown depth
+    for parent in children:
+        node_id(parent)
+    return [tuple(node) for node in nodes], edges
+
+class TaxonomyRepository:
+    """
+    Local SQLite-backed store for taxonomies.
+    Keeps the taxonomy file sections for loading, and flattened ranks, nodes, edges and calls
+    with indexes on root concept, normalized label and rank for cross-run queries without deserializing taxonomies.
+    Response records are stored as call rows and the chunks of an in-memory blob store as blob rows (both only
+    appended), so the 'responses' section only holds the blob store settings and the payload store.
+    """
+    def __init__(self, db_path = None, codec = None) -> None:
+        # Default database next to the saved taxonomy files
+        self.db_path        = db_path or os.path.join(os.getcwd(), "data", "taxonomies.sqlite")
+        self.codec          = codec or default_codec()
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.connection     = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        # Repositories created before calls kept whole response records have no prompt and payload references
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(calls)")}
+        for column in ('prompt_refs', 'payload_ref'):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE calls ADD COLUMN {column} TEXT")
+        # A single connection is shared between threads, so access is serialized
+        self.lock           = threading.Lock()
+        # Taxonomy name -> what the last save through this repository wrote (row ID, section digests,
+        # rank and tree rows per rank list, number of calls, blob store and number of its chunks),
+        # so later saves only write what changed
+        self.saved          = {}
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        self.connection.close()
+
+    def save(self, taxonomy:Taxonomy, overwrite:bool = False) -> str:
+        """
+        Write the taxonomy and its flattened ranks, nodes, edges, calls and blobs in one transaction.
+        The first save of a name through this repository replaces the rows of any previous save of the same
+        taxonomy; later saves only rewrite changed sections and rank lists and append the new calls and blob
+        chunks, so saving after every model call stays proportional to what the call changed. Sections are
+        pickled on every save to detect changes, but only changed ones are compressed and written.
+
+        Args:
+            taxonomy (Taxonomy): The taxonomy to save (not partially loaded).
+            overwrite (bool): Replace a stored taxonomy with the same name but another root concept or creation time.
+
+        Raises:
+            ValueError: If another taxonomy is stored under the same name and overwrite is False.
+
+        Returns:
+            str: The taxonomy name.
+        """
+        sections = taxonomy.to_sections()
+        # Response records and in-memory blob chunks are written as rows below
+        sections['responses'] = {'blobs': self._blob_settings(taxonomy.blobs), 'payload_store': taxonomy.payload_store}
+        pickled = {name: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for name, value in sections.items()}
+        section_digests = {name: hashlib.sha256(data).digest() for name, data in pickled.items()}
+        rank_rows = {}
+        for rank_list, ranks in enumerate(taxonomy.ranks):
+            depth = taxonomy.depths[rank_list] if rank_list < len(taxonomy.depths) else None
+            rank_rows[rank_list] = tuple((rank_list, position, label, normalize_label(label), depth) for position, label in enumerate(ranks))
+        tree_rows = {}
+        for rank_list, tree in enumerate(taxonomy.subconcepts_trees):
+            nodes, edges = tree_nodes_and_edges(tree)
+            if not nodes and rank_list < len(taxonomy.subconcepts_plain):
+                # Not integrated yet: index the plain subconcepts without structure
+                nodes = [(node_id, label, None) for node_id, label in enumerate(dict.fromkeys(taxonomy.subconcepts_plain[rank_list]))]
+            tree_rows[rank_list] = (tuple((rank_list, node_id, label, normalize_label(label), depth) for node_id, label, depth in nodes),
+                                    tuple((rank_list, parent_id, child_id) for parent_id, child_id in edges))
+        created_at = taxonomy.created_at.isoformat()
+        values = (taxonomy.root_concept, normalize_label(taxonomy.root_concept), created_at, taxonomy.last_edit_time.isoformat(),
+                  taxonomy.token_usage['prompt_tokens'], taxonomy.token_usage['completion_tokens'], taxonomy.token_usage['total_tokens'], json.dumps(taxonomy.summary()))
+
+        with self.lock, self.connection:
+            previous = self.saved.pop(taxonomy.name, None)
+            row = self.connection.execute("SELECT id, root_concept, created_at FROM taxonomies WHERE name = ?", (taxonomy.name,)).fetchone()
+            other = row is not None and (row[1], row[2]) != (taxonomy.root_concept, created_at)
+            if other and not overwrite:
+                raise ValueError(f"Repository already holds another taxonomy named {taxonomy.name} "
+                                 f"(root concept {row[1]!r}, created at {row[2]}); pass overwrite=True to replace it")
+            if previous is None or row is None or row[0] != previous['id'] or other:
+                # Unknown to this repository (or replaced elsewhere): rewrite all rows
+                self.connection.execute("DELETE FROM taxonomies WHERE name = ?", (taxonomy.name,))
+                cursor = self.connection.execute(
+                    "INSERT INTO taxonomies (name, root_concept, root_norm, created_at, last_edit_time, prompt_tokens, completion_tokens, total_tokens, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (taxonomy.name,) + values
+                )
+                previous = {'id': cursor.lastrowid, 'sections': {}, 'ranks': {}, 'trees': {}, 'calls': 0, 'blob_store': None, 'blobs': 0}
+            else:
+                self.connection.execute(
+                    "UPDATE taxonomies SET root_concept = ?, root_norm = ?, created_at = ?, last_edit_time = ?, prompt_tokens = ?, completion_tokens = ?, total_tokens = ?, summary = ? WHERE id = ?",
+                    values + (previous['id'],)
+                )
+            taxonomy_id = previous['id']
+            self.connection.executemany("INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?)",
+                                        [(taxonomy_id, name, self.codec, compress(data, self.codec))
+                                         for name, data in pickled.items() if previous['sections'].get(name) != section_digests[name]])
+            for rank_list in set(previous['ranks']) | set(rank_rows):
+                rows = rank_rows.get(rank_list, ())
+                if previous['ranks'].get(rank_list) != rows:
+                    self.connection.execute("DELETE FROM ranks WHERE taxonomy_id = ? AND rank_list = ?", (taxonomy_id, rank_list))
+                    self.connection.executemany("INSERT INTO ranks VALUES (?, ?, ?, ?, ?, ?)", [(taxonomy_id,) + row for row in rows])
+            for rank_list in set(previous['trees']) | set(tree_rows):
+                node_rows, edge_rows = tree_rows.get(rank_list, ((), ()))
+                if previous['trees'].get(rank_list) != (node_rows, edge_rows):
+                    self.connection.execute("DELETE FROM nodes WHERE taxonomy_id = ? AND rank_list = ?", (taxonomy_id, rank_list))
+                    self.connection.execute("DELETE FROM edges WHERE taxonomy_id = ? AND rank_list = ?", (taxonomy_id, rank_list))
+                    self.connection.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", [(taxonomy_id,) + row for row in node_rows])
+                    self.connection.executemany("INSERT INTO edges VALUES (?, ?, ?, ?)", [(taxonomy_id,) + row for row in edge_rows])
+            # Chunks are only added to a blob store, so only the chunks added since the last save are written
+            # (all of them, ignoring stored ones, if the taxonomy got another store); directory-backed stores keep their chunks on disk
+            chunks = taxonomy.blobs.chunks if taxonomy.blobs.path is None else {}
+            first_blob = previous['blobs'] if previous['blob_store'] is taxonomy.blobs else 0
+            self.connection.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)",
+                                        [(taxonomy_id, ref, chunk) for ref, chunk in islice(chunks.items(), first_blob, None)])
+            # Response records are only appended, so only the new calls are written
+            first_call = previous['calls']
+            if len(taxonomy.responses) < first_call:
+                self.connection.execute("DELETE FROM calls WHERE taxonomy_id = ?", (taxonomy_id,))
+                first_call = 0
+            self.connection.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                        [(taxonomy_id, seq, v.template_id, v.prompt_tokens, v.completion_tokens, v.total_tokens, v.latency, v.content_ref,
+                                          json.dumps(v.prompt_refs), v.payload_ref)
+                                         for seq, v in enumerate(taxonomy.responses[first_call:], first_call)])
+            saved = {'id': taxonomy_id, 'sections': section_digests, 'ranks': rank_rows, 'trees': tree_rows, 'calls': len(taxonomy.responses),
+                     'blob_store': taxonomy.blobs, 'blobs': len(chunks)}
+        # Only remembered once the transaction is committed
+        self.saved[taxonomy.name] = saved
+        return taxonomy.name
+
+    @staticmethod
+    def _blob_settings(blobs):
+        # The blob store without its chunks (path, compression level and statistics)
+        settings = copy.copy(blobs)
+        settings.chunks = {}
+        return settings
+
+    def load(self, name:str, sections = None) -> Taxonomy:
+        """
+        Load a taxonomy by name, reading only the requested sections (all if omitted).
+        The response records and blob chunks of the 'responses' section are read from the call and blob rows.
+        """
+        names = list(SECTIONS) if sections is None else list(sections)
+        with self.lock:
+            row = self.connection.execute("SELECT id, summary FROM taxonomies WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(f"Taxonomy not found in repository: {name}")
+            rows = self.connection.execute(
+                f"SELECT name, codec, data FROM sections WHERE taxonomy_id = ? AND name IN ({','.join('?' * len(names))})",
+                [row[0]] + names
+            ).fetchall()
+            values = {section: decode_section(data, codec) for section, codec, data in rows}
+            # The records and in-memory chunks are rows (taxonomies saved before that keep them in the section)
+            if 'responses' in values and 'responses' not in values['responses']:
+                blobs = values['responses']['blobs']
+                if blobs.path is None:
+                    blobs.chunks = dict(self.connection.execute("SELECT ref, data FROM blobs WHERE taxonomy_id = ?", (row[0],)).fetchall())
+                values['responses']['responses'] = [
+                    ResponseRecord(template_id, content_ref, json.loads(prompt_refs or '[]'), prompt_tokens, completion_tokens, total_tokens, latency, payload_ref)
+                    for template_id, content_ref, prompt_refs, prompt_tokens, completion_tokens, total_tokens, latency, payload_ref in self.connection.execute(
+                        "SELECT template_id, content_ref, prompt_refs, prompt_tokens, completion_tokens, total_tokens, latency, payload_ref FROM calls WHERE taxonomy_id = ? ORDER BY seq",
+                        (row[0],)
+                    )
+                ]
+            # Partial load: resolve the text fields from the blob rows they reference
+            refs = Taxonomy.text_refs(values['hierarchies']) if 'hierarchies' in values and 'responses' not in values else []
+            if refs:
+                blobs = decode_section(*self.connection.execute("SELECT data, codec FROM sections WHERE taxonomy_id = ? AND name = 'responses'", (row[0],)).fetchone())['blobs']
+                if blobs.path is None:
+                    blobs.chunks.update(self.connection.execute(
+                        f"SELECT ref, data FROM blobs WHERE taxonomy_id = ? AND ref IN ({','.join('?' * len(refs))})", [row[0]] + refs
+                    ).fetchall())
+                values['hierarchies'] = Taxonomy.resolve_text_refs(values['hierarchies'], blobs)
+        return Taxonomy.from_sections(json.loads(row[1]), values, sections)
+
+    def delete(self, name:str) -> None:
+        """
+        Remove a taxonomy and all its rows.
+        """
+        with self.lock, self.connection:
+            self.saved.pop(name, None)
+            self.connection.execute("DELETE FROM taxonomies WHERE name = ?", (name,))
+
+    def _query(self, sql:str, parameters = ()) -> list:
+        with self.lock:
+            cursor = self.connection.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def list_taxonomies(self, root_concept = None) -> list:
+        """
+        List stored taxonomies (name, root concept, timestamps, token usage), optionally for one root concept.
+        """
+        sql = "SELECT name, root_concept, created_at, last_edit_time, prompt_tokens, completion_tokens, total_tokens FROM taxonomies"
+        if root_concept is None:
+            return self._query(sql + " ORDER BY created_at")
+        return self._query(sql + " WHERE root_norm = ? ORDER BY created_at", (normalize_label(root_concept),))
+
+    def find_nodes(self, label:str, root_concept = None) -> list:
+        """
+        Find every subconcept node with the given (normalized) label across runs,
+        with its taxonomy, rank list, depth and parent labels.
+        """
+        sql = '''SELECT t.name AS taxonomy, t.root_concept, n.rank_list, n.label, n.depth,
+                        (SELECT group_concat(p.label, '; ') FROM edges e JOIN nodes p
+                            ON p.taxonomy_id = e.taxonomy_id AND p.rank_list = e.rank_list AND p.node_id = e.parent_id
+                         WHERE e.taxonomy_id = n.taxonomy_id AND e.rank_list = n.rank_list AND e.child_id = n.node_id) AS parents
+                 FROM nodes n JOIN taxonomies t ON t.id = n.taxonomy_id
+                 WHERE n.label_norm = ?'''
+        parameters = [normalize_label(label)]
+        if root_concept is not None:
+            sql += " AND t.root_norm = ?"
+            parameters.append(normalize_label(root_concept))
+        return self._query(sql + " ORDER BY t.created_at, n.rank_list", parameters)
+
+    def find_ranks(self, label:str, root_concept = None) -> list:
+        """
+        Find every taxonomical rank with the given (normalized) label across runs,
+        with its taxonomy, rank list, position and reached depth.
+        """
+        sql = '''SELECT t.name AS taxonomy, t.root_concept, r.rank_list, r.position, r.label, r.depth
+                 FROM ranks r JOIN taxonomies t ON t.id = r.taxonomy_id
+                 WHERE r.label_norm = ?'''
+        parameters = [normalize_label(label)]
+        if root_concept is not None:
+            sql += " AND t.root_norm = ?"
+            parameters.append(normalize_label(root_concept))
+        return self._query(sql + " ORDER BY t.created_at, r.rank_list, r.position", parameters)
+
+    def rank_lists(self, name:str) -> list:
+        """
+        Return the rank lists of one taxonomy without loading it.
+        """
+        rows = self._query(
+            "SELECT r.rank_list, r.label FROM ranks r JOIN taxonomies t ON t.id = r.taxonomy_id WHERE t.name = ? ORDER BY r.rank_list, r.position",
+            (name,)
+        )
+        rank_lists = {}
+        for row in rows:
+            rank_lists.setdefault(row['rank_list'], []).append(row['label'])
+        return [rank_lists[key] for key in sorted(rank_lists)]
+
+    def call_stats(self, root_concept = None) -> list:
+        """
+        Aggregate model calls per template across runs: call count, token usage and latency.
+        """
+        sql = '''SELECT c.template_id, COUNT(*) AS calls, SUM(c.prompt_tokens) AS prompt_tokens, SUM(c.completion_tokens) AS completion_tokens,
+                        SUM(c.total_tokens) AS total_tokens, AVG(c.latency) AS mean_latency, MAX(c.latency) AS max_latency
+                 FROM calls c JOIN taxonomies t ON t.id = c.taxonomy_id'''
+        parameters = []
+        if root_concept is not None:
+            sql += " WHERE t.root_norm = ?"
+            parameters.append(normalize_label(root_concept))
+        return self._query(sql + " GROUP BY c.template_id ORDER BY total_tokens DESC", parameters)
@@ -0,0 +1,144 @@
+import json
+import hashlib
+
+from src.blobs import BlobStore
+
+class ResponseRecord:
+    """
+    Compact record of a single model call stored in Taxonomy.responses.
+    Keeps only the template ID, references into the taxonomy's BlobStore (completion and prompt messages),
+    token counts and latency; the full raw payload can be offloaded to a separate store and is referenced by payload_ref.
+    """
+    __slots__ = ('template_id', 'content_ref', 'prompt_refs', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'latency', 'payload_ref', '_blobs')
+
+    def __init__(self, template_id:str, content_ref:str, prompt_refs = (), prompt_tokens = 0, completion_tokens = 0, total_tokens = 0, latency = None, payload_ref = None, blobs = None) -> None:
+        self.template_id        = template_id
+        self.content_ref        = content_ref
+        self.prompt_refs        = tuple(prompt_refs)
+        self.prompt_tokens      = prompt_tokens
+        self.completion_tokens  = completion_tokens
+        self.total_tokens       = total_tokens
+        self.latency            = latency
+        self.payload_ref        = payload_ref
+        # Blob store the references point into (not pickled, re-bound by the owning Taxonomy)
+        self._blobs             = blobs
+
+    def bind(self, blobs) -> None:
+        """
+        Attach the blob store the record's references point into.
+        """
+        self._blobs = blobs
+
+    @property
+    def content(self) -> str:
+        """
+        Completion text, read from the blob store.
+        """
+        return self._blobs.get_text(self.content_ref)
+
+    @property
+    def prompt(self) -> list:
+        """
+        Prompt messages as 'type: content' strings, read from the blob store.
+        """
+        return [self._blobs.get_text(ref) for ref in self.prompt_refs]
+
+    @property
+    def prompt_key(self) -> str:
+        """
+        Hash identifying the full rendered prompt (all messages in order), see prompt_key.
+        """
+        return hashlib.sha256('|'.join(self.prompt_refs).encode('utf-8')).hexdigest()
+
+    @property
+    def token_usage(self) -> dict:
+        """
+        Token usage in the same shape as the OpenAI 'token_usage' metadata.
+        """
+        return {
+            'completion_tokens': self.completion_tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'total_tokens': self.total_tokens
+        }
+
+    @property
+    def response_metadata(self) -> dict:
+        """
+        Minimal LangChain-compatible metadata, so records can be read like AIMessage objects.
+        """
+        return {'token_usage': self.token_usage}
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__[:-1])
+
+    def __setstate__(self, state) -> None:
+        for slot, value in zip(self.__slots__[:-1], state):
+            setattr(self, slot, value)
+        self._blobs = None
+
+    def __repr__(self) -> str:
+        return f"ResponseRecord(template_id={self.template_id!r}, total_tokens={self.total_tokens}, latency={self.latency})"
+
+def split_response(response):
+    """
+    Split a model output into (message, parsed).
+    Handles plain LangChain messages, structured outputs created with include_raw=True
+    ({'raw', 'parsed', 'parsing_error'}) and bare parsed dicts from structured outputs without raw messages.
+    """
+    if isinstance(response, dict):
+        if 'raw' in response and hasattr(response['raw'], 'content'):
+            return response['raw'], response.get('parsed')
+        return None, response
+    return response, None
+
+def message_token_usage(message) -> dict:
+    """
+    Return the OpenAI 'token_usage' metadata of a message (empty if the message has none).
+    """
+    return (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+
+def message_text(message) -> str:
+    """
+    Text a prompt message is stored as: 'type: content'.
+    """
+    return f"{getattr(message, 'type', 'message')}: {getattr(message, 'content', message)}"
+
+def store_prompt(blobs, prompt) -> tuple:
+    """
+    Store every message of a formatted prompt in the blob store and return the message references.
+    Repeated messages (e.g. system prompts) are stored once.
+    """
+    if not prompt:
+        return ()
+    return tuple(blobs.put_text(message_text(message)) for message in prompt)
+
+def prompt_key(prompt) -> str:
+    """
+    Hash of a formatted prompt, equal to ResponseRecord.prompt_key of a record made from the same prompt
+    (without storing the messages).
+    """
+    refs = [BlobStore.digest(message_text(message).encode('utf-8')) for message in (prompt or [])]
+    return hashlib.sha256('|'.join(refs).encode('utf-8')).hexdigest()
+
+def make_record(template_id:str, response, blobs, latency = None, prompt = None, payload_ref = None) -> ResponseRecord:
+    """
+    Build a ResponseRecord from any model output accepted by split_response,
+    storing the completion and prompt text in the given blob store.
+    """
+    message, parsed = split_response(response)
+    prompt_refs = store_prompt(blobs, prompt)
+    if message is None:
+        # Structured output without the raw message: keep the parsed JSON, token counts are unknown
+        return ResponseRecord(template_id, blobs.put_text(json.dumps(parsed)), prompt_refs, latency = latency, payload_ref = payload_ref, blobs = blobs)
+    token_usage = message_token_usage(message)
+    return ResponseRecord(
+        template_id,
+        blobs.put_text(message.content),
+        prompt_refs,
+        prompt_tokens       = token_usage.get('prompt_tokens', 0),
+        completion_tokens   = token_usage.get('completion_tokens', 0),
+        total_tokens        = token_usage.get('total_tokens', 0),
+        latency             = latency,
+        payload_ref         = payload_ref,
+        blobs               = blobs
+    )
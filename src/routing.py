@@ -0,0 +1,456 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.models import init_role_model
+from src.responses import message_token_usage, split_response
+
+class Backend:
+    """
+    One endpoint serving a model role: the model (ChatOpenAI or structured-output runnable),
+    its price and live statistics. Latency (of successful calls) and error rate are exponentially weighted
+    moving averages (EWMA, weight alpha for the newest observation); the latency deviation EWMA gives a tail estimate.
+
+    A circuit breaker takes a failing backend out of rotation: after failure_threshold consecutive errors
+    the circuit is open and the backend is skipped for cooldown seconds. Then it is half-open: one call
+    probes it, and a success closes the circuit while an error opens it for another cooldown.
+    """
+    def __init__(self, name:str, model, input_cost:float = 0.0, output_cost:float = 0.0, alpha:float = 0.2, window:int = 256,
+                 failure_threshold:int = 3, cooldown:float = 30.0) -> None:
+        self.name               = name
+        self.model              = model
+        # USD per 1M prompt and completion tokens
+        self.input_cost         = input_cost
+        self.output_cost        = output_cost
+        self.alpha              = alpha
+        self.latency_ewma       = None
+        self.deviation_ewma     = 0.0
+        self.error_ewma         = 0.0
+        # Recent successful latencies, for percentiles in metrics()
+        self.latencies          = deque(maxlen=window)
+        self.calls              = 0
+        self.errors             = 0
+        self.in_flight          = 0
+        # Calls started as hedges, and hedges that returned first
+        self.hedges             = 0
+        self.hedge_wins         = 0
+        self.prompt_tokens      = 0
+        self.completion_tokens  = 0
+        # Circuit breaker state: errors since the last success, end of the open period, probe in flight
+        self.failure_threshold  = failure_threshold
+        self.cooldown           = cooldown
+        self.consecutive_errors = 0
+        self.open_until         = None
+        self.probing            = False
+        self.lock               = threading.Lock()
+
+    def start(self) -> float:
+        """
+        Count a call as started; returns its start time.
+        """
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def circuit(self) -> str:
+        """
+        Circuit breaker state: 'closed', 'open' (skipped until the cooldown has passed) or 'half-open'.
+        """
+        if self.open_until is None:
+            return 'closed'
+        return 'open' if time.perf_counter() < self.open_until or self.probing else 'half-open'
+
+    def available(self) -> bool:
+        """
+        Check whether calls may be routed here: the circuit is closed, or half-open without a probe in flight.
+        """
+        with self.lock:
+            return self.circuit() != 'open'
+
+    def claim_probe(self) -> bool:
+        """
+        Claim the probe call of a half-open circuit. Returns False if the circuit is not half-open
+        (closed, open, or its probe is already in flight).
+        """
+        with self.lock:
+            if self.circuit() != 'half-open':
+                return False
+            self.probing = True
+            return True
+
+    def _observe_latency(self, latency:float) -> None:
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+            self.deviation_ewma = latency / 2
+        else:
+            self.deviation_ewma += self.alpha * (abs(latency - self.latency_ewma) - self.deviation_ewma)
+            self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+
+    def finish(self, start_time:float, response = None, error = None) -> None:
+        """
+        Count a call as finished, updating the error EWMA, the circuit breaker and, for a successful call,
+        the latency EWMA and the token counts. Failed calls do not count for the latency EWMA: a backend
+        that fails fast would otherwise look faster than a healthy one.
+        """
+        latency = time.perf_counter() - start_time
+        with self.lock:
+            self.in_flight -= 1
+            self.probing = False
+            self.error_ewma += self.alpha * ((1.0 if error is not None else 0.0) - self.error_ewma)
+            if error is not None:
+                self.errors += 1
+                self.consecutive_errors += 1
+                if self.consecutive_errors >= self.failure_threshold:
+                    self.open_until = time.perf_counter() + self.cooldown
+                return
+            self.consecutive_errors = 0
+            self.open_until = None
+            self._observe_latency(latency)
+            self.latencies.append(latency)
+            message, _ = split_response(response)
+            usage = message_token_usage(message) if message is not None else {}
+            self.prompt_tokens += usage.get('prompt_tokens', 0)
+            self.completion_tokens += usage.get('completion_tokens', 0)
+
+    def abandon(self, start_time:float) -> None:
+        """
+        Count a cancelled call (a hedge that lost the race) as finished. Its elapsed time is a lower bound
+        of its latency, so it only raises the latency EWMA (a backend that always loses still looks slow).
+        """
+        latency = time.perf_counter() - start_time
+        with self.lock:
+            self.in_flight -= 1
+            # A cancelled probe tells nothing about recovery: the next call probes again
+            self.probing = False
+            if self.latency_ewma is not None and latency > self.latency_ewma:
+                self._observe_latency(latency)
+
+    @property
+    def cost(self) -> float:
+        """
+        Spent USD, from the token counts and prices.
+        """
+        return (self.prompt_tokens * self.input_cost + self.completion_tokens * self.output_cost) / 1e6
+
+    def score(self, cost_weight:float) -> float:
+        """
+        Expected cost of routing a call here, lower is better: the latency EWMA scaled by the calls in flight
+        (so concurrent calls spread over backends) and by the expected number of attempts (1 / success rate),
+        plus cost_weight seconds per USD of the blended price per 1M tokens. Backends without a successful call
+        score 0 (they are tried until their circuit opens).
+        """
+        if self.latency_ewma is None:
+            return 0.0
+        attempts = 1.0 / max(1.0 - self.error_ewma, 0.05)
+        return self.latency_ewma * (self.in_flight + 1) * attempts + cost_weight * (self.input_cost + self.output_cost) / 2
+
+    def tail_latency(self):
+        """
+        Tail latency estimate (EWMA plus four deviations), or None before the first call.
+        """
+        return None if self.latency_ewma is None else self.latency_ewma + 4 * self.deviation_ewma
+
+    def metrics(self) -> dict:
+        """
+        Snapshot of the backend statistics.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            percentile = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else None
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'latency_ewma': self.latency_ewma,
+                'latency_deviation': self.deviation_ewma,
+                'error_rate_ewma': self.error_ewma,
+                'consecutive_errors': self.consecutive_errors,
+                'circuit': self.circuit(),
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cost': self.cost
+            }
+
+class Router:
+    """
+    Routes the calls of one model role over several backends (e.g. OpenAI and local OpenAI-compatible servers).
+    Every call goes to the backend with the lowest score (see Backend.score); with probability explore a random
+    other backend is used instead, so a backend that recovered is measured again. Backends with an open circuit
+    are skipped while another one is available, and a half-open backend gets the next call as its probe (see Backend).
+    A failed call is retried on the next best backend until every backend was tried. With hedge_after, a call that has not returned after that many
+    seconds ('auto': the backend's tail latency estimate) is also sent to the next best backend and the first answer wins;
+    at most hedge_budget hedges per call are started (overall), so hedging cannot multiply the load of a saturated backend.
+
+    Routers have invoke and ainvoke like the models they wrap, so they can be passed to the workflow functions as models.
+    """
+    def __init__(self, backends, cost_weight:float = 0.05, hedge_after = None, max_hedges:int = 1, hedge_budget:float = 0.2, explore:float = 0.05, seed = None, name:str = 'router', max_workers:int = 16) -> None:
+        if not backends:
+            raise ValueError("Router needs at least one backend")
+        self.backends       = list(backends)
+        self.cost_weight    = cost_weight
+        self.hedge_after    = hedge_after
+        self.max_hedges     = max_hedges
+        self.hedge_budget   = hedge_budget
+        self.explore        = explore
+        self.random         = random.Random(seed)
+        self.name           = name
+        self.calls          = 0
+        self.hedged_calls   = 0
+        self.failovers      = 0
+        self.lock           = threading.Lock()
+        # Worker threads for hedged synchronous calls (created on first use)
+        self.max_workers    = max_workers
+        self._executor      = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-hedge")
+            return self._executor
+
+    def select(self, exclude = ()):
+        """
+        Choose the backend for the next attempt among those not in exclude (None if none is left).
+        """
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if not candidates:
+            return None
+        # With every remaining circuit open the call still goes to the best of them rather than failing untried
+        candidates = [backend for backend in candidates if backend.available()] or candidates
+        for backend in candidates:
+            if backend.claim_probe():
+                return backend
+        with self.lock:
+            explore = len(candidates) > 1 and self.random.random() < self.explore
+            if explore:
+                return self.random.choice(candidates)
+        return min(candidates, key=lambda backend: backend.score(self.cost_weight))
+
+    def hedge_delay(self, backend:Backend):
+        """
+        Seconds after which a call to backend is hedged, or None if it is not hedged.
+        """
+        if self.hedge_after == 'auto':
+            return backend.tail_latency()
+        return self.hedge_after
+
+    def can_hedge(self, hedges:int, tried:list) -> bool:
+        """
+        Check whether a call that already started hedges hedges (on the backends in tried) may start another one.
+        """
+        with self.lock:
+            within_budget = self.hedged_calls < self.hedge_budget * self.calls
+        return self.hedge_after is not None and within_budget and hedges < self.max_hedges and len(tried) < len(self.backends)
+
+    def _count_call(self, hedged:bool = False, failover:bool = False) -> None:
+        with self.lock:
+            if hedged:
+                self.hedged_calls += 1
+            elif failover:
+                self.failovers += 1
+            else:
+                self.calls += 1
+
+    def _invoke(self, backend:Backend, prompt, kwargs:dict):
+        start_time = backend.start()
+        try:
+            response = backend.model.invoke(prompt, **kwargs)
+        except Exception as error:
+            backend.finish(start_time, error=error)
+            raise
+        backend.finish(start_time, response)
+        return response
+
+    def invoke(self, prompt, **kwargs):
+        """
+        Invoke the best backend (with failover and, if configured, hedging) and return the first successful response.
+        Hedged calls run in worker threads; a losing call finishes in the background and its response is discarded.
+        """
+        self._count_call()
+        tried = [self.select()]
+        if self.hedge_after is None or len(self.backends) == 1:
+            # Plain path: call on the caller's thread, fail over in score order
+            while True:
+                try:
+                    return self._invoke(tried[-1], prompt, kwargs)
+                except Exception:
+                    backend = self.select(tried)
+                    if backend is None:
+                        raise
+                    self._count_call(failover = True)
+                    tried.append(backend)
+        pending = {}
+        hedges = 0
+        last_error = None
+
+        def launch(backend, hedge):
+            # Worker threads run in a copy of the caller's context (profiling phases carry over)
+            future = self.executor.submit(contextvars.copy_context().run, self._invoke, backend, prompt, kwargs)
+            pending[future] = (backend, hedge, time.perf_counter())
+
+        launch(tried[0], False)
+        while pending:
+            # Hedge the oldest pending call once its delay has passed
+            backend, _, started = min(pending.values(), key=lambda item: item[2])
+            delay = self.hedge_delay(backend) if self.can_hedge(hedges, tried) else None
+            timeout = None if delay is None else max(delay - (time.perf_counter() - started), 0.0)
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge = self.select(tried)
+                tried.append(hedge)
+                hedges += 1
+                with hedge.lock:
+                    hedge.hedges += 1
+                self._count_call(hedged = True)
+                launch(hedge, True)
+                continue
+            for future in done:
+                backend, hedge, _ = pending.pop(future)
+                if future.exception() is None:
+                    if hedge:
+                        with backend.lock:
+                            backend.hedge_wins += 1
+                    return future.result()
+                last_error = future.exception()
+            if not pending:
+                backend = self.select(tried)
+                if backend is None:
+                    break
+                tried.append(backend)
+                self._count_call(failover = True)
+                launch(backend, False)
+        raise last_error
+
+    async def _ainvoke(self, backend:Backend, prompt, kwargs:dict):
+        start_time = backend.start()
+        try:
+            response = await backend.model.ainvoke(prompt, **kwargs)
+        except asyncio.CancelledError:
+            backend.abandon(start_time)
+            raise
+        except Exception as error:
+            backend.finish(start_time, error=error)
+            raise
+        backend.finish(start_time, response)
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        """
+        Async counterpart of invoke. Losing hedged calls are cancelled.
+        """
+        self._count_call()
+        tried = [self.select()]
+        pending = {}
+        hedges = 0
+        last_error = None
+
+        def launch(backend, hedge):
+            pending[asyncio.ensure_future(self._ainvoke(backend, prompt, kwargs))] = (backend, hedge, time.perf_counter())
+
+        launch(tried[0], False)
+        try:
+            while pending:
+                backend, _, started = min(pending.values(), key=lambda item: item[2])
+                delay = self.hedge_delay(backend) if self.can_hedge(hedges, tried) else None
+                timeout = None if delay is None else max(delay - (time.perf_counter() - started), 0.0)
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge = self.select(tried)
+                    tried.append(hedge)
+                    hedges += 1
+                    with hedge.lock:
+                        hedge.hedges += 1
+                    self._count_call(hedged = True)
+                    launch(hedge, True)
+                    continue
+                for task in done:
+                    backend, hedge, _ = pending.pop(task)
+                    if task.exception() is None:
+                        if hedge:
+                            with backend.lock:
+                                backend.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                if not pending:
+                    backend = self.select(tried)
+                    if backend is None:
+                        break
+                    tried.append(backend)
+                    self._count_call(failover = True)
+                    launch(backend, False)
+        finally:
+            # Cancel the calls that lost the race (or all of them if the caller was cancelled)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        raise last_error
+
+    def metrics(self) -> dict:
+        """
+        Router counters and the metrics of every backend (see Backend.metrics), with its current score.
+        """
+        with self.lock:
+            metrics = {'calls': self.calls, 'hedged_calls': self.hedged_calls, 'failovers': self.failovers, 'backends': {}}
+        for backend in self.backends:
+            metrics['backends'][backend.name] = dict(backend.metrics(), score=backend.score(self.cost_weight))
+        return metrics
+
+    def close(self) -> None:
+        """
+        Shut down the hedging worker threads (pending calls finish first).
+        """
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+def init_router(role:str, backends, log = None, http_pool = None, **router_options) -> Router:
+    """
+    Initialize a Router for one model role.
+
+    Args:
+        role (str): Model role, a key of ROLE_PARAMETERS in src/models.py (its sampling parameters are used).
+        backends (list): Backend specs, dicts with 'name' and optionally 'base_url', 'model_checkpoint', 'api_key',
+            'input_cost' and 'output_cost' (USD per 1M tokens), 'max_retries' (0 by default: the router fails over instead),
+            'failure_threshold' and 'cooldown' (circuit breaker, see Backend).
+        log (logging.Logger, optional): Logger for info/debug output.
+        http_pool (HTTPPool, optional): Connection pool shared by all backends (default_pool() by default).
+        **router_options: Options of Router (cost_weight, hedge_after, max_hedges, hedge_budget, explore, seed).
+
+    Returns:
+        Router: The router, usable as the role's model.
+    """
+    if not log:
+        log = logging.getLogger("init_router()")
+        logging.basicConfig(level=logging.INFO)
+    routed = []
+    for spec in backends:
+        model = init_role_model(role, log, http_pool, spec.get('base_url'), spec.get('model_checkpoint'), spec.get('api_key'), spec.get('max_retries', 0))
+        routed.append(Backend(spec['name'], model, spec.get('input_cost', 0.0), spec.get('output_cost', 0.0),
+                              failure_threshold = spec.get('failure_threshold', 3), cooldown = spec.get('cooldown', 30.0)))
+    log.info(f"router for {role}: {[backend.name for backend in routed]}")
+    return Router(routed, name = role, **router_options)
+
+def init_routed_models(backends:dict, log = None, http_pool = None, **router_options):
+    """
+    Routed counterpart of init_models: one Router per role, with the backends given per role
+    ('generate new', 're-generate', 'verify', 'integrate'). Roles without backends use the default
+    OpenAI checkpoint as their only backend.
+
+    Returns:
+        tuple: Routers in the order of init_models (generate new, re-generate, verify, integrate).
+    """
+    default = [{'name': 'openai', 'max_retries': 2}]
+    return tuple(init_router(role, backends.get(role) or default, log, http_pool, **router_options) for role in ('generate new', 're-generate', 'verify', 'integrate'))
@@ -0,0 +1,413 @@
+import os
+import json
+import socket
+import logging
+import sqlite3
+import argparse
+import datetime
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.coalescing import CoalescingModel, coalesce_models
+from src.models import init_models, init_refine_model
+from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id              INTEGER PRIMARY KEY,
+    owner           TEXT NOT NULL,
+    concept         TEXT NOT NULL,
+    params          TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    worker          TEXT,
+    submitted_at    TEXT NOT NULL,
+    started_at      TEXT,
+    heartbeat_at    TEXT,
+    finished_at     TEXT,
+    result_path     TEXT,
+    error           TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, status);
+'''
+
+# Job parameters and their defaults (same as in main.py)
+JOB_DEFAULTS = {
+    'stop_at_depth': 3,
+    'max_subconcepts_per_iteration': 15,
+    'refine_mode': "two_call",
+    'max_workers': 4
+}
+
+def now(offset:float = 0.0) -> str:
+    """
+    Current local time (shifted by offset seconds) as an ISO string (seconds precision).
+    """
+    return (datetime.datetime.now() + datetime.timedelta(seconds=offset)).isoformat(timespec='seconds')
+
+class JobQueue:
+    """
+    SQLite-backed queue of taxonomy jobs shared by submitters and worker processes.
+    Jobs move from 'queued' to 'running' (claim) to 'done' or 'failed'. Claims are fair between owners:
+    the next job comes from the owner with the fewest running jobs, then the least recently served owner.
+    A claim is a lease: the claiming worker renews it with heartbeat(), and running jobs whose lease expired
+    (their worker crashed or was killed) are put back into the queue by requeue_expired(), whoever claimed them.
+    """
+    def __init__(self, db_path = None) -> None:
+        self.db_path        = db_path or os.path.join(os.getcwd(), "data", "jobs.sqlite")
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self.connection     = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        # Queues created before claims were leases have no heartbeat column
+        if 'heartbeat_at' not in {row['name'] for row in self.connection.execute("PRAGMA table_info(jobs)")}:
+            self.connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT")
+        # A single connection is shared between threads, so access is serialized
+        self.lock           = threading.Lock()
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+    def submit(self, concept:str, owner:str = "default", **params) -> int:
+        """
+        Queue a taxonomy job and return its ID.
+
+        Args:
+            concept (str): Root concept of the taxonomy.
+            owner (str): Owner of the job, used for fair scheduling.
+            **params: Job parameters overriding JOB_DEFAULTS (stop_at_depth, max_subconcepts_per_iteration, refine_mode, max_workers).
+        """
+        unknown = set(params) - set(JOB_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown job parameters: {sorted(unknown)}")
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (owner, concept, params, status, submitted_at) VALUES (?, ?, ?, 'queued', ?)",
+                (owner, concept, json.dumps({**JOB_DEFAULTS, **params}), now())
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker:str):
+        """
+        Atomically mark the next queued job as running for the given worker.
+
+        Returns:
+            dict: The claimed job (with decoded params), or None if no job is queued.
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute('''
+                    SELECT j.id FROM jobs j WHERE j.status = 'queued'
+                    ORDER BY
+                        (SELECT COUNT(*) FROM jobs r WHERE r.owner = j.owner AND r.status = 'running'),
+                        COALESCE((SELECT MAX(s.started_at) FROM jobs s WHERE s.owner = j.owner AND s.started_at IS NOT NULL), ''),
+                        j.id
+                    LIMIT 1
+                ''').fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                        (worker, now(), now(), row['id'])
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return None if row is None else self.get(row['id'])
+
+    def complete(self, job_id:int, result_path:str, worker:str) -> bool:
+        """
+        Mark a job the worker is running as done and record where its taxonomy was saved.
+        Returns False (and changes nothing) if the worker no longer holds the job: its lease expired
+        and the job was requeued, and possibly claimed by another worker.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, result_path = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (now(), result_path, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id:int, error:str, worker:str) -> bool:
+        """
+        Mark a job the worker is running as failed with an error message.
+        Returns False (and changes nothing) if the worker no longer holds the job, see complete().
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (now(), error, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def requeue(self, worker:str) -> int:
+        """
+        Put the jobs left running by a (crashed) worker back into the queue. Returns the number of requeued jobs.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL WHERE status = 'running' AND worker = ?",
+                (worker,)
+            )
+            return cursor.rowcount
+
+    def heartbeat(self, worker:str) -> int:
+        """
+        Renew the leases of all jobs the worker is running. Returns the number of renewed jobs.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND worker = ?",
+                (now(), worker)
+            )
+            return cursor.rowcount
+
+    def requeue_expired(self, lease_timeout:float) -> int:
+        """
+        Put running jobs whose lease was not renewed for lease_timeout seconds back into the queue,
+        regardless of the worker that claimed them. Returns the number of requeued jobs.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, '') < ?",
+                (now(-lease_timeout),)
+            )
+            return cursor.rowcount
+
+    def get(self, job_id:int):
+        """
+        Return a job as a dict (with decoded params), or None if it does not exist.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def list_jobs(self, status = None, owner = None) -> list:
+        """
+        List jobs (optionally filtered by status and owner) in submission order.
+        """
+        query = "SELECT id, owner, concept, status, worker, submitted_at, started_at, finished_at, result_path, error FROM jobs WHERE 1 = 1"
+        args = []
+        if status:
+            query += " AND status = ?"
+            args.append(status)
+        if owner:
+            query += " AND owner = ?"
+            args.append(owner)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(query + " ORDER BY id", args)]
+
+    def counts(self) -> dict:
+        """
+        Return the number of jobs per status.
+        """
+        with self.lock:
+            return {row['status']: row['n'] for row in self.connection.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+def job_logger(job_id:int, log_path:str) -> logging.Logger:
+    """
+    Create a logger writing only to the job's own log file (it does not propagate to the root logger),
+    so concurrent jobs never share logging configuration.
+    """
+    log = logging.getLogger(f"TaxoRankExpand.job.{job_id}")
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+    handler = logging.FileHandler(log_path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    log.addHandler(handler)
+    return log
+
+def close_logger(log:logging.Logger) -> None:
+    """
+    Detach and close the handlers of a job logger.
+    """
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+
+class Worker:
+    """
+    Long-running worker that claims jobs from a JobQueue and builds their taxonomies.
+    Models and their shared HTTP connection pool are created once and stay warm between jobs;
+    up to max_jobs jobs run at the same time. Every job gets its own result directory and log file.
+    With max_resident_bytes, every job's taxonomy runs in the memory-bounded mode (see Taxonomy.bound_memory),
+    so one huge taxonomy cannot take the memory of the other jobs.
+    With coalesce, identical model calls of concurrent jobs (e.g. jobs for the same concept) share one call
+    (see src/coalescing.py).
+    The worker renews the leases of its jobs every poll_interval and requeues the jobs of any worker
+    whose leases are older than lease_timeout, so jobs of a crashed worker are recovered by the others
+    (or by its restart) even though a restarted worker gets a new worker ID.
+    """
+    def __init__(self, queue:JobQueue, max_jobs:int = 2, poll_interval:float = 1.0, results_path = None, models = None, worker_id = None, log = None, max_resident_bytes = None, coalesce = False,
+                 lease_timeout:float = 60.0) -> None:
+        self.queue          = queue
+        self.max_jobs       = max_jobs
+        self.poll_interval  = poll_interval
+        self.results_path   = results_path or os.path.join(os.getcwd(), "data", "jobs")
+        self.worker_id      = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.log            = log or logging.getLogger("TaxoRankExpand.service")
+        # (model_generate_new, model_re_generate, model_verify, model_integrate), initialized once
+        self.models         = models or init_models(self.log)
+        self.coalesce       = coalesce
+        if coalesce:
+            self.models     = coalesce_models(*self.models)
+        self._model_refine  = None
+        self.stop_event     = threading.Event()
+        self.max_resident_bytes = max_resident_bytes
+        self.lease_timeout  = max(lease_timeout, 2 * poll_interval)
+
+    def model_refine(self):
+        # The structured refine model is only created once a job needs it
+        if self._model_refine is None:
+            self._model_refine = init_refine_model(self.log)
+            if self.coalesce:
+                self._model_refine = CoalescingModel(self._model_refine)
+        return self._model_refine
+
+    def run_job(self, job:dict) -> str:
+        """
+        Build the taxonomy of one claimed job and return the path it was saved to.
+        """
+        params = job['params']
+        job_path = os.path.join(self.results_path, f"job_{job['id']}")
+        os.makedirs(job_path, exist_ok=True)
+        log = job_logger(job['id'], os.path.join(job_path, "job.log"))
+        model_generate_new, model_re_generate, model_verify, model_integrate = self.models
+        try:
+            log.info(f"job {job['id']} ({job['owner']}): {job['concept']} {params}")
+            model_refine = self.model_refine() if params['refine_mode'] == "structured" else None
+            taxonomy = create_taxonomy(model_generate_new, model_verify, job['concept'], log, params['max_workers'], save_path = job_path)
+            if self.max_resident_bytes is not None:
+                taxonomy.bound_memory(self.max_resident_bytes)
+            taxonomy = generate_subconcepts_for_all_ranks(
+                model_generate_new,
+                model_re_generate,
+                taxonomy,
+                params['stop_at_depth'],
+                params['max_subconcepts_per_iteration'],
+                log,
+                params['refine_mode'],
+                model_refine
+            )
+            taxonomy = integrate_subconcepts(model_integrate, taxonomy, log)
+            result_path = taxonomy.save()
+            log.info(f"job {job['id']} done: {result_path}, token usage {taxonomy.token_usage}, memory {taxonomy.memory_report()}")
+            return result_path
+        finally:
+            close_logger(log)
+
+    def _run_claimed(self, job:dict) -> None:
+        try:
+            result_path = self.run_job(job)
+        except Exception as error:
+            self.log.exception(f"job {job['id']} failed")
+            if not self.queue.fail(job['id'], f"{type(error).__name__}: {error}", self.worker_id):
+                self.log.warning(f"job {job['id']}: lease lost, the failure is not recorded")
+        else:
+            if self.queue.complete(job['id'], result_path, self.worker_id):
+                self.log.info(f"job {job['id']} done: {result_path}")
+            else:
+                self.log.warning(f"job {job['id']}: lease lost, result {result_path} is not recorded")
+
+    def run(self, until_empty:bool = False) -> None:
+        """
+        Claim and run jobs until stop() is called (or, with until_empty, until the queue is drained).
+        Jobs left running by an earlier process with the same worker ID, and jobs with expired leases, are requeued first.
+        On KeyboardInterrupt the worker stops claiming and lets the running jobs finish (a second interrupt aborts them).
+        """
+        requeued = self.queue.requeue(self.worker_id)
+        if requeued:
+            self.log.info(f"requeued {requeued} interrupted jobs")
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            try:
+                while not self.stop_event.is_set():
+                    self.queue.heartbeat(self.worker_id)
+                    requeued = self.queue.requeue_expired(self.lease_timeout)
+                    if requeued:
+                        self.log.info(f"requeued {requeued} jobs with expired leases")
+                    # Fill the free slots; claim() picks the next job fairly between owners
+                    while len(running) < self.max_jobs:
+                        job = self.queue.claim(self.worker_id)
+                        if job is None:
+                            break
+                        self.log.info(f"claimed job {job['id']} ({job['owner']}): {job['concept']}")
+                        running.add(executor.submit(self._run_claimed, job))
+                    if not running:
+                        if until_empty:
+                            break
+                        self.stop_event.wait(self.poll_interval)
+                        continue
+                    done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                self.stop()
+                self.log.info(f"interrupted, finishing {len(running)} running jobs")
+            # Let the running jobs finish after stop(), keeping their leases alive
+            while running:
+                self.queue.heartbeat(self.worker_id)
+                done, running = wait(running, timeout=self.poll_interval)
+
+    def stop(self) -> None:
+        """
+        Stop claiming new jobs; run() returns once the running jobs are finished.
+        """
+        self.stop_event.set()
+
+def main(argv = None) -> None:
+    parser = argparse.ArgumentParser(description="TaxoRankExpand job queue and worker")
+    parser.add_argument("--db", default=None, help="Job queue database (default: data/jobs.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue a taxonomy job")
+    submit.add_argument("concept")
+    submit.add_argument("--owner", default="default")
+    submit.add_argument("--depth", type=int, default=JOB_DEFAULTS['stop_at_depth'])
+    submit.add_argument("--max-subconcepts", type=int, default=JOB_DEFAULTS['max_subconcepts_per_iteration'])
+    submit.add_argument("--refine-mode", choices=["two_call", "structured"], default=JOB_DEFAULTS['refine_mode'])
+
+    work = commands.add_parser("work", help="Run a worker")
+    work.add_argument("--jobs", type=int, default=2, help="Number of concurrent jobs")
+    work.add_argument("--poll-interval", type=float, default=1.0)
+    work.add_argument("--results", default=None, help="Directory for job results (default: data/jobs)")
+    work.add_argument("--until-empty", action="store_true", help="Exit once the queue is drained")
+    work.add_argument("--max-resident-mb", type=float, default=None, help="Run every job in the memory-bounded mode with this cap")
+    work.add_argument("--coalesce", action="store_true", help="Share identical in-flight model calls between concurrent jobs")
+    work.add_argument("--worker-id", default=None, help="Worker ID (default: host:pid); a restart with the same ID requeues its jobs at once")
+    work.add_argument("--lease-timeout", type=float, default=60.0, help="Seconds after which jobs of a worker that stopped renewing its leases are requeued")
+
+    commands.add_parser("status", help="List jobs")
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(args.db)
+    if args.command == "submit":
+        job_id = queue.submit(args.concept, args.owner, stop_at_depth = args.depth, max_subconcepts_per_iteration = args.max_subconcepts, refine_mode = args.refine_mode)
+        print(job_id)
+    elif args.command == "status":
+        for job in queue.list_jobs():
+            print(f"{job['id']}\t{job['owner']}\t{job['status']}\t{job['concept']}\t{job['result_path'] or job['error'] or ''}")
+    else:
+        # Service-level log only; every job logs to its own file
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+        max_resident_bytes = int(args.max_resident_mb * 2**20) if args.max_resident_mb is not None else None
+        worker = Worker(queue, args.jobs, args.poll_interval, args.results, worker_id = args.worker_id, max_resident_bytes = max_resident_bytes,
+                        coalesce = args.coalesce, lease_timeout = args.lease_timeout)
+        worker.run(args.until_empty)
+    queue.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import sys
+import pickle
+import itertools
+from collections.abc import MutableSequence
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Shared access clock, so least recently used items can be chosen across several SpillLists
+_clock = itertools.count()
+
+class Spilled:
+    """
+    Placeholder for a SpillList item stored in a BlobStore: the reference and the pickled size.
+    """
+    __slots__ = ('ref', 'size')
+
+    def __init__(self, ref:str, size:int) -> None:
+        self.ref    = ref
+        self.size   = size
+
+    def __getstate__(self):
+        return (self.ref, self.size)
+
+    def __setstate__(self, state) -> None:
+        self.ref, self.size = state
+
+class SpillList(MutableSequence):
+    """
+    List whose items can be moved (pickled) to a BlobStore and are loaded back on access.
+    Indexing loads a spilled item and keeps it resident, so the returned object can be mutated safely;
+    iteration loads spilled items only transiently. Pinned items (e.g. the rank list being generated) are never spilled.
+    Sizes are cached only for items not handed out since they were measured, since callers mutate
+    the returned objects in place (e.g. levels.append(...)).
+    """
+    def __init__(self, store, items = ()) -> None:
+        self.store      = store
+        self.items      = list(items)
+        # Index -> pickled size of resident items (computed on demand) and last access time
+        self.sizes      = {}
+        self.accessed   = {}
+        self.pinned     = set()
+
+    def _load(self, item):
+        return pickle.loads(self.store.get(item.ref)) if isinstance(item, Spilled) else item
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.items)))]
+        index = range(len(self.items))[index]
+        item = self.items[index]
+        if isinstance(item, Spilled):
+            self.items[index] = self._load(item)
+        # The caller may mutate the returned object, so its size is measured again by resident_items
+        self.sizes.pop(index, None)
+        self.accessed[index] = next(_clock)
+        return self.items[index]
+
+    def __setitem__(self, index, value) -> None:
+        index = range(len(self.items))[index]
+        self.items[index] = value
+        self.sizes.pop(index, None)
+        self.accessed[index] = next(_clock)
+
+    def __delitem__(self, index) -> None:
+        del self.items[index]
+        self._reindex()
+
+    def insert(self, index, value) -> None:
+        self.items.insert(index, value)
+        if index < len(self.items) - 1:
+            self._reindex()
+        self.accessed[range(len(self.items))[index]] = next(_clock)
+
+    def _reindex(self) -> None:
+        # Positions moved: drop the cached sizes and access times, pins cannot be kept
+        self.sizes, self.accessed, self.pinned = {}, {}, set()
+
+    def __iter__(self):
+        for item in self.items:
+            yield self._load(item)
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other) if isinstance(other, (list, SpillList)) else NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def __getstate__(self) -> dict:
+        return {'store': self.store, 'items': self.items}
+
+    def __setstate__(self, state) -> None:
+        self.__init__(state['store'])
+        self.items = state['items']
+
+    def pin(self, index:int) -> None:
+        """
+        Exclude the item at index from spilling.
+        """
+        self.pinned.add(index)
+
+    def unpin(self, index:int) -> None:
+        """
+        Allow the item at index to be spilled again.
+        """
+        self.pinned.discard(index)
+        self.sizes.pop(index, None)
+
+    def is_spilled(self, index:int) -> bool:
+        """
+        Check whether the item at index is currently stored in the blob store.
+        """
+        return isinstance(self.items[index], Spilled)
+
+    def spill(self, index:int) -> int:
+        """
+        Move a resident, unpinned item to the store. Returns the number of bytes freed (0 if nothing was spilled).
+        """
+        item = self.items[index]
+        if isinstance(item, Spilled) or index in self.pinned:
+            return 0
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        self.items[index] = Spilled(self.store.put(data), len(data))
+        self.sizes.pop(index, None)
+        return len(data)
+
+    def resident_items(self) -> list:
+        """
+        Return (last access time, index, pickled size) of every resident, unpinned item.
+        """
+        resident = []
+        for index, item in enumerate(self.items):
+            if isinstance(item, Spilled) or index in self.pinned:
+                continue
+            if index not in self.sizes:
+                self.sizes[index] = len(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+            resident.append((self.accessed.get(index, -1), index, self.sizes[index]))
+        return resident
+
+def spill_to_cap(lists, max_bytes:int) -> int:
+    """
+    Spill the least recently used resident items of several SpillLists until their resident size is at most max_bytes.
+    Returns the resident size afterwards.
+    """
+    candidates = sorted((accessed, position, index, size) for position, spill_list in enumerate(lists) for accessed, index, size in spill_list.resident_items())
+    resident = sum(candidate[3] for candidate in candidates)
+    for accessed, position, index, size in candidates:
+        if resident <= max_bytes:
+            break
+        lists[position].spill(index)
+        resident -= size
+    return resident
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of the current process in bytes, or None where the resource module is unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
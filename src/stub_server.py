@@ -0,0 +1,159 @@
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def default_responder(body:dict) -> str:
+    """
+    Default completion text: a JSON object for JSON-mode requests, a short comma-separated list otherwise.
+    """
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        return json.dumps({'taxonomy': {}, 'kept': [], 'dropped': [], 'renamed': {}})
+    return "Alpha, Beta, Gamma"
+
+class StubServer:
+    """
+    Local OpenAI-compatible chat completions server for tests and benchmarks without network access.
+    Serves POST /v1/chat/completions on 127.0.0.1 with HTTP/1.1 keep-alive, counting requests and
+    accepted TCP connections, so connection reuse of a client can be checked against the server side.
+    delay is seconds per request, or a function of the request number (e.g. for slow-tail scenarios);
+    a fraction error_rate of the requests fails with error_status (e.g. 500, or 429 for rate limiting).
+    With max_concurrency, requests arriving while that many are being served are rejected with 429 at once,
+    like a provider's concurrency limit.
+
+    Usage:
+        with StubServer(delay = 0.05) as server:
+            model = ChatOpenAI(model = "gpt-4o-mini", base_url = server.base_url, api_key = "stub")
+    """
+    def __init__(self, responder = None, delay = 0.0, port = 0, error_rate = 0.0, error_status = 500, seed = None, max_concurrency = None) -> None:
+        # responder(request body dict) -> completion text
+        self.responder      = responder or default_responder
+        self.delay          = delay
+        self.error_rate     = error_rate
+        self.error_status   = error_status
+        self.random         = random.Random(seed)
+        self.max_concurrency = max_concurrency
+        self.in_flight      = 0
+        self.rejected       = 0
+        self.requests       = 0
+        self.connections    = 0
+        self.errors         = 0
+        self.lock           = threading.Lock()
+        self.server         = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread         = None
+
+    @property
+    def base_url(self) -> str:
+        """
+        Base URL to pass to ChatOpenAI (or Model) as base_url.
+        """
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with stub.lock:
+                    stub.requests += 1
+                    request_number = stub.requests
+                    failed = stub.error_rate and stub.random.random() < stub.error_rate
+                    if failed:
+                        stub.errors += 1
+                if not self.path.endswith('/chat/completions'):
+                    self._send(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+                    return
+                with stub.lock:
+                    rejected = stub.max_concurrency is not None and stub.in_flight >= stub.max_concurrency
+                    if rejected:
+                        stub.rejected += 1
+                    else:
+                        stub.in_flight += 1
+                if rejected:
+                    self._send(429, {'error': {'message': "Too many concurrent requests", 'type': 'rate_limit_exceeded'}})
+                    return
+                try:
+                    delay = stub.delay(request_number) if callable(stub.delay) else stub.delay
+                    if delay:
+                        time.sleep(delay)
+                finally:
+                    with stub.lock:
+                        stub.in_flight -= 1
+                if failed:
+                    error_type = 'rate_limit_exceeded' if stub.error_status == 429 else 'server_error'
+                    self._send(stub.error_status, {'error': {'message': f"Injected error for request {request_number}", 'type': error_type}})
+                    return
+                self._send(200, stub.completion(body, request_number))
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the request (e.g. a cancelled hedge)
+                    self.close_connection = True
+
+        return Handler
+
+    def completion(self, body:dict, request_number:int) -> dict:
+        """
+        Build a chat completion payload in the OpenAI response format.
+        """
+        content = self.responder(body)
+        prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in body.get('messages', []))
+        completion_tokens = len(content.split())
+        return {
+            'id': f"chatcmpl-stub-{request_number}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+        }
+
+    def start(self) -> 'StubServer':
+        """
+        Serve in a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the listening socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+if __name__ == "__main__":
+    # Serve on a fixed port until interrupted, e.g. for running main.py against base_url
+    server = StubServer(port = 8089)
+    print(f"Serving stub chat completions at {server.base_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
@@ -0,0 +1,150 @@
+import os
+import json
+import gzip
+import struct
+import threading
+import pickle
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File layout:
+#   MAGIC (4 bytes) | format version (uint16) | header length (uint32) | header (UTF-8 JSON) | sections...
+# The header holds a small summary of the taxonomy and an index of the sections
+# (name -> [offset, length], offsets relative to the end of the header), so callers
+# can list taxonomies from the header alone and read only the sections they need.
+MAGIC           = b'TRXT'
+FORMAT_VERSION  = 1
+FILE_EXTENSION  = '.trx'
+PREFIX          = struct.Struct('<4sHI')
+
+# Sections of a taxonomy file and the Taxonomy attributes stored in each of them.
+# The text fields (property groups, key aspects, ...) and missing hierarchies are stored as references
+# into the blob store of the 'responses' section; files written before hold them as plain text.
+SECTIONS = {
+    'metadata':     ('name', 'created_at', 'last_edit_time', 'save_path', 'saved_to', 'root_concept', 'token_usage', 'refine_metrics', 'run_parameters'),
+    'hierarchies':  ('_text_refs', 'hierarchies', '_missing_refs'),
+    'ranks':        ('ranks', 'depths', 'subconcepts_plain', 'subconcepts_levels'),
+    'trees':        ('subconcepts_trees',),
+    'responses':    ('blobs', 'responses', 'payload_store'),
+}
+
+def compress(data:bytes, codec:str) -> bytes:
+    """
+    Compress section bytes with the given codec ('zstd' or 'gzip').
+    """
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def decompress(data:bytes, codec:str) -> bytes:
+    """
+    Decompress section bytes written with the given codec.
+    """
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Taxonomy file is zstd-compressed but the 'zstandard' package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def encode_section(value, codec:str) -> bytes:
+    """
+    Pickle and compress one section value.
+    """
+    return compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), codec)
+
+def decode_section(data:bytes, codec:str):
+    """
+    Decompress and unpickle one section value.
+    """
+    return pickle.loads(decompress(data, codec))
+
+def default_codec() -> str:
+    """
+    Return 'zstd' if the zstandard package is available, 'gzip' otherwise.
+    """
+    return 'zstd' if zstandard is not None else 'gzip'
+
+def is_taxonomy_file(file_path:str) -> bool:
+    """
+    Check whether the file starts with the taxonomy container magic bytes.
+    """
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+def write_sections(file_path:str, summary:dict, sections:dict, codec = None) -> None:
+    """
+    Write pickled and compressed sections with a JSON header to file_path.
+    The file is written to a temporary file next to it, synced and moved into place,
+    so an interrupted save keeps the previous version of the file.
+
+    Args:
+        file_path (str): Destination file path.
+        summary (dict): JSON-serializable summary stored in the header.
+        sections (dict): Section name -> picklable value.
+        codec (str, optional): 'zstd' or 'gzip'; defaults to default_codec().
+    """
+    codec = codec or default_codec()
+    payloads = {name: encode_section(value, codec) for name, value in sections.items()}
+    index = {}
+    offset = 0
+    for name, payload in payloads.items():
+        index[name] = [offset, len(payload)]
+        offset += len(payload)
+    header = json.dumps({'format_version': FORMAT_VERSION, 'codec': codec, 'summary': summary, 'sections': index}).encode('utf-8')
+    temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary_path, 'wb') as file:
+            file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            file.write(header)
+            for payload in payloads.values():
+                file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.unlink(temporary_path)
+        raise
+
+def read_header(file_path:str) -> dict:
+    """
+    Read only the header (format version, codec, summary and section index) of a taxonomy file.
+    """
+    with open(file_path, 'rb') as file:
+        return _read_header(file)
+
+def _read_header(file) -> dict:
+    magic, version, header_length = PREFIX.unpack(file.read(PREFIX.size))
+    if magic != MAGIC:
+        raise ValueError("Not a taxonomy container file")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported taxonomy file format version: {version}")
+    header = json.loads(file.read(header_length).decode('utf-8'))
+    header['data_offset'] = PREFIX.size + header_length
+    return header
+
+def read_sections(file_path:str, sections = None) -> tuple:
+    """
+    Read the requested sections of a taxonomy file, seeking past the others.
+
+    Args:
+        file_path (str): Source file path.
+        sections (list, optional): Section names to read; all sections if omitted.
+
+    Returns:
+        tuple: (header dict, dict of section name -> unpickled value)
+    """
+    with open(file_path, 'rb') as file:
+        header = _read_header(file)
+        names = list(header['sections']) if sections is None else sections
+        values = {}
+        for name in names:
+            if name not in header['sections']:
+                raise KeyError(f"Unknown taxonomy file section: {name}")
+            offset, length = header['sections'][name]
+            file.seek(header['data_offset'] + offset)
+            values[name] = decode_section(file.read(length), header['codec'])
+    return header, values
@@ -1,280 +1,528 @@
+import time
 import logging
-from src.chat_templates import chat_templates
+from src.chat_templates import format_prompt
+from src.dag import Step, run_steps
 from src.models import Taxonomy
+from src.profiling import Phase
+from src.parsing import parse_indices, parse_json_object, parse_list_scores, parse_tree, split_list
+from src.responses import split_response
 
-def create_taxonomy(model_generate_new, model_verify, concept = "Transistor", log = None):
+def invoke_and_record(model, taxonomy: Taxonomy, template_id: str, prompt, **kwargs):
     """
-    Create a new taxonomy for a given concept using LLM-based prompts.
+    Invoke a model on a formatted prompt and record a compact response record in the taxonomy.
 
     Args:
+        model: Model (or structured-output runnable) to invoke.
+        taxonomy (Taxonomy): The taxonomy the response record is appended to.
+        template_id (str): Key of the chat template the prompt was formatted from.
+        prompt: Formatted prompt messages.
+        **kwargs: Extra invocation parameters (e.g. max_tokens).
+
+    Returns:
+        The raw model output; the recorded content is available as taxonomy.responses[-1].
+    """
+    start_time = time.perf_counter()
+    with Phase('invoke'):
+        response = model.invoke(prompt, **kwargs)
+    taxonomy.record_response(template_id, response, time.perf_counter() - start_time, prompt)
+    return response
+
+def run_calls(calls, taxonomy: Taxonomy):
+    """
+    Drive a call generator (e.g. subconcept_calls) synchronously: invoke and record every
+    model call it yields, send the output back and return the generator's result.
+    """
+    response = None
+    while True:
+        try:
+            model, template_id, prompt, kwargs = calls.send(response)
+        except StopIteration as stop:
+            return stop.value
+        response = invoke_and_record(model, taxonomy, template_id, prompt, **kwargs)
+
+def get_hierarchies_list(hierarchies_str):
+    """
+    Parse a semicolon-separated hierarchies string into a list of hierarchy descriptions.
+    """
+    # Split by semicolon, remove empty/short entries, and add trailing semicolon
+    return [v + ';' for v in split_list(hierarchies_str, ';') if len(v) > 5]
+
+def response_content(response) -> str:
+    """
+    Return the text content of a model response (plain or structured with include_raw=True).
+    """
+    return split_response(response)[0].content
+
+def taxonomy_steps(res: Taxonomy, model_generate_new, model_verify, log, criteria_batch_size = None, model_score = None):
+    """
+    Describe the model calls of create_taxonomy as a step graph (see src/dag.py).
+
+    The initial context calls depend only on the root concept; every hierarchy refinement step
+    depends on the hierarchies list of the previous one and on the context it uses. The criteria
+    extraction fans out over the final hierarchies and is followed by the criteria discard step.
+    Commit functions update res in the original serial order.
+
+    With criteria_batch_size, the single discard step is replaced by one score_criteria step per group
+    of criteria_batch_size lists. Each group starts as soon as its own lists are extracted and answers
+    keep/drop with a score per list ID; the decisions are merged by global list index when the last
+    group is committed. Lists without a usable decision are kept, so a bad answer only affects its group.
+
+    Args:
+        res (Taxonomy): The taxonomy being created.
         model_generate_new: Model used to generate new information.
         model_verify: Model used to verify and filter generated information.
-        concept (str): The root concept for the taxonomy.
-        log (logging.Logger, optional): Logger for info/debug output.
+        log (logging.Logger): Logger for info/debug output.
+        criteria_batch_size (int, optional): Number of criteria lists scored per call (single discard call if None).
+        model_score (optional): Structured-output model for the scoring groups (see init_role_model('score')); model_verify if None.
 
     Returns:
-        Taxonomy: The constructed and initialized taxonomy object.
+        list: Steps in commit order.
     """
-    # Set up logging if not provided
-    if not log:
-        log = logging.getLogger("create_taxonomy")
-        logging.basicConfig(level=logging.INFO)
+    concept = res.root_concept
+    new_line = '\n'
+    res.run_parameters['criteria_batch_size'] = criteria_batch_size
 
-    # Initialize the Taxonomy object with the root concept
-    res = Taxonomy(concept)
-    # For backward compatibility, also set a dict with root_concept (not used later)
-    res = {
-        "root_concept": concept,
-    }
+    def record(result):
+        # Record the finished step's response in the taxonomy
+        res.record_response(result.template_id, result.response, result.latency, result.prompt)
 
-    log.info("\n\n\n\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n\n++++++++INITIAL CONTEXT++++++++\n(property groups, key features, unknown facts)\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n")
+    def add_hierarchies(previous):
+        # Parse new hierarchies and append them to the hierarchies list of the previous step
+        return lambda inputs, response: inputs[previous] + get_hierarchies_list(response_content(response))
+
+    def commit_hierarchies(message):
+        def commit(result):
+            record(result)
+            res.add_missing(res.responses[-1].content)
+            res.hierarchies = list(result.value)
+            res.update_last_edit_time()
+            res.save()
+            log.info(f"{message}\n-------------\nconcept:\t{concept}\n{len(get_hierarchies_list(res.missing[-1]))} new hierarchies found...\n'hierarchies new':\n{new_line.join(res.hierarchies)}\n\n")
+        return commit
 
     # Step 1: Get property groups for the concept
-    prompt = chat_templates['get_property_groups'].format_messages(root_concept = concept)
-    res.responses.append(model_generate_new.invoke(prompt))
-    # Clean up the property groups string
-    res.property_groups = res.responses[-1].content.replace('\n',' ').replace('  ', ' ').strip()
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"0.1.get_property_groups()\n-------------\nconcept:\t{concept}\n\n'property groups':\n{res.property_groups}\n")
+    def commit_property_groups(result):
+        record(result)
+        res.property_groups = result.value
+        res.save()
+        log.info(f"0.1.get_property_groups()\n-------------\nconcept:\t{concept}\n\n'property groups':\n{res.property_groups}\n")
 
     # Step 2: Get key aspects of the concept
-    prompt = chat_templates['get_key_aspects'].format_messages(root_concept = concept)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.key_aspects = res.responses[-1].content
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"0.2.get_key_aspects()\n-------------\nconcept:\t{concept}\n\n'key aspects':\n{res.key_aspects}\n")
+    def commit_key_aspects(result):
+        record(result)
+        res.key_aspects = result.value
+        res.save()
+        log.info(f"0.2.get_key_aspects()\n-------------\nconcept:\t{concept}\n\n'key aspects':\n{res.key_aspects}\n")
 
     # Step 3: Get rare or obscure information about the concept
-    prompt = chat_templates['get_rare_info'].format_messages(root_concept = concept)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.rare_info = res.responses[-1].content
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"0.3.get_rare_info()\n-------------\nconcept:\t{concept}\n\n'rare info':\n{res.rare_info}\n")
-    log.info("\n\n++++++++HIERARCHIES CONSTRUCT&UPDATE++++++++\n\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n")
-
-    # Helper function to parse hierarchies string into a list
-    def get_hierarchies_list(hierarchies_str):
-        # Split by semicolon, remove empty/short entries, and add trailing semicolon
-        return [v.strip()+';' for v in hierarchies_str.strip().replace('\n','').replace(';;',';').split(';') if len(v)>5]
+    def commit_rare_info(result):
+        record(result)
+        res.rare_info = result.value
+        res.save()
+        log.info(f"0.3.get_rare_info()\n-------------\nconcept:\t{concept}\n\n'rare info':\n{res.rare_info}\n")
+        log.info("\n\n++++++++HIERARCHIES CONSTRUCT&UPDATE++++++++\n\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n")
 
     # Step 4: Construct initial hierarchies based on property groups
-    prompt = chat_templates['get_initial_hierarchies'].format_messages(root_concept = concept, properties = res.property_groups)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.initial_hierarchies = res.responses[-1].content
-    res.hierarchies = get_hierarchies_list(res['initial_hierarchies'])
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    new_line = '\n'
-    res.save()
-    log.info(f"1.get_initial_hierarchies()...\n-------------\nconcept:\t{concept}\n\n'initial hierarchies list':\n{new_line.join(res.hierarchies)}\n\n")
-
-    # Step 5: Find missing hierarchies (basic context)
-    prompt = chat_templates['find_missing_hierarchies'].format_messages(root_concept = concept, current_hierarchies = '\n'.join(res.hierarchies))
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.missing.append(res.responses[-1].content)
-    res.hierarchies += get_hierarchies_list(res.missing[-1])
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"2.find_missing_hierarchies()...\n-------------\nconcept:\t{concept}\n{len(get_hierarchies_list(res.missing[-1]))} new hierarchies found...\n'hierarchies new':\n{new_line.join(res.hierarchies)}\n\n")
-
-    # Step 6: Find additional hierarchies using general key aspects as context
-    current_hierarchies = '\n'.join(res.hierarchies)
-    prompt = chat_templates['find_additional_hierarchies'].format_messages(root_concept = concept, context = res.key_aspects, current_hierarchies = current_hierarchies)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.missing.append(res.responses[-1].content)
-    res.hierarchies += get_hierarchies_list(res.missing[-1])
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"3.1.find_additional_hierarchies()...\ncontext = general key features info\n-------------\nconcept:\t{concept}\n{len(get_hierarchies_list(res.missing[-1]))} new hierarchies found...\n'hierarchies new':\n{new_line.join(res.hierarchies)}\n\n")
-
-    # Step 7: Find additional hierarchies using rare info as context
-    current_hierarchies = '\n'.join(res.hierarchies)
-    prompt = chat_templates['find_additional_hierarchies'].format_messages(root_concept = concept, context = res.rare_info, current_hierarchies = current_hierarchies)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.missing.append(res.responses[-1].content)
-    res.hierarchies += get_hierarchies_list(res.missing[-1])
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"3.2.find_additional_hierarchies()...\ncontext = unknown rare features info\n-------------\nconcept:\t{concept}\n{len(get_hierarchies_list(res.missing[-1]))} new hierarchies found...\n'hierarchies new':\n{new_line.join(res.hierarchies)}\n\n")
-    log.info("\n\n+++++++++++++++++++=\n+++++++++++++++++++++++++++\n+++++++++++++++++++=\n\n\n")
+    def commit_initial_hierarchies(result):
+        record(result)
+        res.initial_hierarchies = res.responses[-1].content
+        res.hierarchies = list(result.value)
+        res.update_last_edit_time()
+        res.save()
+        log.info(f"1.get_initial_hierarchies()...\n-------------\nconcept:\t{concept}\n\n'initial hierarchies list':\n{new_line.join(res.hierarchies)}\n\n")
 
     # Step 8: Find present and distinctive features for the concept
-    current_hierarchies = '\n'.join(res.hierarchies)
-    # 8.1: Find present features
-    prompt = chat_templates["find_present_features"].format_messages(root_concept = concept, current_hierarchies = current_hierarchies)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.present_features = res.responses[-1].content
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"4.1.find_present_features()...\n-------------\nconcept:\t{concept}\n'present_features':\n{res.present_features}\n\n")
-
-    # 8.2: Find distinctive features based on present features
-    prompt = chat_templates["find_distinctive_features"].format_messages(root_concept = concept, properties = res.present_features)
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.distinctive_features = res.responses[-1].content
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"4.2.find_distinctive_features()...\n-------------\nconcept:\t{concept}\n'distinctive_features':\n{res.distinctive_features}\n\n")
-
-    # Step 9: Update hierarchies again using distinctive features
-    current_hierarchies = '\n'.join(res.hierarchies)
-    prompt = chat_templates['find_additional_hierarchies_for_features'].format_messages(
-        root_concept = concept,
-        current_hierarchies = current_hierarchies,
-        new_properties = res.distinctive_features
-    )
-    res.responses.append(model_generate_new.invoke(prompt))
-    res.missing.append(res.responses[-1].content)
-    res.hierarchies += get_hierarchies_list(res.missing[-1])
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"5.1.find_additional_hierarchies()...\ncontext = distinct properties\n-------------\nconcept:\t{concept}\n{len(get_hierarchies_list(res.missing[-1]))} new hierarchies found...\n'hierarchies new':\n{new_line.join(res.hierarchies)}\n\n")
-
-    # Step 10: For each hierarchy, extract taxonomical ranks (criteria)
-    res.ranks = []
-    for hierarchy in res.hierarchies:
-        prompt = chat_templates['get_criteria_basic'].format_messages(root_concept = concept, context = hierarchy)
-        res.responses.append(model_generate_new.invoke(prompt))
-        # Split the response into a list of rank names
-        res.ranks.append([v.strip() for v in res.responses[-1].content.split(",")])
-        res.update_last_edit_time()
-        res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
+    def commit_present_features(result):
+        log.info("\n\n+++++++++++++++++++=\n+++++++++++++++++++++++++++\n+++++++++++++++++++=\n\n\n")
+        record(result)
+        res.present_features = result.value
         res.save()
+        log.info(f"4.1.find_present_features()...\n-------------\nconcept:\t{concept}\n'present_features':\n{res.present_features}\n\n")
+
+    def commit_distinctive_features(result):
+        record(result)
+        res.distinctive_features = result.value
+        res.save()
+        log.info(f"4.2.find_distinctive_features()...\n-------------\nconcept:\t{concept}\n'distinctive_features':\n{res.distinctive_features}\n\n")
+
+    # Step 10: For each final hierarchy, extract taxonomical ranks (criteria); then Step 11 discards redundant ones
+    def expand_criteria(result):
+        hierarchies = result.value
+        criteria_names = [f'get_criteria_basic_{i}' for i in range(len(hierarchies))]
 
-    log.info(f"-------------\n\n'initial ranks':\n{res.ranks}\n")
-
-    # Step 11: Discard redundant or irrelevant criteria using the verification model
-    prompt = chat_templates["discard_criteria"].format_messages(root_concept = concept, context = res.ranks)
-    res.responses.append(model_verify.invoke(prompt))
-    # Remove ranks at indices specified by the model's response
-    res.ranks = [v for i, v in enumerate(res.ranks) if i not in [int(n.strip()) for n in res.responses[-1].content.split(",")]]
-    # Initialize depths and subconcept containers for each rank
-    res.depths = [0 for v in res['ranks']]
-    res.subconcepts_plain = [[] for v in res.ranks]
-    res.subconcepts_trees = [{} for v in res.ranks]
-    res.update_last_edit_time()
-    res.update_token_usage(res.responses[-1].response_metadata['token_usage'])
-    res.save()
-    log.info(f"-------------\n\n'filtered ranks':\n{res.ranks}\n")
+        def commit_criteria(result):
+            record(result)
+            res.ranks.append(result.value)
+            res.update_last_edit_time()
+            res.save()
+            if len(res.ranks) == len(hierarchies):
+                log.info(f"-------------\n\n'initial ranks':\n{res.ranks}\n")
+
+        def set_ranks(ranks):
+            res.ranks = ranks
+            # Initialize depths and subconcept containers for each rank
+            res.depths = [0 for v in res.ranks]
+            res.subconcepts_plain = [[] for v in res.ranks]
+            res.subconcepts_levels = [[] for v in res.ranks]
+            res.subconcepts_trees = [{} for v in res.ranks]
+            res.update_last_edit_time()
+            res.save()
+            log.info(f"-------------\n\n'filtered ranks':\n{res.ranks}\n")
+
+        def commit_discard(result):
+            record(result)
+            set_ranks(result.value)
+
+        def discard_ranks(inputs, response):
+            # Remove ranks at indices specified by the model's response ("None" or an answer that is not an ID list discards nothing)
+            ranks = [inputs[name] for name in criteria_names]
+            discarded = parse_indices(response_content(response), len(ranks))
+            if discarded is None:
+                log.info(f"discard_criteria answer is not an ID list, discarding nothing: {response_content(response)!r}\n")
+                discarded = []
+            return [v for i, v in enumerate(ranks) if i not in discarded]
+
+        steps = [
+            Step(name, [], model_generate_new, 'get_criteria_basic',
+                 prompt = lambda inputs, hierarchy = hierarchy: format_prompt('get_criteria_basic', root_concept = concept, context = hierarchy),
+                 # Split the response into a list of rank names
+                 parse = lambda inputs, response: split_list(response_content(response), ','),
+                 commit = commit_criteria)
+            for name, hierarchy in zip(criteria_names, hierarchies)
+        ]
+        if not criteria_batch_size:
+            steps.append(Step('discard_criteria', criteria_names, model_verify, 'discard_criteria',
+                              prompt = lambda inputs: format_prompt("discard_criteria", root_concept = concept, context = [inputs[name] for name in criteria_names]),
+                              parse = discard_ranks,
+                              commit = commit_discard))
+            return steps
+
+        # Step 11 (batched): score fixed-size groups of lists, identified by their global index
+        groups = [list(range(start, min(start + criteria_batch_size, len(criteria_names)))) for start in range(0, len(criteria_names), criteria_batch_size)]
+        decisions = {}
+
+        def score_prompt(ids):
+            return lambda inputs: format_prompt('score_criteria', root_concept = concept,
+                                                context = '\n'.join(f"{i}: {', '.join(inputs[criteria_names[i]])}" for i in ids))
+
+        def parse_scores(ids):
+            def parse(inputs, response):
+                # Fall back to the JSON object in the raw content (plain model or failed structured parser)
+                message, parsed = split_response(response)
+                if not parsed and message is not None:
+                    parsed = parse_json_object(message.content)
+                return parse_list_scores(parsed, ids)
+            return parse
+
+        def commit_scores(ids, last):
+            def commit(result):
+                record(result)
+                decisions.update(result.value)
+                kept = [i for i in ids if i not in result.value]
+                if kept:
+                    log.info(f"{result.name}: no usable decision for lists {kept}, kept\n")
+                if last:
+                    log.info(f"-------------\n\n'criteria scores':\n{dict(sorted(decisions.items()))}\n")
+                    set_ranks([v for i, v in enumerate(res.ranks) if decisions.get(i, {'keep': True})['keep']])
+            return commit
+
+        for k, ids in enumerate(groups):
+            steps.append(Step(f'score_criteria_{k}', [criteria_names[i] for i in ids], model_score or model_verify, 'score_criteria',
+                              prompt = score_prompt(ids),
+                              parse = parse_scores(ids),
+                              commit = commit_scores(ids, k == len(groups) - 1)))
+        if not groups:
+            set_ranks([])
+        return steps
+
+    return [
+        Step('get_property_groups', [], model_generate_new, 'get_property_groups',
+             prompt = lambda inputs: format_prompt('get_property_groups', root_concept = concept),
+             # Clean up the property groups string
+             parse = lambda inputs, response: response_content(response).replace('\n',' ').replace('  ', ' ').strip(),
+             commit = commit_property_groups),
+        Step('get_key_aspects', [], model_generate_new, 'get_key_aspects',
+             prompt = lambda inputs: format_prompt('get_key_aspects', root_concept = concept),
+             parse = lambda inputs, response: response_content(response),
+             commit = commit_key_aspects),
+        Step('get_rare_info', [], model_generate_new, 'get_rare_info',
+             prompt = lambda inputs: format_prompt('get_rare_info', root_concept = concept),
+             parse = lambda inputs, response: response_content(response),
+             commit = commit_rare_info),
+        Step('get_initial_hierarchies', ['get_property_groups'], model_generate_new, 'get_initial_hierarchies',
+             prompt = lambda inputs: format_prompt('get_initial_hierarchies', root_concept = concept, properties = inputs['get_property_groups']),
+             parse = lambda inputs, response: get_hierarchies_list(response_content(response)),
+             commit = commit_initial_hierarchies),
+        # Step 5: Find missing hierarchies (basic context)
+        Step('find_missing_hierarchies', ['get_initial_hierarchies'], model_generate_new, 'find_missing_hierarchies',
+             prompt = lambda inputs: format_prompt('find_missing_hierarchies', root_concept = concept, current_hierarchies = '\n'.join(inputs['get_initial_hierarchies'])),
+             parse = add_hierarchies('get_initial_hierarchies'),
+             commit = commit_hierarchies("2.find_missing_hierarchies()...")),
+        # Step 6: Find additional hierarchies using general key aspects as context
+        Step('find_additional_hierarchies_key_aspects', ['find_missing_hierarchies', 'get_key_aspects'], model_generate_new, 'find_additional_hierarchies',
+             prompt = lambda inputs: format_prompt('find_additional_hierarchies', root_concept = concept, context = inputs['get_key_aspects'], current_hierarchies = '\n'.join(inputs['find_missing_hierarchies'])),
+             parse = add_hierarchies('find_missing_hierarchies'),
+             commit = commit_hierarchies("3.1.find_additional_hierarchies()...\ncontext = general key features info")),
+        # Step 7: Find additional hierarchies using rare info as context
+        Step('find_additional_hierarchies_rare_info', ['find_additional_hierarchies_key_aspects', 'get_rare_info'], model_generate_new, 'find_additional_hierarchies',
+             prompt = lambda inputs: format_prompt('find_additional_hierarchies', root_concept = concept, context = inputs['get_rare_info'], current_hierarchies = '\n'.join(inputs['find_additional_hierarchies_key_aspects'])),
+             parse = add_hierarchies('find_additional_hierarchies_key_aspects'),
+             commit = commit_hierarchies("3.2.find_additional_hierarchies()...\ncontext = unknown rare features info")),
+        Step('find_present_features', ['find_additional_hierarchies_rare_info'], model_generate_new, 'find_present_features',
+             prompt = lambda inputs: format_prompt("find_present_features", root_concept = concept, current_hierarchies = '\n'.join(inputs['find_additional_hierarchies_rare_info'])),
+             parse = lambda inputs, response: response_content(response),
+             commit = commit_present_features),
+        Step('find_distinctive_features', ['find_present_features'], model_generate_new, 'find_distinctive_features',
+             prompt = lambda inputs: format_prompt("find_distinctive_features", root_concept = concept, properties = inputs['find_present_features']),
+             parse = lambda inputs, response: response_content(response),
+             commit = commit_distinctive_features),
+        # Step 9: Update hierarchies again using distinctive features
+        Step('find_additional_hierarchies_for_features', ['find_additional_hierarchies_rare_info', 'find_distinctive_features'], model_generate_new, 'find_additional_hierarchies_for_features',
+             prompt = lambda inputs: format_prompt('find_additional_hierarchies_for_features', 
+                 root_concept = concept,
+                 current_hierarchies = '\n'.join(inputs['find_additional_hierarchies_rare_info']),
+                 new_properties = inputs['find_distinctive_features']
+             ),
+             parse = add_hierarchies('find_additional_hierarchies_rare_info'),
+             commit = commit_hierarchies("5.1.find_additional_hierarchies()...\ncontext = distinct properties"),
+             expand = expand_criteria),
+    ]
+
+@Phase('create_taxonomy')
+def create_taxonomy(model_generate_new, model_verify, concept = "Transistor", log = None, max_workers = 4, save_path = None, criteria_batch_size = None, model_score = None):
+    """
+    Create a new taxonomy for a given concept using LLM-based prompts.
+
+    The calls run as a step graph (see taxonomy_steps): the initial context calls run concurrently,
+    hierarchy refinement starts as soon as its inputs are ready, and criteria extraction fans out
+    over the hierarchies. Results are applied in the serial order, so the resulting state is the
+    same as a serial run (max_workers = 1).
+
+    Args:
+        model_generate_new: Model used to generate new information.
+        model_verify: Model used to verify and filter generated information.
+        concept (str): The root concept for the taxonomy.
+        log (logging.Logger, optional): Logger for info/debug output.
+        max_workers (int): Maximum number of concurrent model calls.
+        save_path (str, optional): Directory the taxonomy is saved to (data/taxonomies by default).
+        criteria_batch_size (int, optional): Verify the criteria lists in concurrent groups of this size (see taxonomy_steps).
+        model_score (optional): Structured-output model for the criteria groups (see init_role_model('score')).
+
+    Returns:
+        Taxonomy: The constructed and initialized taxonomy object.
+    """
+    # Set up logging if not provided
+    if not log:
+        log = logging.getLogger("create_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+
+    # Initialize the Taxonomy object with the root concept
+    res = Taxonomy(concept, save_path)
+
+    log.info("\n\n\n\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n\n++++++++INITIAL CONTEXT++++++++\n(property groups, key features, unknown facts)\n+++++++++++++++++++++++++++\n\n\n+++++++++++++++++++=\n")
+    run_steps(taxonomy_steps(res, model_generate_new, model_verify, log, criteria_batch_size, model_score), max_workers)
 
     # Return the fully initialized taxonomy object
     return res
 
-def generate_subconcepts(
+def subconcept_calls(
     model_generate_new, 
     model_re_generate, 
     taxonomy: Taxonomy, 
     ranks_list_num: int, 
     stop_at_depth: int = None, 
     max_subconcepts_per_iteration: int = 15, 
-    log = None
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None
 ):
-    # Set up logging if not provided
-    if not log:
-        log = logging.getLogger("generate_subconcepts")
-        logging.basicConfig(level=logging.INFO)
+    """
+    Generator holding the iteration logic of generate_subconcepts without performing any I/O.
+    It yields (model, template_id, prompt, invoke_kwargs) for every model call and expects the raw
+    model output to be sent back after the call was recorded in the taxonomy (see run_calls).
+    The same generator is driven synchronously by generate_subconcepts and asynchronously by
+    src/async_workflow.py, so both produce identical taxonomies.
 
-    # Determine the maximum depth to iterate through
+    Returns (as the StopIteration value):
+        Taxonomy: The updated taxonomy.
+    """
+    # The structured refine stage replaces discard + postprocess and needs its own JSON-output model
+    if refine_mode not in ("two_call", "structured"):
+        raise ValueError(f"Unknown refine_mode: {refine_mode}")
+    if refine_mode == "structured" and model_refine is None:
+        raise ValueError("refine_mode 'structured' requires model_refine (see init_refine_model)")
+    taxonomy.run_parameters.update(stop_at_depth = stop_at_depth, max_subconcepts_per_iteration = max_subconcepts_per_iteration, refine_mode = refine_mode)
+
+    # Determine the maximum depth to iterate through (never beyond the available ranks)
     if stop_at_depth:
-        max_depth = stop_at_depth
+        max_depth = min(stop_at_depth, len(taxonomy.ranks[ranks_list_num]))
     else: 
         max_depth = len(taxonomy.ranks[ranks_list_num])
 
-    i = 0  # Current depth/iteration index
-    taxonomical_context = taxonomy.ranks[ranks_list_num][0]  # Start with the first rank as context
+    # Taxonomies created before per-level subconcepts were recorded get empty level lists
+    while len(taxonomy.subconcepts_levels) < len(taxonomy.ranks):
+        taxonomy.subconcepts_levels.append([])
+    i = taxonomy.depths[ranks_list_num]  # Current depth/iteration index
+    levels = taxonomy.subconcepts_levels[ranks_list_num]
     target_concept = taxonomy.root_concept  # Start with the root concept
+    if 0 < i < max_depth:
+        if len(levels) == i:
+            # Resume from the leaves of the deepest generated level
+            target_concept = levels[-1]
+            log.info(f"resuming rank list {ranks_list_num} at depth {i}\n")
+        else:
+            # Generated before per-level lists were recorded: the leaves are unknown, so start over
+            log.info(f"no per-level subconcepts recorded for rank list {ranks_list_num}, regenerating from depth 0\n")
+            taxonomy.subconcepts_plain[ranks_list_num] = []
+            taxonomy.depths[ranks_list_num] = 0
+            levels.clear()
+            i = 0
 
     # Iterate through each rank up to the maximum depth
     while i < max_depth:
+        # Ranks up to the current one form the taxonomical context
+        taxonomical_context = " > ".join(taxonomy.ranks[ranks_list_num][:i + 1])
         # 1. Generate a definition for the current concept at this rank
-        prompt = chat_templates["define"].format_messages(
-            root_concept = taxonomy.root_concept, 
-            target_concept = target_concept, 
-            target_rank = taxonomy.ranks[ranks_list_num][i], 
-            taxonomical_context = taxonomical_context
-        )
-        definition_response = model_generate_new.invoke(prompt, max_tokens=200)
-        context_string = " " + definition_response.content  # Use the definition as context
+        with Phase('define'):
+            prompt = format_prompt("define", 
+                root_concept = taxonomy.root_concept, 
+                target_concept = target_concept, 
+                target_rank = taxonomy.ranks[ranks_list_num][i], 
+                taxonomical_context = taxonomical_context
+            )
+            yield model_generate_new, 'define', prompt, {'max_tokens': 200}
+            context_string = " " + taxonomy.responses[-1].content  # Use the definition as context
 
         # 2. Generate a list of candidate subconcepts for the current rank
-        prompt = chat_templates["list_subconcepts"].format_messages(
-            root_concept = taxonomy.root_concept, 
-            concept = target_concept, 
-            context_string = context_string, 
-            taxonomical_rank = taxonomy.ranks[ranks_list_num][i], 
-            taxonomical_context = taxonomical_context, 
-            subconcepts_amount = max_subconcepts_per_iteration
-        )
-        taxonomy.responses.append(model_generate_new.invoke(prompt, max_tokens=200))
-        # Parse the response into a list of subconcepts, filtering out overly long entries
-        subconcepts_list = [v.strip() for v in taxonomy.responses[-1].content.split(',') if len(v) <= 120]
-        taxonomy.update_last_edit_time()
-        taxonomy.update_token_usage(taxonomy.responses[-1].response_metadata['token_usage'])
-        taxonomy.save()
-        log.info(f"generated concepts at iteration {i}: {subconcepts_list}\n")
-        
-        # 3. Identify and remove redundant subconcepts using the re-generation model
-        prompt = chat_templates["discard_subconcepts"].format_messages(
-            root_concept = taxonomy.root_concept, 
-            taxonomical_rank = taxonomy.ranks[ranks_list_num][i], 
-            taxonomical_context = taxonomical_context, 
-            candidate_list = subconcepts_list
-        )
-        taxonomy.responses.append(model_re_generate.invoke(prompt, max_tokens=200))
-        redundant_subconcepts = [v.strip() for v in taxonomy.responses[-1].content.split(',') if len(v) <= 120]
-        taxonomy.update_last_edit_time()
-        taxonomy.update_token_usage(taxonomy.responses[-1].response_metadata['token_usage'])
-        taxonomy.save()
-        log.info(f"redundant subconcepts list: {redundant_subconcepts}\n")
-        
-        # Normalize redundant subconcepts for case-insensitive comparison
-        redundant_subconcepts = [subconcept.lower() for subconcept in redundant_subconcepts]
-        # Filter out redundant subconcepts from the candidate list
-        subconcepts_list = [subconcept for subconcept in subconcepts_list if subconcept.lower() not in redundant_subconcepts]
-        
-        # 4. Post-process the filtered subconcepts for final refinement
-        prompt = chat_templates["postprocess_subconcepts"].format_messages(
-            root_concept = taxonomy.root_concept, 
-            taxonomical_rank = taxonomy.ranks[ranks_list_num][i],
-            subconcept_candidates = subconcepts_list
-        )
-        taxonomy.responses.append(model_re_generate.invoke(prompt, max_tokens=300))
-        subconcepts_list = [v.strip() for v in taxonomy.responses[-1].content.split(',') if len(v) <= 120]
-        taxonomy.update_last_edit_time()
-        taxonomy.update_token_usage(taxonomy.responses[-1].response_metadata['token_usage'])
-        log.info(f"postprocessed concepts: {subconcepts_list}\n")
+        with Phase('list_subconcepts'):
+            prompt = format_prompt("list_subconcepts", 
+                root_concept = taxonomy.root_concept, 
+                concept = target_concept, 
+                context_string = context_string, 
+                taxonomical_rank = taxonomy.ranks[ranks_list_num][i], 
+                taxonomical_context = taxonomical_context, 
+                subconcepts_amount = max_subconcepts_per_iteration
+            )
+            yield model_generate_new, 'list_subconcepts', prompt, {'max_tokens': 200}
+            # Parse the response into a list of subconcepts, filtering out overly long entries
+            subconcepts_list = split_list(taxonomy.responses[-1].content, ',', max_length = 120)
+            taxonomy.update_last_edit_time()
+            taxonomy.save()
+            log.info(f"generated concepts at iteration {i}: {subconcepts_list}\n")
         
+        if refine_mode == "structured":
+            # 3-4. Discard and refine the candidates in a single structured-output call
+            with Phase('refine_subconcepts'):
+                prompt = format_prompt("refine_subconcepts", 
+                    root_concept = taxonomy.root_concept, 
+                    taxonomical_rank = taxonomy.ranks[ranks_list_num][i], 
+                    taxonomical_context = taxonomical_context, 
+                    candidate_list = subconcepts_list
+                )
+                refine_response = yield model_refine, 'refine_subconcepts', prompt, {}
+                # Fall back to the JSON object in the raw content if the structured parser failed
+                refined = refine_response['parsed'] or parse_json_object(response_content(refine_response)) or {}
+                if not isinstance(refined.get('kept'), list):
+                    # Keep the candidates unchanged if the structured output is unusable
+                    log.info(f"refine output could not be parsed, keeping candidates: {refine_response['parsing_error']}\n")
+                    refined = {'kept': subconcepts_list, 'dropped': [], 'renamed': {}}
+                renamed = refined.get('renamed') if isinstance(refined.get('renamed'), dict) else {}
+                log.info(f"redundant subconcepts list: {refined.get('dropped', [])}\n")
+                # Replace every kept candidate with its refined name
+                subconcepts_list = [str(renamed.get(v, v)).strip() for v in refined['kept'] if isinstance(v, str)]
+                subconcepts_list = [v for v in subconcepts_list if v and len(v) <= 120]
+                taxonomy.update_last_edit_time()
+                taxonomy.update_refine_metrics(refine_mode, taxonomy.responses[-1].token_usage, taxonomy.responses[-1].latency)
+                log.info(f"postprocessed concepts: {subconcepts_list}\n")
+        else:
+            # 3. Identify and remove redundant subconcepts using the re-generation model
+            with Phase('discard_subconcepts'):
+                prompt = format_prompt("discard_subconcepts", 
+                    root_concept = taxonomy.root_concept, 
+                    taxonomical_rank = taxonomy.ranks[ranks_list_num][i], 
+                    taxonomical_context = taxonomical_context, 
+                    candidate_list = subconcepts_list
+                )
+                yield model_re_generate, 'discard_subconcepts', prompt, {'max_tokens': 200}
+                discard_record = taxonomy.responses[-1]
+                redundant_subconcepts = split_list(taxonomy.responses[-1].content, ',', max_length = 120)
+                taxonomy.update_last_edit_time()
+                taxonomy.save()
+                log.info(f"redundant subconcepts list: {redundant_subconcepts}\n")
+            
+                # Normalize redundant subconcepts for case-insensitive comparison
+                redundant_subconcepts = [subconcept.lower() for subconcept in redundant_subconcepts]
+                # Filter out redundant subconcepts from the candidate list
+                subconcepts_list = [subconcept for subconcept in subconcepts_list if subconcept.lower() not in redundant_subconcepts]
+            
+            # 4. Post-process the filtered subconcepts for final refinement
+            with Phase('postprocess_subconcepts'):
+                prompt = format_prompt("postprocess_subconcepts", 
+                    root_concept = taxonomy.root_concept, 
+                    taxonomical_rank = taxonomy.ranks[ranks_list_num][i],
+                    subconcept_candidates = subconcepts_list
+                )
+                yield model_re_generate, 'postprocess_subconcepts', prompt, {'max_tokens': 300}
+                subconcepts_list = split_list(taxonomy.responses[-1].content, ',', max_length = 120)
+                taxonomy.update_last_edit_time()
+                # Both calls of the two-call path count as one refine iteration
+                refine_token_usage = {key: discard_record.token_usage[key] + taxonomy.responses[-1].token_usage[key] for key in taxonomy.token_usage.keys()}
+                taxonomy.update_refine_metrics(refine_mode, refine_token_usage, discard_record.latency + taxonomy.responses[-1].latency, calls = 2)
+                log.info(f"postprocessed concepts: {subconcepts_list}\n")
+            
         # 5. Add the final subconcepts to the taxonomy's plain list for this rank
         taxonomy.subconcepts_plain[ranks_list_num] += subconcepts_list
+        levels.append(subconcepts_list)
         # Set the target concept for the next iteration to the current subconcepts
         target_concept = subconcepts_list
         
         i += 1  # Move to the next depth/rank
         taxonomy.depths[ranks_list_num] += 1  # Increment the depth for this rank
         taxonomy.save()
-        # Update the taxonomical context for the next iteration
-        taxonomical_context += " > " + taxonomy.ranks[ranks_list_num][i]
     return taxonomy
 
+@Phase('generate_subconcepts')
+def generate_subconcepts(
+    model_generate_new, 
+    model_re_generate, 
+    taxonomy: Taxonomy, 
+    ranks_list_num: int, 
+    stop_at_depth: int = None, 
+    max_subconcepts_per_iteration: int = 15, 
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None
+):
+    # Set up logging if not provided
+    if not log:
+        log = logging.getLogger("generate_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    # In the memory-bounded mode the rank list stays resident until it is complete
+    taxonomy.pin_rank_list(ranks_list_num)
+    try:
+        return run_calls(subconcept_calls(
+            model_generate_new, 
+            model_re_generate, 
+            taxonomy, 
+            ranks_list_num, 
+            stop_at_depth, 
+            max_subconcepts_per_iteration, 
+            log,
+            refine_mode,
+            model_refine
+        ), taxonomy)
+    finally:
+        taxonomy.release_rank_list(ranks_list_num)
+
 def generate_subconcepts_for_all_ranks(
     model_generate_new, 
     model_re_generate, 
     taxonomy: Taxonomy, 
     stop_at_depth: int = None, 
     max_subconcepts_per_iteration: int = 15, 
-    log = None
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None
 ):
     """
     Generate subconcepts for all taxonomical ranks in the taxonomy.
@@ -286,6 +534,9 @@ def generate_subconcepts_for_all_ranks(
         stop_at_depth (int, optional): Maximum depth to generate subconcepts for each rank.
         max_subconcepts_per_iteration (int): Maximum number of subconcepts to generate per iteration.
         log (logging.Logger, optional): Logger for info/debug output.
+        refine_mode (str): "two_call" runs the discard and postprocess steps separately,
+            "structured" replaces them with a single JSON-output refine call.
+        model_refine (optional): Structured-output model used when refine_mode is "structured".
 
     Returns:
         Taxonomy: The updated taxonomy with generated subconcepts.
@@ -303,7 +554,9 @@ def generate_subconcepts_for_all_ranks(
             i, 
             stop_at_depth, 
             max_subconcepts_per_iteration, 
-            log
+            log,
+            refine_mode,
+            model_refine
         )
         # Log the depth reached for the current rank
         log.info(f"depth of rank {taxonomy.ranks[i]}: {taxonomy.depths[i]}")
@@ -311,10 +564,12 @@ def generate_subconcepts_for_all_ranks(
         taxonomy.save()
     return taxonomy
 
+@Phase('integrate_subconcepts')
 def integrate_subconcepts(
     model_integrate, 
     taxonomy: Taxonomy, 
-    log = None
+    log = None,
+    rank_indices = None
 ):
     """
     Integrate the generated subconcepts into the taxonomy structure using a model.
@@ -323,6 +578,7 @@ def integrate_subconcepts(
         model_integrate: Model used to integrate subconcepts into a hierarchical structure.
         taxonomy (Taxonomy): The taxonomy object containing subconcepts.
         log (logging.Logger, optional): Logger for info/debug output.
+        rank_indices (list, optional): Indices of the rank lists to (re-)integrate; all if omitted.
 
     Returns:
         Taxonomy: The updated taxonomy with integrated subconcept trees.
@@ -330,19 +586,135 @@ def integrate_subconcepts(
     if not log:
         log = logging.getLogger("integrate_subconcepts")
         logging.basicConfig(level=logging.INFO)
-    # Iterate through all ranks in the taxonomy
-    for i in range(len(taxonomy.ranks)):
-        # Prepare the prompt for integrating subconcepts for the current rank
-        prompt = chat_templates["integrate_subconcepts"].format_messages(
-            root_concept = taxonomy.root_concept, 
-            subconcepts = taxonomy.subconcepts_plain[i]
-        )
+    # Iterate through all (or the requested) ranks in the taxonomy
+    for i in (range(len(taxonomy.ranks)) if rank_indices is None else rank_indices):
         # Invoke the integration model to build the hierarchical structure
-        taxonomy.responses.append(model_integrate.invoke(prompt))
-        # Store the resulting taxonomy tree for the current rank
-        taxonomy.subconcepts_trees[i] = taxonomy.responses[-1]['taxonomy']
-        # Update metadata and save the taxonomy state
-        taxonomy.update_last_edit_time()
-        taxonomy.update_token_usage(taxonomy.responses[-1].response_metadata['token_usage'])
+        integrate_response = invoke_and_record(model_integrate, taxonomy, 'integrate_subconcepts', integrate_prompt(taxonomy, i))
+        store_integrated(taxonomy, i, integrate_response, log)
+    return taxonomy
+
+def integrate_prompt(taxonomy: Taxonomy, i: int):
+    """
+    Format the integration prompt for the subconcepts of rank list i.
+    """
+    return format_prompt("integrate_subconcepts", 
+        root_concept = taxonomy.root_concept, 
+        subconcepts = taxonomy.subconcepts_plain[i]
+    )
+
+def store_integrated(taxonomy: Taxonomy, i: int, integrate_response, log) -> None:
+    """
+    Store the tree of a (recorded) integration response for rank list i and save the taxonomy.
+    The tree is validated and normalized to {parent: [children]}; if no tree can be recovered,
+    the subconcepts are stored flat under the root concept instead of aborting the run.
+    """
+    message, parsed = split_response(integrate_response)
+    tree = parse_tree(message.content if message is not None else None, parsed)
+    if not tree:
+        log.info(f"integration output for rank list {i} is not a usable tree, storing subconcepts flat under the root concept\n")
+        tree = {taxonomy.root_concept: list(taxonomy.subconcepts_plain[i])} if taxonomy.subconcepts_plain[i] else {}
+    # Store the resulting taxonomy tree for the current rank
+    taxonomy.subconcepts_trees[i] = tree
+    # Update metadata and save the taxonomy state
+    taxonomy.update_last_edit_time()
+    taxonomy.save()
+
+def plan_expansion(
+    taxonomy: Taxonomy, 
+    stop_at_depth: int = None, 
+    hierarchies = None
+):
+    """
+    Compare a requested configuration with what the taxonomy already recorded.
+
+    Args:
+        taxonomy (Taxonomy): The existing taxonomy.
+        stop_at_depth (int, optional): Requested maximum depth for each rank list.
+        hierarchies (list, optional): Requested hierarchy descriptions; descriptions not yet in taxonomy.hierarchies are new.
+
+    Returns:
+        dict: 'new_hierarchies' (list of descriptions to extract new rank lists from) and
+            'deepen' (rank list index -> (current depth, target depth)) for existing rank lists.
+    """
+    new_hierarchies = [v for v in dict.fromkeys(hierarchies or []) if v not in taxonomy.hierarchies]
+    deepen = {}
+    for i, ranks in enumerate(taxonomy.ranks):
+        target_depth = min(stop_at_depth, len(ranks)) if stop_at_depth else len(ranks)
+        if taxonomy.depths[i] < target_depth:
+            deepen[i] = (taxonomy.depths[i], target_depth)
+    return {'new_hierarchies': new_hierarchies, 'deepen': deepen}
+
+def expand_taxonomy(
+    model_generate_new, 
+    model_re_generate, 
+    model_integrate, 
+    taxonomy: Taxonomy, 
+    stop_at_depth: int = None, 
+    max_subconcepts_per_iteration: int = 15, 
+    hierarchies = None, 
+    log = None,
+    refine_mode: str = "two_call",
+    model_refine = None
+):
+    """
+    Incrementally re-expand an existing (e.g. loaded) taxonomy.
+    Only the delta against the recorded depths, ranks and hierarchies is generated:
+    new depths on the leaves of existing rank lists and new rank lists for new hierarchies.
+    Only the affected subconcept trees are re-integrated.
+
+    Args:
+        model_generate_new: Model used to generate new concepts and rank lists.
+        model_re_generate: Model used to refine and filter concepts.
+        model_integrate: Model used to integrate subconcepts into a hierarchical structure.
+        taxonomy (Taxonomy): The taxonomy object to expand.
+        stop_at_depth (int, optional): Requested maximum depth for each rank list.
+        max_subconcepts_per_iteration (int): Maximum number of subconcepts to generate per iteration.
+        hierarchies (list, optional): Hierarchy descriptions to include; new ones get their own rank lists.
+        log (logging.Logger, optional): Logger for info/debug output.
+        refine_mode (str): Refine mode passed to generate_subconcepts.
+        model_refine (optional): Structured-output model used when refine_mode is "structured".
+
+    Returns:
+        Taxonomy: The expanded taxonomy.
+    """
+    if not log:
+        log = logging.getLogger("expand_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+
+    plan = plan_expansion(taxonomy, stop_at_depth, hierarchies)
+    log.info(f"expansion plan: {len(plan['new_hierarchies'])} new hierarchies, deepen rank lists {plan['deepen']}\n")
+
+    # 1. Extract rank lists for the new hierarchies
+    affected = list(plan['deepen'])
+    for hierarchy in plan['new_hierarchies']:
+        prompt = format_prompt('get_criteria_basic', root_concept = taxonomy.root_concept, context = hierarchy)
+        invoke_and_record(model_generate_new, taxonomy, 'get_criteria_basic', prompt)
+        taxonomy.hierarchies.append(hierarchy)
+        taxonomy.ranks.append(split_list(taxonomy.responses[-1].content, ','))
+        taxonomy.depths.append(0)
+        taxonomy.subconcepts_plain.append([])
+        taxonomy.subconcepts_levels.append([])
+        taxonomy.subconcepts_trees.append({})
+        affected.append(len(taxonomy.ranks) - 1)
+        taxonomy.save()
+        log.info(f"new rank list {len(taxonomy.ranks) - 1}: {taxonomy.ranks[-1]}\n")
+
+    # 2. Generate only the missing depths of the affected rank lists
+    for i in affected:
+        taxonomy = generate_subconcepts(
+            model_generate_new, 
+            model_re_generate, 
+            taxonomy, 
+            i, 
+            stop_at_depth, 
+            max_subconcepts_per_iteration, 
+            log,
+            refine_mode,
+            model_refine
+        )
+        log.info(f"depth of rank {taxonomy.ranks[i]}: {taxonomy.depths[i]}")
         taxonomy.save()
+
+    # 3. Re-integrate only the affected subconcept trees
+    taxonomy = integrate_subconcepts(model_integrate, taxonomy, log, rank_indices = affected)
     return taxonomy
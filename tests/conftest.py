@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import logging
+
+import pytest
+
+# Run from any directory: the tests import the package as src.*
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.http_pool import HTTPPool
+from src.models import init_role_model
+from src.stub_server import StubServer
+
+def taxonomy_responder(body:dict) -> str:
+    """
+    Completion text for the workflow prompts, chosen by keywords of the templates.
+    Answers depend only on the prompt, so repeated runs (sync, async, replayed) give the same taxonomy.
+    """
+    text = "\n".join(str(message.get('content', '')) for message in body.get('messages', []))
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        if "kept" in text:
+            return json.dumps({'kept': ["A", "B, with comma"], 'dropped': ["C"], 'renamed': {"A": "A Thing"}})
+        if '"lists"' in text:
+            return json.dumps({'lists': [{'id': 0, 'keep': True, 'score': 0.9}, {'id': 1, 'keep': False, 'score': 0.1}]})
+        return json.dumps({'taxonomy': {"Root": ["A Thing", "B"], "A Thing": ["X"]}})
+    if "redundant lists" in text or "IDs of the redundant" in text:
+        return "1"
+    if "Hierarchy X" in text or "Hierarchy 1:" in text:
+        number = sum(map(ord, text)) % 97
+        return f"Hierarchy {number}: some long description; Hierarchy {number + 1}: another description;"
+    if "criteria" in text and "comma-separated" in text:
+        return "Rank a, Rank b, Rank c, Rank d"
+    if "Redundant sub-concepts" in text:
+        return "C"
+    return "A, B, C"
+
+@pytest.fixture(scope='session', autouse=True)
+def quiet_logs():
+    logging.disable(logging.INFO)
+    yield
+    logging.disable(logging.NOTSET)
+
+@pytest.fixture(scope='module')
+def stub_server():
+    with StubServer(taxonomy_responder) as server:
+        yield server
+
+def stub_role_models(server:StubServer) -> dict:
+    """
+    Models of every workflow role pointed at the stub server, keyed by role. They get their own HTTPPool:
+    its async client is bound to the event loop it is first used on, so every asyncio.run needs new models.
+    """
+    http_pool = HTTPPool()
+    roles = ('generate new', 're-generate', 'verify', 'integrate', 'refine', 'score')
+    return {role: init_role_model(role, http_pool = http_pool, base_url = server.base_url, api_key = "stub", max_retries = 0) for role in roles}
+
+@pytest.fixture(scope='module')
+def role_models(stub_server):
+    return stub_role_models(stub_server)
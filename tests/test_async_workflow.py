@@ -0,0 +1,38 @@
+import os
+import asyncio
+
+from conftest import stub_role_models
+from src.async_workflow import acreate_taxonomy, agenerate_subconcepts_for_all_ranks, aintegrate_subconcepts
+from src.models import Taxonomy
+from src.replay import diff_taxonomies
+from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+
+def test_sync_and_async_workflows_build_the_same_taxonomy(role_models, tmp_path):
+    generate_new, re_generate, verify, integrate = (role_models[role] for role in ('generate new', 're-generate', 'verify', 'integrate'))
+    taxonomy = create_taxonomy(generate_new, verify, "Transistor", save_path = str(tmp_path))
+    taxonomy = generate_subconcepts_for_all_ranks(generate_new, re_generate, taxonomy, 2, 5)
+    taxonomy = integrate_subconcepts(integrate, taxonomy)
+
+    async def build():
+        result = await acreate_taxonomy(generate_new, verify, "Transistor", save_path = str(tmp_path))
+        await agenerate_subconcepts_for_all_ranks(generate_new, re_generate, result, 2, 5, max_concurrency = 4)
+        return await aintegrate_subconcepts(integrate, result)
+
+    result = asyncio.run(build())
+    assert result.hierarchies == taxonomy.hierarchies
+    assert result.ranks and diff_taxonomies(taxonomy, result)['identical']
+    assert sorted(record.template_id for record in result.responses) == sorted(record.template_id for record in taxonomy.responses)
+    assert result.token_usage == taxonomy.token_usage
+
+def test_concurrent_runs_save_to_separate_files(stub_server, tmp_path):
+    role_models = stub_role_models(stub_server)
+
+    async def build_both():
+        return await asyncio.gather(*(acreate_taxonomy(role_models['generate new'], role_models['verify'], concept, save_path = str(tmp_path))
+                                      for concept in ("Alpha", "Beta")))
+
+    alpha, beta = asyncio.run(build_both())
+    assert alpha.name != beta.name
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(taxonomy.saved_to[0]) for taxonomy in (alpha, beta))
+    assert Taxonomy.load(alpha.saved_to[0]).root_concept == "Alpha"
+    assert Taxonomy.load(beta.saved_to[0]).root_concept == "Beta"
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.coalescing import CoalescingModel
+
+class GatedModel:
+    """
+    Blocks every call until release is set, then answers (or raises error).
+    """
+    def __init__(self, error = None) -> None:
+        self.release = threading.Event()
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content = f"answer to {prompt}", response_metadata = {'token_usage': {'total_tokens': 7}})
+
+def run_together(model, prompts):
+    # Start the callers, wait until all but the leader share its flight, then let the model answer
+    results = [None] * len(prompts)
+
+    def call(i):
+        try:
+            results[i] = model.invoke(prompts[i])
+        except BaseException as error:
+            results[i] = error
+
+    threads = [threading.Thread(target = call, args = (i,)) for i in range(len(prompts))]
+    for thread in threads:
+        thread.start()
+    while model.metrics()['calls'] < len(prompts):
+        threading.Event().wait(0.001)
+    model.model.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+def test_identical_calls_share_one_model_call():
+    model = CoalescingModel(GatedModel())
+    results = run_together(model, ["Hello"] * 4 + ["Other"])
+    assert [result.content for result in results] == ["answer to Hello"] * 4 + ["answer to Other"]
+    assert model.model.calls == 2
+    metrics = model.metrics()
+    assert (metrics['coalesced'], metrics['saved_tokens'], metrics['in_flight']) == (3, 21, 0)
+
+def test_errors_are_shared():
+    model = CoalescingModel(GatedModel(ValueError("bad request")))
+    results = run_together(model, ["Hello"] * 3)
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_interrupt_of_the_shared_call_reaches_every_caller():
+    model = CoalescingModel(GatedModel(KeyboardInterrupt()))
+    results = run_together(model, ["Hello"] * 3)
+    assert sum(isinstance(result, KeyboardInterrupt) for result in results) == 1
+    assert sum(isinstance(result, RuntimeError) for result in results) == 2
+    assert model.metrics()['in_flight'] == 0
@@ -0,0 +1,61 @@
+import time
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.concurrency import AIMDLimiter, LimitedModel
+
+class TimedModel:
+    """
+    Answers after seconds_per_token times max_tokens, reporting max_tokens completion tokens.
+    """
+    def __init__(self, seconds_per_token:float = 0.0005) -> None:
+        self.seconds_per_token = seconds_per_token
+
+    def invoke(self, prompt, max_tokens = 10, **kwargs):
+        time.sleep(self.seconds_per_token * max_tokens)
+        return AIMessage(content = "x", response_metadata = {'token_usage': {'completion_tokens': max_tokens}})
+
+class InterruptedModel:
+    def invoke(self, prompt, **kwargs):
+        raise KeyboardInterrupt
+
+def test_mixed_lengths_do_not_decrease_the_limit():
+    model = LimitedModel(TimedModel(), AIMDLimiter(initial = 4))
+    for i in range(30):
+        model.invoke("short", max_tokens = 10)
+        model.invoke("long", max_tokens = 200)
+    metrics = model.metrics()
+    assert metrics['decreases'] == 0
+    assert metrics['in_flight'] == 0
+
+def test_interrupted_call_frees_its_slot():
+    limiter = AIMDLimiter(initial = 1, max_limit = 1)
+    model = LimitedModel(InterruptedModel(), limiter)
+    for i in range(3):
+        with pytest.raises(KeyboardInterrupt):
+            model.invoke("Hello")
+    assert limiter.metrics()['in_flight'] == 0
+    assert LimitedModel(TimedModel(), limiter).invoke("Hello").content == "x"
+
+def test_queued_callers_are_served_in_order():
+    limiter = AIMDLimiter(initial = 1, max_limit = 1)
+    start_time = limiter.acquire()
+    order = []
+
+    def call(i):
+        limiter.release(limiter.acquire())
+        order.append(i)
+
+    threads = []
+    for i in range(3):
+        threads.append(threading.Thread(target = call, args = (i,)))
+        threads[-1].start()
+        while limiter.metrics()['queue_depth'] < i + 1:
+            time.sleep(0.001)
+    limiter.release(start_time)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2]
+    assert limiter.metrics()['max_queue_depth'] == 3
@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from src.models import Taxonomy
+from src.replay import Replay, ReplayMiss, diff_taxonomies, replay_run
+from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def recorded_path(role_models, tmp_path_factory):
+    """
+    Path of a taxonomy recorded against the stub server (batched criteria, structured refine, integration).
+    """
+    taxonomy = create_taxonomy(role_models['generate new'], role_models['verify'], "Transistor", save_path = str(tmp_path_factory.mktemp("recorded")),
+                               criteria_batch_size = 3, model_score = role_models['score'])
+    taxonomy = generate_subconcepts_for_all_ranks(role_models['generate new'], role_models['re-generate'], taxonomy, 2, 7,
+                                                  None, "structured", role_models['refine'])
+    taxonomy = integrate_subconcepts(role_models['integrate'], taxonomy)
+    return taxonomy.save()
+
+@pytest.mark.parametrize('mode', ['prompt', 'order'])
+def test_replay_round_trip(recorded_path, mode):
+    recorded = Taxonomy.load(recorded_path)
+    assert recorded.run_parameters['criteria_batch_size'] == 3
+    assert recorded.run_parameters['max_subconcepts_per_iteration'] == 7
+    replayed, report = replay_run(recorded, mode)
+    assert diff_taxonomies(recorded, replayed)['identical']
+    assert report['calls'] == len(recorded.responses)
+    assert report['replay']['unused'] == 0
+    assert report['replay']['prompt_mismatches'] == 0
+    assert replayed.save_path != os.path.dirname(recorded_path)
+
+def test_replay_miss_on_new_prompt(recorded_path):
+    replay = Replay(Taxonomy.load(recorded_path))
+    with pytest.raises(ReplayMiss):
+        replay.next_record("a prompt that was never recorded")
+
+def test_replay_cli(recorded_path, tmp_path):
+    result = subprocess.run([sys.executable, "-m", "src.replay", recorded_path], cwd = tmp_path, capture_output = True, text = True,
+                            env = {**os.environ, 'PYTHONPATH': ROOT}, timeout = 120)
+    assert result.returncode == 0, result.stderr
+    assert "ranks, plain subconcepts and trees are identical" in result.stdout
+    assert not os.path.exists(os.path.join(tmp_path, "data"))
@@ -0,0 +1,86 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src.models import Taxonomy
+from src.repository import TaxonomyRepository
+from src.workflow import create_taxonomy, generate_subconcepts_for_all_ranks, integrate_subconcepts
+
+TABLES = {
+    'ranks': "SELECT rank_list, position, label, label_norm, depth FROM ranks",
+    'nodes': "SELECT rank_list, node_id, label, label_norm, depth FROM nodes",
+    'edges': "SELECT rank_list, parent_id, child_id FROM edges",
+    'calls': "SELECT seq, template_id, prompt_tokens, completion_tokens, total_tokens, latency, content_ref, prompt_refs, payload_ref FROM calls",
+    'blobs': "SELECT ref, data FROM blobs",
+    'sections': "SELECT name FROM sections"
+}
+
+def record_call(taxonomy, i):
+    message = AIMessage(content = f"Answer {i}, " + "word " * 50,
+                        response_metadata = {'token_usage': {'prompt_tokens': 10, 'completion_tokens': 20, 'total_tokens': 30}})
+    taxonomy.record_response('get_property_groups', message, 0.01, [HumanMessage(content = f"Question {i}")])
+
+def rows(repository):
+    return {table: sorted(repository.connection.execute(sql).fetchall(), key = repr) for table, sql in TABLES.items()}
+
+@pytest.fixture
+def built(role_models, tmp_path):
+    taxonomy = create_taxonomy(role_models['generate new'], role_models['verify'], "Transistor", save_path = str(tmp_path))
+    taxonomy = generate_subconcepts_for_all_ranks(role_models['generate new'], role_models['re-generate'], taxonomy, 1, 5)
+    return integrate_subconcepts(role_models['integrate'], taxonomy)
+
+def test_save_and_load_round_trip(built, tmp_path):
+    repository = TaxonomyRepository(str(tmp_path / "taxonomies.sqlite"))
+    repository.save(built)
+    loaded = Taxonomy.load(built.name, repository = TaxonomyRepository(repository.db_path))
+    assert (loaded.root_concept, loaded.created_at) == (built.root_concept, built.created_at)
+    assert loaded.ranks == built.ranks
+    assert loaded.subconcepts_trees == built.subconcepts_trees
+    assert loaded.hierarchies == built.hierarchies and loaded.missing == built.missing
+    assert loaded.property_groups == built.property_groups
+    assert [(v.template_id, v.content, v.prompt, v.token_usage) for v in loaded.responses] == \
+           [(v.template_id, v.content, v.prompt, v.token_usage) for v in built.responses]
+    partial = repository.load(built.name, sections = ['ranks'])
+    assert partial.ranks == built.ranks and partial.loaded_sections == ['ranks']
+    assert repository.rank_lists(built.name) == built.ranks
+    assert repository.find_ranks(built.ranks[0][0])
+
+def test_incremental_saves_write_the_same_rows_as_a_full_save(built, tmp_path):
+    incremental = TaxonomyRepository(str(tmp_path / "incremental.sqlite"))
+    taxonomy = Taxonomy("Transistor")
+    for i in range(20):
+        record_call(taxonomy, i)
+        incremental.save(taxonomy)
+    taxonomy.ranks = [["Material", "Function"]]
+    taxonomy.depths = [1]
+    taxonomy.subconcepts_plain = [["Silicon", "Germanium"]]
+    taxonomy.subconcepts_trees = [{"Material": ["Silicon", "Germanium"]}]
+    incremental.save(taxonomy)
+    full = TaxonomyRepository(str(tmp_path / "full.sqlite"))
+    full.save(taxonomy)
+    assert rows(incremental) == rows(full)
+
+def test_per_call_saves_write_only_the_new_call(tmp_path):
+    repository = TaxonomyRepository(str(tmp_path / "taxonomies.sqlite"))
+    taxonomy = Taxonomy("Transistor")
+    changes = []
+    for i in range(200):
+        record_call(taxonomy, i)
+        before = repository.connection.total_changes
+        repository.save(taxonomy)
+        changes.append(repository.connection.total_changes - before)
+    # Taxonomy row, metadata and responses sections, one call and its two new blobs
+    assert max(changes[1:]) <= 6
+    assert len(repository.load(taxonomy.name).responses) == 200
+
+def test_save_refuses_another_taxonomy_with_the_same_name(tmp_path):
+    repository = TaxonomyRepository(str(tmp_path / "taxonomies.sqlite"))
+    alpha, beta = Taxonomy("Alpha"), Taxonomy("Beta")
+    beta.name = alpha.name
+    repository.save(alpha)
+    with pytest.raises(ValueError):
+        repository.save(beta)
+    with pytest.raises(ValueError):
+        TaxonomyRepository(repository.db_path).save(beta)
+    assert repository.load(alpha.name).root_concept == "Alpha"
+    repository.save(beta, overwrite = True)
+    assert repository.load(alpha.name).root_concept == "Beta"
@@ -0,0 +1,58 @@
+import time
+import asyncio
+
+import pytest
+
+from src.routing import Backend, init_router
+from src.stub_server import StubServer
+
+@pytest.fixture
+def servers():
+    with StubServer(error_rate = 1.0) as failing, StubServer(delay = 0.02) as healthy:
+        yield failing, healthy
+
+def router_for(servers, **backend_options):
+    failing, healthy = servers
+    backends = [{'name': name, 'base_url': server.base_url, 'api_key': "stub", **backend_options}
+                for name, server in (('failing', failing), ('healthy', healthy))]
+    return init_router('verify', backends, seed = 0)
+
+def test_failed_calls_do_not_lower_the_latency_estimate():
+    backend = Backend('failing', None)
+    backend.finish(backend.start(), error = RuntimeError("500"))
+    assert backend.latency_ewma is None
+    assert backend.errors == 1
+
+def test_routes_away_from_fast_failing_backend(servers):
+    failing, healthy = servers
+    router = router_for(servers)
+    for i in range(50):
+        assert router.invoke("Hello").content
+    metrics = router.metrics()
+    # Only the calls until the circuit opened paid a failed round trip
+    assert metrics['failovers'] == 3
+    assert metrics['backends']['failing']['circuit'] == 'open'
+    assert failing.requests == 3
+    assert healthy.requests == 50
+
+def test_async_failover(servers):
+    router = router_for(servers)
+
+    async def run():
+        return await asyncio.gather(*(router.ainvoke("Hello") for i in range(20)))
+
+    assert all(response.content for response in asyncio.run(run()))
+    assert router.metrics()['backends']['failing']['circuit'] == 'open'
+
+def test_half_open_probe_closes_circuit_after_recovery(servers):
+    failing, healthy = servers
+    router = router_for(servers, cooldown = 0.5)
+    for i in range(3):
+        router.invoke("Hello")
+    assert router.metrics()['backends']['failing']['circuit'] == 'open'
+    failing.error_rate = 0.0
+    time.sleep(0.6)
+    requests = failing.requests
+    router.invoke("Hello")
+    assert failing.requests == requests + 1
+    assert router.metrics()['backends']['failing']['circuit'] == 'closed'
@@ -0,0 +1,59 @@
+import os
+
+from conftest import stub_role_models
+from src.models import Taxonomy
+from src.service import JobQueue, Worker
+
+def expire_leases(queue):
+    with queue.lock:
+        queue.connection.execute("UPDATE jobs SET heartbeat_at = '2000-01-01T00:00:00' WHERE status = 'running'")
+
+def test_expired_lease_is_reclaimed_and_stale_worker_cannot_finish(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("Transistor")
+    assert queue.claim("worker-1")['id'] == job_id
+    assert queue.requeue_expired(60) == 0
+    expire_leases(queue)
+    assert queue.requeue_expired(60) == 1
+    assert queue.get(job_id)['status'] == 'queued'
+    assert queue.claim("worker-2")['worker'] == "worker-2"
+    # The first worker comes back after its lease was taken over
+    assert not queue.complete(job_id, "stale.trx", "worker-1")
+    assert not queue.fail(job_id, "RuntimeError: stale", "worker-1")
+    job = queue.get(job_id)
+    assert (job['status'], job['worker'], job['result_path'], job['error']) == ('running', "worker-2", None, None)
+    assert queue.complete(job_id, "fresh.trx", "worker-2")
+    job = queue.get(job_id)
+    assert (job['status'], job['result_path']) == ('done', "fresh.trx")
+    assert not queue.complete(job_id, "again.trx", "worker-2")
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("Transistor")
+    queue.claim("worker-1")
+    expire_leases(queue)
+    assert queue.heartbeat("worker-1") == 1
+    assert queue.heartbeat("worker-2") == 0
+    assert queue.requeue_expired(60) == 0
+    assert queue.get(job_id)['status'] == 'running'
+
+def test_restarted_worker_requeues_its_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_id = queue.submit("Transistor")
+    queue.claim("worker-1")
+    assert queue.requeue("worker-2") == 0
+    assert queue.requeue("worker-1") == 1
+    assert queue.get(job_id)['status'] == 'queued'
+
+def test_worker_runs_jobs_against_stub_server(stub_server, tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_ids = [queue.submit(concept, owner, stop_at_depth = 1, max_subconcepts_per_iteration = 5) for concept, owner in (("Alpha", "a"), ("Beta", "b"))]
+    models = stub_role_models(stub_server)
+    worker = Worker(queue, max_jobs = 2, poll_interval = 0.05, results_path = str(tmp_path / "jobs"), worker_id = "worker-1",
+                    models = tuple(models[role] for role in ('generate new', 're-generate', 'verify', 'integrate')))
+    worker.run(until_empty = True)
+    for job_id, concept in zip(job_ids, ("Alpha", "Beta")):
+        job = queue.get(job_id)
+        assert job['status'] == 'done', job['error']
+        assert os.path.dirname(job['result_path']) == str(tmp_path / "jobs" / f"job_{job_id}")
+        assert Taxonomy.load(job['result_path']).root_concept == concept
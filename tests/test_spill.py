@@ -0,0 +1,23 @@
+from src.blobs import BlobStore
+from src.spill import SpillList, spill_to_cap
+
+def test_item_grown_in_place_is_measured_again_and_spilled():
+    # The workflow appends to the level lists it got from the SpillList
+    spill_list = SpillList(BlobStore(), [[]])
+    spill_to_cap([spill_list], 1000)
+    levels = spill_list[0]
+    for i in range(200):
+        levels.append(f"subconcept {i}")
+    resident = spill_to_cap([spill_list], 1000)
+    assert spill_list.is_spilled(0), f"item grown in place stayed resident ({resident} bytes counted)"
+    assert spill_list[0] == levels
+
+def test_pinned_items_stay_resident():
+    spill_list = SpillList(BlobStore(), [["a" * 500], ["b" * 500], ["c" * 500]])
+    spill_list.pin(2)
+    spill_to_cap([spill_list], 0)
+    assert [spill_list.is_spilled(i) for i in range(3)] == [True, True, False]
+    spill_list.unpin(2)
+    spill_to_cap([spill_list], 0)
+    assert spill_list.is_spilled(2)
+    assert list(spill_list) == [["a" * 500], ["b" * 500], ["c" * 500]]
@@ -0,0 +1,50 @@
+import os
+
+from langchain_core.messages import AIMessage
+
+from src.models import Taxonomy
+from src.repository import TaxonomyRepository
+from src.taxonomy_file import read_sections, write_sections
+
+def sample_taxonomy(save_path) -> Taxonomy:
+    taxonomy = Taxonomy("Transistor", str(save_path))
+    taxonomy.record_response('get_property_groups', AIMessage(content = "Physical properties; electrical properties"))
+    taxonomy.property_groups = taxonomy.responses[-1].content
+    taxonomy.key_aspects = "Switching and amplification"
+    taxonomy.add_missing("Hierarchy 1: by material;")
+    taxonomy.hierarchies = ["Hierarchy 1: by material;"]
+    return taxonomy
+
+def test_text_fields_are_stored_once_as_references(tmp_path):
+    taxonomy = sample_taxonomy(tmp_path)
+    path = taxonomy.save()
+    hierarchies = read_sections(path, ['hierarchies'])[1]['hierarchies']
+    assert "Switching and amplification" not in repr(hierarchies)
+    assert set(hierarchies['_text_refs'].values()) <= set(taxonomy.blobs.chunks)
+    loaded = Taxonomy.load(path)
+    assert loaded.property_groups == "Physical properties; electrical properties"
+    assert loaded.key_aspects == "Switching and amplification"
+    assert loaded.missing == ("Hierarchy 1: by material;",)
+
+def test_partial_load_without_responses_resolves_text(tmp_path):
+    taxonomy = sample_taxonomy(tmp_path)
+    path = taxonomy.save()
+    partial = Taxonomy.load(path, sections = ['hierarchies'])
+    assert partial.key_aspects == "Switching and amplification"
+    assert partial.missing == ("Hierarchy 1: by material;",)
+    assert partial.responses == []
+    repository = TaxonomyRepository(os.path.join(tmp_path, "taxonomies.sqlite"))
+    repository.save(taxonomy)
+    partial = repository.load(taxonomy.name, sections = ['hierarchies'])
+    assert partial.property_groups == "Physical properties; electrical properties"
+    assert partial.missing == ("Hierarchy 1: by material;",)
+
+def test_files_with_plain_text_fields_still_load(tmp_path):
+    taxonomy = sample_taxonomy(tmp_path)
+    sections = taxonomy.to_sections()
+    sections['hierarchies'] = Taxonomy.resolve_text_refs(sections['hierarchies'], taxonomy.blobs)
+    path = os.path.join(tmp_path, "plain.trx")
+    write_sections(path, taxonomy.summary(), sections)
+    for loaded in (Taxonomy.load(path), Taxonomy.load(path, sections = ['hierarchies'])):
+        assert loaded.key_aspects == "Switching and amplification"
+        assert loaded.missing == ("Hierarchy 1: by material;",)